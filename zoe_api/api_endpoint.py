@@ -18,6 +18,7 @@
 from datetime import timedelta, datetime
 import logging
 import os
+import threading
 from typing import List, Union
 
 import zoe_api.exceptions
@@ -26,6 +27,8 @@ import zoe_lib.applications
 import zoe_lib.exceptions
 import zoe_lib.state
 from zoe_lib.config import get_conf
+import zoe_master.backends.interface
+import zoe_master.exceptions
 
 log = logging.getLogger(__name__)
 
@@ -40,10 +43,18 @@ class APIEndpoint:
     def __init__(self, master_api, sql_manager: zoe_lib.state.sql_manager.SQLManager):
         self.master = master_api
         self.sql = sql_manager
+        self._sessions = threading.local()
+
+    def _session(self) -> zoe_lib.state.sql_manager.SQLManager:
+        """The database connection of the calling thread for submissions, their row locks must not be released by commits of other threads."""
+        sql = getattr(self._sessions, 'sql', None)
+        if sql is None:
+            sql = self._sessions.sql = self.sql.session()
+        return sql
 
     def execution_by_id(self, user: Union[None, zoe_lib.state.User], execution_id: int) -> zoe_lib.state.Execution:
         """Lookup an execution by its ID."""
-        e = self.sql.executions.select(id=execution_id, only_one=True)
+        e = self.sql.executions.select(id=execution_id, only_one=True, history=True)
         if e is None:
             raise zoe_api.exceptions.ZoeNotFoundException('No such execution')
         assert isinstance(e, zoe_lib.state.Execution)
@@ -51,18 +62,29 @@ class APIEndpoint:
             raise zoe_api.exceptions.ZoeAuthException()
         return e
 
+    @staticmethod
+    def _include_history(filters):
+        """Archived executions are all terminated, there is no need to look for them when filtering on other statuses."""
+        return filters.get('status') in (None, zoe_lib.state.Execution.TERMINATED_STATUS, zoe_lib.state.Execution.ERROR_STATUS)
+
     def execution_list(self, user: zoe_lib.state.User, **filters):
         """Generate a optionally filtered list of executions."""
         if not user.role.can_operate_others:
             filters['user_id'] = user.id
-        execs = self.sql.executions.select(**filters)
+        execs = self.sql.executions.select(history=self._include_history(filters), **filters)
         return execs
 
+    def execution_stream(self, user: zoe_lib.state.User, **filters):
+        """Iterate over an optionally filtered list of executions, for unbounded listings."""
+        if not user.role.can_operate_others:
+            filters['user_id'] = user.id
+        return self.sql.executions.stream(history=self._include_history(filters), **filters)
+
     def execution_count(self, user: zoe_lib.state.User, **filters):
         """Count the number of executions optionally filtered."""
         if not user.role.can_operate_others:
             filters['user_id'] = user.id
-        return self.sql.executions.count(**filters)
+        return self.sql.executions.count(history=self._include_history(filters), **filters)
 
     def zapp_validate(self, application_description):
         """Validates the passed ZApp description against the supported schema."""
@@ -71,27 +93,18 @@ class APIEndpoint:
         except zoe_lib.exceptions.InvalidApplicationDescription as e:
             raise zoe_api.exceptions.ZoeRestAPIException('Invalid application description: {}'.format(e.message), status_code=400)
 
-    def _check_quota(self, user: zoe_lib.state.User, application_description):
-        """Check quota for given user and execution."""
-        quota = self.sql.quota.select(only_one=True, **{'id': user.quota_id})
-
-        running_execs = self.sql.executions.select(**{'status': 'running', 'user_id': user.id})
-        running_execs += self.sql.executions.select(**{'status': 'starting', 'user_id': user.id})
-        running_execs += self.sql.executions.select(**{'status': 'queued', 'user_id': user.id})
-        running_execs += self.sql.executions.select(**{'status': 'image download', 'user_id': user.id})
-        running_execs += self.sql.executions.select(**{'status': 'submitted', 'user_id': user.id})
-        if quota.concurrent_executions != 0 and len(running_execs) >= quota.concurrent_executions:
-            raise zoe_api.exceptions.ZoeQuotaException('You cannot run more than {} executions at a time, quota exceeded.'.format(quota.concurrent_executions))
-
-        if quota.cores == 0 and quota.memory == 0:
+    def _check_quota(self, sql: zoe_lib.state.sql_manager.SQLManager, user: zoe_lib.state.User, application_description):
+        """Check quota for given user and execution. The user row stays locked until the caller commits or rolls back."""
+        quota = user.quota
+        if quota.concurrent_executions == 0 and quota.cores == 0 and quota.memory == 0:
             return
 
-        reserved_cores = 0
-        reserved_mem = 0
-        for e in running_execs:
-            for service in e.services:
-                reserved_cores += service.resource_reservation.cores.min
-                reserved_mem += service.resource_reservation.memory.min
+        # Concurrent submissions by the same user, also in other API processes, wait here so that each one sees the executions inserted by the others
+        sql.user.lock(user.id)
+        active_count, reserved_cores, reserved_mem = sql.executions.active_usage(user.id)
+
+        if quota.concurrent_executions != 0 and active_count >= quota.concurrent_executions:
+            raise zoe_api.exceptions.ZoeQuotaException('You cannot run more than {} executions at a time, quota exceeded.'.format(quota.concurrent_executions))
 
         new_exec_cores = 0
         new_exec_memory = 0
@@ -112,9 +125,14 @@ class APIEndpoint:
             log.info('Invalid application description: {}'.format(e.message))
             raise zoe_api.exceptions.ZoeRestAPIException('Invalid application description')
 
-        self._check_quota(user, application_description)
+        sql = self._session()
+        try:
+            self._check_quota(sql, user, application_description)
+        except Exception:
+            sql.rollback()  # release the lock on the user
+            raise
 
-        new_id = self.sql.executions.insert(exec_name, user.id, application_description)
+        new_id = sql.executions.insert(exec_name, user.id, application_description)  # commits, releasing the lock on the user
         success, message = self.master.execution_start(new_id)
         if not success:
             raise zoe_api.exceptions.ZoeRestAPIException('The Zoe master is unavailable, execution will be submitted automatically when the master is back up ({}).'.format(message), status_code=503)
@@ -143,10 +161,10 @@ class APIEndpoint:
         if not user.role.can_delete_executions:
             raise zoe_api.exceptions.ZoeAuthException()
 
-        e = self.sql.executions.select(id=exec_id, only_one=True)
-        assert isinstance(e, zoe_lib.state.Execution)
+        e = self.sql.executions.select(id=exec_id, only_one=True, history=True)
         if e is None:
             raise zoe_api.exceptions.ZoeNotFoundException('No such execution')
+        assert isinstance(e, zoe_lib.state.Execution)
 
         if e.user_id != user.id and not user.role.can_operate_others:
             raise zoe_api.exceptions.ZoeAuthException('You are not authorized to terminate this execution')
@@ -156,13 +174,13 @@ class APIEndpoint:
 
         status, message = self.master.execution_delete(exec_id)
         if status:
-            self.sql.executions.delete(exec_id)
+            self.sql.executions.delete(exec_id, history=e.archived)
         else:
             raise zoe_api.exceptions.ZoeRestAPIException(message)
 
     def service_by_id(self, user: zoe_lib.state.User, service_id: int) -> zoe_lib.state.Service:
         """Lookup a service by its ID."""
-        service = self.sql.services.select(id=service_id, only_one=True)
+        service = self.sql.services.select(id=service_id, only_one=True, history=True)
         if service is None:
             raise zoe_api.exceptions.ZoeNotFoundException('No such execution')
         if service.user_id != user.id and not user.role.can_operate_others:
@@ -179,7 +197,7 @@ class APIEndpoint:
         """Retrieve the logs for the given service.
         If stream is True, a file object is returned, otherwise the log contents as a str object.
         """
-        service = self.sql.services.select(id=service_id, only_one=True)
+        service = self.sql.services.select(id=service_id, only_one=True, history=True)
         if service is None:
             raise zoe_api.exceptions.ZoeNotFoundException('No such service')
         if service.user_id != user.id and not user.role.can_operate_others:
@@ -190,6 +208,22 @@ class APIEndpoint:
             raise zoe_api.exceptions.ZoeNotFoundException('Service log not available')
         return open(path, encoding='utf-8')
 
+    def service_log_stream(self, user: zoe_lib.state.User, service_id, since=None, tail='all', follow=False):
+        """Stream the logs of a service directly from its container, as byte chunks. Returns None if they cannot be streamed, for example because the container does not exist anymore or its back-end cannot stream logs."""
+        service = self.sql.services.select(id=service_id, only_one=True, history=True)
+        if service is None:
+            raise zoe_api.exceptions.ZoeNotFoundException('No such service')
+        if service.user_id != user.id and not user.role.can_operate_others:
+            raise zoe_api.exceptions.ZoeAuthException()
+
+        if service.archived or service.backend_id is None:
+            return None
+        try:
+            return zoe_master.backends.interface.service_log_stream(service, since, tail, follow)
+        except zoe_master.exceptions.ZoeException as e:
+            log.debug('Cannot stream the logs of service {} from the back-end: {}'.format(service_id, e))
+            return None
+
     def statistics_scheduler(self):
         """Retrieve statistics about the scheduler."""
         success, message = self.master.scheduler_statistics()
@@ -411,19 +445,54 @@ class APIEndpoint:
 
         self.sql.quota.update(quota_id, **quota_data)
 
-    def verify_runtime_limit(self):
-        """Scan the active executions and kill all those that exceed the runtime_limit quota."""
-        running_execs = self.sql.executions.select(**{'status': 'running'})
-        running_execs += self.sql.executions.select(**{'status': 'starting'})
-        running_execs += self.sql.executions.select(**{'status': 'queued'})
-        running_execs += self.sql.executions.select(**{'status': 'image download'})
-        running_execs += self.sql.executions.select(**{'status': 'submitted'})
-
-        for e in running_execs:
-            runtime_limit = e.owner.quota.runtime_limit
-            if runtime_limit == 0:
-                continue
-            runtime_limit = timedelta(hours=runtime_limit)
-            if e.time_submit + runtime_limit < datetime.utcnow():
-                log.info('Automatically terminating execution {} that has exceeded the run time limit'.format(e.id))
-                self.execution_terminate(e.owner, e.id, 'Run time quota exceeded')
+    def archive_start(self, user: zoe_lib.state.User, older_than_days=None):
+        """Start moving old terminated executions to the history tables, in the background."""
+        if not user.role.can_change_config:
+            raise zoe_api.exceptions.ZoeAuthException()
+
+        if older_than_days is None:
+            older_than_days = get_conf().archive_age
+        if older_than_days <= 0:
+            raise zoe_api.exceptions.ZoeRestAPIException('The archival age must be a positive number of days')
+        cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+
+        th = threading.Thread(target=self._archive_thread, name='archive', args=(cutoff,), daemon=True)
+        th.start()
+        return cutoff
+
+    @staticmethod
+    def _archive_thread(cutoff):
+        """The archival runs on its own connection, to not hold up the API requests."""
+        sql = zoe_lib.state.SQLManager(get_conf())
+        try:
+            if sql.archive.archive(cutoff) is None:
+                log.warning('Another archival run is in progress')
+        except Exception:
+            log.exception('Archival of executions that ended before {} failed'.format(cutoff))
+        finally:
+            sql.close()
+
+    def images_warm(self, user: zoe_lib.state.User, images):
+        """Start pulling images on all nodes, in the background."""
+        if not user.role.can_change_config:
+            raise zoe_api.exceptions.ZoeAuthException()
+
+        success, message = self.master.images_warm(images)
+        if not success:
+            raise zoe_api.exceptions.ZoeRestAPIException('The Zoe master is unavailable, images cannot be warmed ({}).'.format(message), status_code=503)
+
+    def image_pulls(self, user: zoe_lib.state.User):
+        """List the image pulls in progress and the ones finished recently."""
+        if not user.role.can_change_config:
+            raise zoe_api.exceptions.ZoeAuthException()
+
+        success, message = self.master.image_pulls()
+        if not success:
+            raise zoe_api.exceptions.ZoeException(message=message)
+        return message
+
+    def archive_list(self, user: zoe_lib.state.User, limit=-1):
+        """List the archival runs, most recent first."""
+        if not user.role.can_change_config:
+            raise zoe_api.exceptions.ZoeAuthException()
+        return self.sql.archive.select(limit=limit)
@@ -19,7 +19,7 @@ import logging
 import os
 
 from tornado.httpserver import HTTPServer
-from tornado.ioloop import IOLoop, PeriodicCallback
+from tornado.ioloop import IOLoop
 from tornado.web import Application
 
 import zoe_lib.config
@@ -76,9 +76,6 @@ def zoe_web_main(test_conf=None) -> int:
     http_server.bind(args.listen_port, args.listen_address)
     http_server.start(num_processes=1)
 
-    runtime_limit_cb = PeriodicCallback(api_endpoint.verify_runtime_limit, 300000)
-    runtime_limit_cb.start()
-
     try:
         IOLoop.current().start()
     except KeyboardInterrupt:
@@ -109,3 +109,18 @@ class APIManager:
             'command': 'scheduler_stats'
         }
         return self._request_reply(msg)
+
+    def images_warm(self, images) -> APIReturnType:
+        """Start pulling images on all nodes."""
+        msg = {
+            'command': 'images_warm',
+            'images': images
+        }
+        return self._request_reply(msg)
+
+    def image_pulls(self) -> APIReturnType:
+        """Query the image pulls in progress."""
+        msg = {
+            'command': 'image_pulls'
+        }
+        return self._request_reply(msg)
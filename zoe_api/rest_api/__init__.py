@@ -29,6 +29,8 @@ from zoe_api.rest_api.discovery import DiscoveryAPI
 from zoe_api.rest_api.statistics import SchedulerStatsAPI
 from zoe_api.rest_api.login import LoginAPI
 from zoe_api.rest_api.validation import ZAppValidateAPI
+from zoe_api.rest_api.archive import ArchiveAPI
+from zoe_api.rest_api.images import ImagesAPI
 
 import zoe_lib.config
 from zoe_lib.version import ZOE_API_VERSION
@@ -64,6 +66,10 @@ def api_init(api_endpoint) -> List[tornado.web.URLSpec]:
         tornado.web.url(api_path + r'/service/([0-9]+)', ServiceAPI, route_args),
         tornado.web.url(api_path + r'/service/logs/([0-9]+)', ServiceLogsAPI, route_args),
 
+        tornado.web.url(api_path + r'/archive', ArchiveAPI, route_args),
+
+        tornado.web.url(api_path + r'/images', ImagesAPI, route_args),
+
         tornado.web.url(api_path + r'/discovery/by_group/([0-9]+)/([a-z0-9A-Z\-]+)', DiscoveryAPI, route_args),
 
         tornado.web.url(api_path + r'/statistics/scheduler', SchedulerStatsAPI, route_args)
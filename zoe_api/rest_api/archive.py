@@ -0,0 +1,75 @@
+# Copyright (c) 2018, Daniele Venzano
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""The Archive API endpoints."""
+
+import tornado.escape
+
+from zoe_api.rest_api.request_handler import ZoeAPIRequestHandler
+from zoe_api.exceptions import ZoeException
+
+
+class ArchiveAPI(ZoeAPIRequestHandler):
+    """The Archive API endpoint. Moves old terminated executions to the history tables."""
+
+    def get(self):
+        """HTTP GET method, lists the archival runs."""
+        if self.current_user is None:
+            return
+
+        try:
+            limit = int(self.get_argument('limit', '-1'))
+        except ValueError:
+            self.set_status(400, "Parameter must be an integer")
+            return
+
+        try:
+            runs = self.api_endpoint.archive_list(self.current_user, limit)
+        except ZoeException as e:
+            self.set_status(e.status_code, e.message)
+            return
+
+        self.write({r.id: r.serialize() for r in runs})
+
+    def post(self):
+        """HTTP POST method, starts an archival run in the background."""
+        if self.current_user is None:
+            return
+
+        if len(self.request.body) > 0:
+            try:
+                data = tornado.escape.json_decode(self.request.body)
+            except ValueError:
+                self.set_status(400, 'Error decoding JSON data')
+                return
+        else:
+            data = {}
+
+        try:
+            older_than_days = data.get('older_than_days', None)
+            if older_than_days is not None:
+                older_than_days = int(older_than_days)
+        except (AttributeError, ValueError):
+            self.set_status(400, 'Error decoding JSON data')
+            return
+
+        try:
+            cutoff = self.api_endpoint.archive_start(self.current_user, older_than_days)
+        except ZoeException as e:
+            self.set_status(e.status_code, e.message)
+            return
+
+        self.set_status(202)
+        self.write({'cutoff': cutoff.isoformat()})
@@ -15,11 +15,27 @@
 
 """The Execution API endpoints."""
 
+from concurrent.futures import ThreadPoolExecutor
+import itertools
+import logging
+
 import tornado.escape
+import tornado.gen
+import tornado.iostream
 
 from zoe_api.rest_api.request_handler import ZoeAPIRequestHandler
 from zoe_api.exceptions import ZoeException
 
+log = logging.getLogger(__name__)
+
+# The listings share the database connection of the API, more threads would only wait for it
+THREAD_POOL = ThreadPoolExecutor(4)
+
+
+def _next_batch(execs, size):
+    """Read and serialize the next executions of a stream, in a thread of the pool."""
+    return ['"{}": {}'.format(e.id, tornado.escape.json_encode(e.serialize())) for e in itertools.islice(execs, size)]
+
 
 class ExecutionAPI(ZoeAPIRequestHandler):
     """The Execution API endpoint."""
@@ -91,7 +107,9 @@ class ExecutionDeleteAPI(ZoeAPIRequestHandler):
 
 class ExecutionCollectionAPI(ZoeAPIRequestHandler):
     """The Execution Collection API endpoints."""
+    STREAM_FLUSH_COUNT = 500
 
+    @tornado.gen.coroutine
     def get(self):
         """
         Returns a list of all active executions.
@@ -102,6 +120,7 @@ class ExecutionCollectionAPI(ZoeAPIRequestHandler):
         * name: execution mane
         * user_id: user_id owning the execution (admin only)
         * limit: limit the number of returned entries
+        * before_id: only executions with an ID lower than this, pass the smallest ID of the previous page to paginate
         * earlier_than_submit: all execution that where submitted earlier than this timestamp
         * earlier_than_start: all execution that started earlier than this timestamp
         * earlier_than_end: all execution that ended earlier than this timestamp
@@ -111,6 +130,8 @@ class ExecutionCollectionAPI(ZoeAPIRequestHandler):
 
         All timestamps should be passed as number of seconds since the epoch (UTC timezone).
 
+        Without a limit the executions are streamed to the client as they are read from the database.
+
         example:  curl -u 'username:password' -X GET 'http://bf5:8080/api/0.6/execution?limit=1&status=terminated'
 
         :return:
@@ -125,6 +146,7 @@ class ExecutionCollectionAPI(ZoeAPIRequestHandler):
             ('name', str),
             ('user_id', str),
             ('limit', int),
+            ('before_id', int),
             ('earlier_than_submit', int),
             ('earlier_than_start', int),
             ('earlier_than_end', int),
@@ -139,6 +161,10 @@ class ExecutionCollectionAPI(ZoeAPIRequestHandler):
                 else:
                     filt_dict[filt[0]] = filt[1](self.request.arguments[filt[0]][0])
 
+        if 'limit' not in filt_dict:
+            yield self._write_stream(self.api_endpoint.execution_stream(self.current_user, **filt_dict))
+            return
+
         try:
             execs = self.api_endpoint.execution_list(self.current_user, **filt_dict)
         except ZoeException as e:
@@ -147,6 +173,38 @@ class ExecutionCollectionAPI(ZoeAPIRequestHandler):
 
         self.write({e.id: e.serialize() for e in execs})
 
+    @tornado.gen.coroutine
+    def _write_stream(self, execs):
+        """
+        Write the same JSON dictionary as the paginated listing, one batch of executions at a time.
+
+        The executions are read from the database in a thread, each batch is flushed before the next one is read. If the database fails after the
+        response has started the connection is closed, so that the client does not take a truncated dictionary for a complete one.
+        """
+        try:
+            batch = yield THREAD_POOL.submit(_next_batch, execs, self.STREAM_FLUSH_COUNT)
+            self.set_header('Content-Type', 'application/json; charset=UTF-8')
+            self.write('{')
+            first = True
+            while len(batch) > 0:
+                if not first:
+                    self.write(',')
+                first = False
+                self.write(','.join(batch))
+                yield self.flush()
+                batch = yield THREAD_POOL.submit(_next_batch, execs, self.STREAM_FLUSH_COUNT)
+            self.write('}')
+        except tornado.iostream.StreamClosedError:
+            log.debug('Client closed the connection during an execution listing')
+        except Exception:  # pylint: disable=broad-except
+            log.exception('Error streaming the execution list')
+            if self._headers_written:
+                self.request.connection.close()
+            else:
+                self.send_error(500)
+        finally:
+            yield THREAD_POOL.submit(execs.close)  # closes the database cursor
+
     def post(self):
         """
         Starts an execution, given an application description. Takes a JSON object.
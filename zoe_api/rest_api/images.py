@@ -0,0 +1,61 @@
+# Copyright (c) 2018, Daniele Venzano
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""The Images API endpoints."""
+
+import tornado.escape
+
+from zoe_api.rest_api.request_handler import ZoeAPIRequestHandler
+from zoe_api.exceptions import ZoeException
+
+
+class ImagesAPI(ZoeAPIRequestHandler):
+    """The Images API endpoint. Distributes images to the nodes before executions need them."""
+
+    def get(self):
+        """HTTP GET method, lists the image pulls in progress and the ones finished recently."""
+        if self.current_user is None:
+            return
+
+        try:
+            pulls = self.api_endpoint.image_pulls(self.current_user)
+        except ZoeException as e:
+            self.set_status(e.status_code, e.message)
+            return
+
+        self.write({'pulls': pulls})
+
+    def post(self):
+        """HTTP POST method, starts pulling images on all nodes."""
+        if self.current_user is None:
+            return
+
+        try:
+            data = tornado.escape.json_decode(self.request.body)
+            images = data['images']
+            if not isinstance(images, list) or not all(isinstance(image, str) for image in images):
+                raise ValueError
+        except (ValueError, KeyError, TypeError):
+            self.set_status(400, 'Error decoding JSON data')
+            return
+
+        try:
+            self.api_endpoint.images_warm(self.current_user, images)
+        except ZoeException as e:
+            self.set_status(e.status_code, e.message)
+            return
+
+        self.set_status(202)
+        self.write({'images': images})
@@ -23,11 +23,18 @@ import tornado.iostream
 
 from zoe_api.rest_api.request_handler import ZoeAPIRequestHandler
 from zoe_api.exceptions import ZoeException
+import zoe_master.exceptions
 
 log = logging.getLogger(__name__)
 
 THREAD_POOL = ThreadPoolExecutor(20)
 
+# A followed log keeps a thread waiting for the next line of the container, followed logs get their own threads so that they cannot take
+# all the threads used by the other requests, beyond this limit new followed logs are refused
+MAX_FOLLOWED_LOGS = 20
+FOLLOW_THREAD_POOL = ThreadPoolExecutor(MAX_FOLLOWED_LOGS)
+_followed_logs = 0  # only changed in the IOLoop thread
+
 
 class ServiceAPI(ZoeAPIRequestHandler):
     """The Service API endpoint."""
@@ -61,26 +68,57 @@ class ServiceLogsAPI(ZoeAPIRequestHandler):
         self.service_id = None
         self.stream = None
         self.log_obj = None
+        self.log_chunks = None
+
+    def _log_parameters(self):
+        since = self.get_argument('since', None)
+        if since is not None:
+            since = int(since)
+        tail = self.get_argument('tail', 'all')
+        if tail != 'all':
+            tail = int(tail)
+        follow = self.get_argument('follow', 'true').lower() in ('true', '1', 'yes')
+        return since, tail, follow
 
     def on_connection_close(self):
         """Tornado callback for clients closing the connection."""
         log.debug('Finished log stream for service {}'.format(self.service_id))
         self.connection_closed = True
+        if self.log_chunks is not None:
+            self.log_chunks.close()  # wakes up the thread waiting for the next chunk
         self.finish()
 
     @tornado.gen.coroutine
     def get(self, service_id):
-        """HTTP GET method."""
+        """
+        HTTP GET method.
+
+        The logs are streamed from the container with chunked transfer encoding, the since (UNIX timestamp), tail (number of lines) and
+        follow (true or false) arguments select what is sent. When the container is gone, the log file written by the GELF listener is sent instead.
+        """
         if self.current_user is None:
             return
 
         try:
             service_id = int(service_id)
+            since, tail, follow = self._log_parameters()
         except ValueError:
             self.set_status(400, "Parameter must be an integer")
+            return
+
+        self.service_id = service_id
+        try:  # the database query and the connection to the engine block, they do not run in the IOLoop thread
+            log_chunks = yield THREAD_POOL.submit(self.api_endpoint.service_log_stream, self.current_user, service_id, since, tail, follow)
+        except ZoeException as e:
+            self.set_status(e.status_code, e.message)
+            return
+
+        if log_chunks is not None:
+            yield self._send_chunks(log_chunks, follow)
+            return
 
         try:
-            log_obj = self.api_endpoint.service_logs(self.current_user, service_id)
+            log_obj = yield THREAD_POOL.submit(self.api_endpoint.service_logs, self.current_user, service_id)
         except ZoeException as e:
             self.set_status(e.status_code, e.message)
             return
@@ -98,3 +136,38 @@ class ServiceLogsAPI(ZoeAPIRequestHandler):
                 yield self.flush()
             except tornado.iostream.StreamClosedError:
                 break
+
+    @tornado.gen.coroutine
+    def _send_chunks(self, log_chunks, follow):
+        """Relay the chunks as they come, only one is held in memory at a time."""
+        global _followed_logs  # pylint: disable=global-statement
+        self.log_chunks = log_chunks
+        if follow:
+            if _followed_logs >= MAX_FOLLOWED_LOGS:
+                log_chunks.close()
+                self.log_chunks = None
+                self.set_status(503, 'Too many followed logs, retry later or do not follow the log')
+                return
+            _followed_logs += 1
+            pool = FOLLOW_THREAD_POOL
+        else:
+            pool = THREAD_POOL
+        try:
+            while not self.connection_closed:
+                try:
+                    chunk = yield pool.submit(next, log_chunks, None)
+                except zoe_master.exceptions.ZoeException as e:
+                    log.warning(str(e))
+                    break
+                if chunk is None or self.connection_closed:
+                    break
+                self.write(chunk)
+                try:
+                    yield self.flush()
+                except tornado.iostream.StreamClosedError:
+                    break
+        finally:
+            if follow:
+                _followed_logs -= 1
+            self.log_chunks = None
+            log_chunks.close()  # releases the connection to the engine
@@ -15,12 +15,22 @@
 
 """Test module for the API endpoint."""
 
+from argparse import Namespace
+import json
+import threading
+import time
+
+import psycopg2
 import pytest
 
 from zoe_api.api_endpoint import APIEndpoint
-from zoe_api.exceptions import ZoeException
+from zoe_api.exceptions import ZoeException, ZoeQuotaException
 from zoe_api.tests.mock_master_api import MockAPIManager
+from zoe_lib.config import load_configuration
+from zoe_lib.state import SQLManager
+from zoe_lib.state.execution import ExecutionTable
 from zoe_lib.state.tests.mock_sql_manager import MockSQLManager
+from zoe_lib.tests.config_mock import zoe_configuration  # pylint: disable=unused-import
 
 
 class TestAPIEndpoint:
@@ -47,3 +57,50 @@ class TestAPIEndpoint:
         else:
             ret = api.statistics_scheduler()
             assert isinstance(ret, dict)
+
+    def test_quota_serialized(self, zoe_configuration, master_api, monkeypatch):  # pylint: disable=redefined-outer-name
+        """Test that concurrent submissions by the same user to two API processes cannot exceed the concurrent executions quota."""
+        conf = Namespace(**vars(zoe_configuration))
+        conf.deployment_name = 'test_quota'
+        conf.max_core_limit = 32
+        conf.max_memory_limit = 64
+        load_configuration(conf)
+        try:
+            sql = SQLManager(conf)
+        except psycopg2.OperationalError:
+            pytest.skip('PostgreSQL is not available')
+        sql.init_db(force=True)
+
+        active_usage = ExecutionTable.active_usage
+
+        def slow_active_usage(table, user_id):
+            """Long enough for the two submissions to overlap."""
+            ret = active_usage(table, user_id)
+            time.sleep(0.1)
+            return ret
+        monkeypatch.setattr(ExecutionTable, 'active_usage', slow_active_usage)
+
+        master_api.fails = False
+        user = Namespace(id=1, quota=Namespace(concurrent_executions=1, cores=0, memory=0))
+        zapp = json.load(open('integration_tests/zapp.json', 'r'))
+        errors = []
+
+        def submit():
+            """Submit an execution through an API endpoint with its own connection, recording quota errors."""
+            try:
+                APIEndpoint(master_api, SQLManager(conf)).execution_start(user, 'test', zapp)
+            except ZoeQuotaException as e:
+                errors.append(e)
+        try:
+            threads = [threading.Thread(target=submit) for _ in range(2)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            assert sql.executions.count(user_id=1) == 1
+            assert len(errors) == 1
+        finally:
+            cur = sql.cursor()
+            cur.execute("DELETE FROM public.versions WHERE deployment = %s", (conf.deployment_name,))
+            cur.execute('DROP SCHEMA {} CASCADE'.format(conf.deployment_name))
+            sql.commit()
@@ -21,6 +21,7 @@ import math
 import time
 
 from zoe_lib.config import get_conf
+from zoe_lib.state import Execution
 
 import zoe_api.exceptions
 from zoe_api.web.request_handler import ZoeWebRequestHandler
@@ -58,7 +59,7 @@ class ExecutionListWeb(ZoeWebRequestHandler):
 
         page = int(page)
         executions_count = self.api_endpoint.execution_count(self.current_user)
-        executions = self.api_endpoint.execution_list(self.current_user, base=page*self.PAGINATION_ITEM_COUNT, limit=self.PAGINATION_ITEM_COUNT)
+        executions = self.api_endpoint.execution_list(self.current_user, base=page*self.PAGINATION_ITEM_COUNT, limit=self.PAGINATION_ITEM_COUNT, fields=Execution.SUMMARY_FIELDS)
 
         template_vars = {
             "user": self.current_user,
@@ -124,8 +125,7 @@ class ExecutionInspectWeb(ZoeWebRequestHandler):
         template_vars = {
             "e": e,
             "services_info": services_info,
-            "endpoints": endpoints,
-            'killed_at': e.time_submit + datetime.timedelta(hours=e.owner.quota.runtime_limit)
+            "endpoints": endpoints
         }
 
         if get_conf().enable_plots and e.time_start is not None:
@@ -23,6 +23,7 @@ from zoe_api.auth.base import BaseAuthenticator
 from zoe_api.auth.requests_oauth2 import EurecomGitLabClient
 
 import zoe_lib.config
+from zoe_lib.state import Execution
 
 
 class RootWeb(ZoeWebRequestHandler):
@@ -84,31 +85,36 @@ class HomeWeb(ZoeWebRequestHandler):
 
         filters = {
             "user_id": self.current_user.id,
-            "limit": 5
+            "limit": 5,
+            "fields": Execution.SUMMARY_FIELDS
         }
         last_executions = self.api_endpoint.execution_list(self.current_user, **filters)
 
         filters = {
             "user_id": self.current_user.id,
-            "status": "running"
+            "status": "running",
+            "fields": Execution.SUMMARY_FIELDS
         }
         last_running_executions = self.api_endpoint.execution_list(self.current_user, **filters)
 
         filters = {
             "user_id": self.current_user.id,
-            "status": "submitted"
+            "status": "submitted",
+            "fields": Execution.SUMMARY_FIELDS
         }
         last_running_executions += self.api_endpoint.execution_list(self.current_user, **filters)
 
         filters = {
             "user_id": self.current_user.id,
-            "status": "queued"
+            "status": "queued",
+            "fields": Execution.SUMMARY_FIELDS
         }
         last_running_executions += self.api_endpoint.execution_list(self.current_user, **filters)
 
         filters = {
             "user_id": self.current_user.id,
-            "status": "starting"
+            "status": "starting",
+            "fields": Execution.SUMMARY_FIELDS
         }
         last_running_executions += self.api_endpoint.execution_list(self.current_user, **filters)
 
@@ -54,7 +54,7 @@ class StatusEndpointWeb(ZoeWebRequestHandler):
 
         services_per_node = {}
         for node in stats['platform_stats']['nodes']:
-            services_per_node[node['name']] = self.api_endpoint.sql.services.select(backend_host=node['name'], backend_status='started')
+            services_per_node[node['name']] = self.api_endpoint.sql.services.select(backend_host=node['name'], backend_status='started', fields=['name', 'execution_id', 'backend_status', 'essential'])
             for service in services_per_node[node['name']]:
                 if service.id not in node['service_stats']:
                     node['service_stats'][service.id] = {
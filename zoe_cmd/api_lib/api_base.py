@@ -74,14 +74,15 @@ class ZoeAPIBase:
         self.token = token
 
     @retry(ZoeAPIException)
-    def _rest_get_stream(self, path):
+    def _rest_get_stream(self, path, payload=None):
         """
         :type path: str
+        :type payload: dict
         :rtype: Tuple[requests.Response, int]
         """
         url = self.url + '/api/' + ZOE_API_VERSION + path
         try:
-            req = requests.get(url, stream=True, headers={'Cookie': self.token})
+            req = requests.get(url, params=payload, stream=True, headers={'Cookie': self.token})
         except requests.exceptions.Timeout:
             raise ZoeAPIException('HTTP connection timeout')
         except requests.exceptions.HTTPError:
@@ -0,0 +1,57 @@
+# Copyright (c) 2018, Daniele Venzano
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""
+This module contains the API calls to archive old executions that a Zoe client can use.
+"""
+import logging
+
+from zoe_cmd.api_lib.api_base import ZoeAPIBase
+from zoe_lib.exceptions import ZoeAPIException
+
+log = logging.getLogger(__name__)
+
+
+class ZoeArchiveAPI(ZoeAPIBase):
+    """
+    The archive API class.
+    """
+    def start(self, older_than_days=None) -> str:
+        """
+        Start moving the executions terminated more than older_than_days ago to the history tables.
+
+        :param older_than_days: the age in days, the server default is used if None
+        :return: the cutoff time of the run
+        """
+        payload = {}
+        if older_than_days is not None:
+            payload['older_than_days'] = older_than_days
+        data, status_code = self._rest_post('/archive', payload)
+        if status_code != 202:
+            raise ZoeAPIException(data)
+        return data['cutoff']
+
+    def list(self, limit=-1):
+        """
+        List the archival runs, most recent first.
+
+        :param limit: the maximum number of runs to return
+        :return:
+        """
+        data, status_code = self._rest_get('/archive', {'limit': limit})
+        if status_code != 200:
+            raise ZoeAPIException(data)
+        return list(data.values())
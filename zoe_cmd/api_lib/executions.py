@@ -71,6 +71,7 @@ class ZoeExecutionsAPI(ZoeAPIBase):
         * name: execution mane
         * user_id: user_id owning the execution (admin only)
         * limit: limit the number of returned entries
+        * before_id: only executions with an ID lower than this, pass the smallest ID of the previous page to paginate
         * earlier_than_submit: all execution that where submitted earlier than this timestamp
         * earlier_than_start: all execution that started earlier than this timestamp
         * earlier_than_end: all execution that ended earlier than this timestamp
@@ -0,0 +1,51 @@
+# Copyright (c) 2018, Daniele Venzano
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+This module contains the API calls to distribute images to the nodes that a Zoe client can use.
+"""
+import logging
+
+from zoe_cmd.api_lib.api_base import ZoeAPIBase
+from zoe_lib.exceptions import ZoeAPIException
+
+log = logging.getLogger(__name__)
+
+
+class ZoeImagesAPI(ZoeAPIBase):
+    """
+    The images API class.
+    """
+    def warm(self, images):
+        """
+        Start pulling images on all nodes.
+
+        :param images: a list of image names
+        :return:
+        """
+        data, status_code = self._rest_post('/images', {'images': images})
+        if status_code != 202:
+            raise ZoeAPIException(data)
+
+    def pulls(self):
+        """
+        List the image pulls in progress and the ones finished recently.
+
+        :return: a list of pulls
+        """
+        data, status_code = self._rest_get('/images')
+        if status_code != 200:
+            raise ZoeAPIException(data)
+        return data['pulls']
@@ -46,14 +46,22 @@ class ZoeServiceAPI(ZoeAPIBase):
         else:
             raise ZoeAPIException('error retrieving service {}: {}'.format(container_id, cont))
 
-    def get_logs(self, container_id):
+    def get_logs(self, container_id, since=None, tail=None, follow=True):
         """
         Retrieve service logs.
 
         :param container_id:
+        :param since: only logs after this UNIX timestamp
+        :param tail: only this number of lines from the end of the log
+        :param follow: keep streaming new lines
         :return:
         """
-        response, status_code = self._rest_get_stream('/service/logs/' + str(container_id))
+        payload = {'follow': 'true' if follow else 'false'}
+        if since is not None:
+            payload['since'] = since
+        if tail is not None:
+            payload['tail'] = tail
+        response, status_code = self._rest_get_stream('/service/logs/' + str(container_id), payload)
         if status_code == 200:
             for line in response.iter_lines():
                 line = line.decode('utf-8').split(' ', 1)
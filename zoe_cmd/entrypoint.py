@@ -33,9 +33,9 @@ from zoe_cmd.api_lib import ZoeAPI
 from zoe_lib.exceptions import ZoeAPIException
 
 
-def _log_stream_stdout(service_id, timestamps, api: ZoeAPI):
+def _log_stream_stdout(service_id, timestamps, api: ZoeAPI, tail=None, follow=True):
     try:
-        for line in api.services.get_logs(service_id):
+        for line in api.services.get_logs(service_id, tail=tail, follow=follow):
             if timestamps:
                 print(line[0], line[1])
             else:
@@ -71,6 +71,7 @@ def exec_list_cmd(api: ZoeAPI, args):
         'status',
         'name',
         'limit',
+        'before_id',
         'earlier_than_submit',
         'earlier_than_start',
         'earlier_than_end',
@@ -90,6 +91,8 @@ def exec_list_cmd(api: ZoeAPI, args):
     tabular_data = [[e['id'], e['name'], e['user_id'], e['status']] for e in sorted(data, key=lambda x: x['id'])]
     headers = ['ID', 'Name', 'User ID', 'Status']
     print(tabulate(tabular_data, headers))
+    if args.limit is not None and len(data) == args.limit:
+        print('Use --before-id {} to see the next page'.format(min(e['id'] for e in data)))
 
 
 def exec_start_cmd(api: ZoeAPI, args):
@@ -178,7 +181,7 @@ def exec_kill_cmd(api: ZoeAPI, args):
 
 def logs_cmd(api: ZoeAPI, args):
     """Retrieves and streams the logs of a service."""
-    _log_stream_stdout(args.service_id, args.timestamps, api)
+    _log_stream_stdout(args.service_id, args.timestamps, api, args.tail, not args.no_follow)
 
 
 def stats_cmd(api: ZoeAPI, args_):
@@ -223,6 +226,7 @@ def process_arguments() -> Tuple[ArgumentParser, Namespace]:
 
     argparser_app_list = subparser.add_parser('exec-ls', help="List all executions for the calling user")
     argparser_app_list.add_argument('--limit', type=int, help='Limit the number of executions')
+    argparser_app_list.add_argument('--before-id', type=int, help='Show only executions with an ID lower than this one, to get the next page of a limited listing')
     argparser_app_list.add_argument('--name', help='Show only executions with this name')
     argparser_app_list.add_argument('--status', choices=["submitted", "queued", "starting", "error", "running", "cleaning up", "terminated"], help='Show only executions with this status')
     argparser_app_list.add_argument('--earlier-than-submit', help='Show only executions submitted earlier than this timestamp (seconds since UTC epoch)')
@@ -248,6 +252,8 @@ def process_arguments() -> Tuple[ArgumentParser, Namespace]:
     argparser_logs = subparser.add_parser('logs', help="Streams the service logs")
     argparser_logs.add_argument('service_id', type=int, help="Service id")
     argparser_logs.add_argument('-t', '--timestamps', action='store_true', help="Prefix timestamps for each line")
+    argparser_logs.add_argument('--tail', type=int, help="Show only this number of lines from the end of the log")
+    argparser_logs.add_argument('--no-follow', action='store_true', help="Exit at the end of the log instead of waiting for new lines")
     argparser_logs.set_defaults(func=logs_cmd)
 
     argparser_stats = subparser.add_parser('stats', help="Prints all available statistics")
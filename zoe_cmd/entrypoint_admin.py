@@ -61,6 +61,7 @@ def exec_list_cmd(api: ZoeAPI, args):
         'name',
         'user_id',
         'limit',
+        'before_id',
         'earlier_than_submit',
         'earlier_than_start',
         'earlier_than_end',
@@ -78,6 +79,8 @@ def exec_list_cmd(api: ZoeAPI, args):
     tabular_data = [[e['id'], e['name'], e['user_id'], e['status']] for e in sorted(data, key=lambda x: x['id'])]
     headers = ['ID', 'Name', 'User ID', 'Status']
     print(tabulate(tabular_data, headers))
+    if args.limit is not None and len(data) == args.limit:
+        print('Use --before-id {} to see the next page'.format(min(e['id'] for e in data)))
 
 
 def exec_get_cmd(api: ZoeAPI, args):
@@ -372,6 +375,46 @@ def user_update_cmd(api: ZoeAPI, args):
     api.user.update(args.id, user_update)
 
 
+def archive_start_cmd(api: ZoeAPI, args):
+    """Start moving old terminated executions to the history tables."""
+    cutoff = api.archive.start(args.older_than)
+    print('Archival started for executions that ended before {} UTC, check progress with archive-ls'.format(cutoff))
+
+
+def archive_ls_cmd(api: ZoeAPI, args):
+    """List the archival runs."""
+    def ts2text(val):
+        """Timestamp to text."""
+        if val is None:
+            return 'running'
+        return datetime.fromtimestamp(val, timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+    runs = api.archive.list(args.limit if args.limit is not None else -1)
+    tabular_data = [[r['id'], ts2text(r['time_start']), ts2text(r['time_end']), ts2text(r['cutoff']), r['executions'], r['services'], r['ports']] for r in sorted(runs, key=lambda x: x['id'], reverse=True)]
+    headers = ['ID', 'Started', 'Finished', 'Ended before', 'Executions', 'Services', 'Ports']
+    print(tabulate(tabular_data, headers))
+
+
+def images_warm_cmd(api: ZoeAPI, args):
+    """Pull the images of a ZApp on all nodes."""
+    app_descr = json.load(args.jsonfile)
+    images = sorted({service['image'] for service in app_descr['services']})
+    api.images.warm(images)
+    print('Started pulling {} on all nodes, check progress with images-pulls'.format(', '.join(images)))
+
+
+def images_pulls_cmd(api: ZoeAPI, args_):
+    """List the image pulls in progress."""
+    def size2text(val):
+        """Bytes to text."""
+        return '{:.1f}MB'.format(val / (1024 ** 2))
+
+    pulls = api.images.pulls()
+    tabular_data = [[p['image'], p['host'], p['status'], '{} / {}'.format(size2text(p['bytes_downloaded']), size2text(p['bytes_total'])), p['error'] if p['error'] is not None else ''] for p in pulls]
+    headers = ['Image', 'Host', 'Status', 'Downloaded', 'Error']
+    print(tabulate(tabular_data, headers))
+
+
 ENV_HELP_TEXT = '''To authenticate with Zoe you need to define three environment variables:
 ZOE_URL: point to the URL of the Zoe Scheduler (ex.: http://localhost:5000/
 ZOE_USER: the username used for authentication
@@ -402,6 +445,7 @@ def process_arguments() -> Tuple[ArgumentParser, Namespace]:
     # executions
     argparser_app_list = subparser.add_parser('exec-ls', help="List all executions for the calling user")
     argparser_app_list.add_argument('--limit', type=int, help='Limit the number of executions')
+    argparser_app_list.add_argument('--before-id', type=int, help='Show only executions with an ID lower than this one, to get the next page of a limited listing')
     argparser_app_list.add_argument('--name', help='Show only executions with this name')
     argparser_app_list.add_argument('--user_id', help='Show only executions belonging to this user')
     argparser_app_list.add_argument('--status', choices=["submitted", "queued", "starting", "error", "running", "cleaning up", "terminated"], help='Show only executions with this status')
@@ -529,6 +573,23 @@ def process_arguments() -> Tuple[ArgumentParser, Namespace]:
     sub_parser.add_argument('--quota_id', help="Change quota")
     sub_parser.set_defaults(func=user_update_cmd)
 
+    # Archive
+    sub_parser = subparser.add_parser('archive-start', help="Move old terminated executions to the history tables")
+    sub_parser.add_argument('--older-than', type=int, help="Archive executions that ended more than this number of days ago (default set in the server configuration)")
+    sub_parser.set_defaults(func=archive_start_cmd)
+
+    sub_parser = subparser.add_parser('archive-ls', help="List archival runs")
+    sub_parser.add_argument('--limit', type=int, help="Show only the most recent runs")
+    sub_parser.set_defaults(func=archive_ls_cmd)
+
+    # Images
+    sub_parser = subparser.add_parser('images-warm', help="Pull the images of a ZApp on all nodes")
+    sub_parser.add_argument('jsonfile', type=FileType("r"), help='Application description')
+    sub_parser.set_defaults(func=images_warm_cmd)
+
+    sub_parser = subparser.add_parser('images-pulls', help="List the image pulls in progress")
+    sub_parser.set_defaults(func=images_pulls_cmd)
+
     return parser, parser.parse_args()
 
 
@@ -57,6 +57,7 @@ def load_configuration(test_conf=None):
         argparser.add_argument('--dbpass', help='DB password', default='')
         argparser.add_argument('--dbhost', help='DB hostname', default='localhost')
         argparser.add_argument('--dbport', type=int, help='DB port', default=5432)
+        argparser.add_argument('--dbcache-ttl', type=int, help='Seconds user, role and quota records are cached in memory, set to 0 to disable the cache', default=60)
 
         # Master options
         argparser.add_argument('--api-listen-uri', help='ZMQ API listen address', default='tcp://*:4850')
@@ -65,6 +66,7 @@ def load_configuration(test_conf=None):
         argparser.add_argument('--kairosdb-url', help='URL of the KairosDB service (ex. http://localhost:8090)', default='http://localhost:8090')
         argparser.add_argument('--influxdb-enable', action="store_true", help='Enable usage metric input from InfluxDB')
         argparser.add_argument('--influxdb-url', help='URL of the InfluxDB service (ex. http://localhost:8086)', default='http://localhost:8086')
+        argparser.add_argument('--metrics-max-age', type=int, help='Seconds after which the platform state and the usage metrics are considered stale, the scheduler does not place executions on a stale platform state', default=60)
 
         argparser.add_argument('--workspace-base-path', help='Base directory where user workspaces will be created. Must be visible at this path on all hosts.', default='/mnt/zoe-workspaces')
         argparser.add_argument('--workspace-deployment-path', help='Path appended to the workspace path to distinguish this deployment. If unspecified is equal to the deployment name.', default='--default--')
@@ -82,6 +84,7 @@ def load_configuration(test_conf=None):
         argparser.add_argument('--listen-port', type=int, help='Port to listen to for incoming connections', default=5001)
         argparser.add_argument('--master-url', help='URL of the Zoe master process', default='tcp://127.0.0.1:4850')
         argparser.add_argument('--cookie-secret', help='secret used to encrypt cookies', default='changeme')
+        argparser.add_argument('--archive-age', type=int, help='Default age in days of the terminated executions moved to the history tables by an archival run', default=90)
 
         argparser.add_argument('--auth-file', help='Path to the CSV file containing user,pass,role lines for text authentication', default='zoepass.csv')
 
@@ -110,8 +113,9 @@ def load_configuration(test_conf=None):
         argparser.add_argument('--scheduler-class', help='Scheduler class to use for scheduling ZApps', choices=['ZoeElasticScheduler'], default='ZoeElasticScheduler')
         argparser.add_argument('--scheduler-policy', help='Scheduler policy to use for scheduling ZApps', choices=['FIFO', 'SIZE', 'DYNSIZE'], default='FIFO')
         argparser.add_argument('--placement-policy', help='Placement policy', choices=['waterfill', 'random', 'average'], default='average')
+        argparser.add_argument('--image-prefetch', action='store_true', help='Start pulling the images of queued executions on the nodes they are likely to be placed on')
 
-        argparser.add_argument('--backend', choices=['Kubernetes', 'DockerEngine'], default='DockerEngine', help='Which backend to enable')
+        argparser.add_argument('--backend', default='DockerEngine', help='Which backend to enable, among Kubernetes, DockerEngine and DockerEngineAsync, a comma-separated list federates several back-ends')
 
         # Docker Engine backend options
         argparser.add_argument('--backend-docker-config-file', help='Location of the Docker Engine config file', default='docker.conf')
@@ -119,6 +123,8 @@ def load_configuration(test_conf=None):
         # Kubernetes backend
         argparser.add_argument('--kube-config-file', help='Kubernetes configuration file', default='/opt/zoe/kube.conf')
         argparser.add_argument('--kube-namespace', help='The namespace that Zoe operates on', default='default')
+        argparser.add_argument('--kube-placement', choices=['required', 'preferred', 'none'], help='How the node chosen by the Zoe scheduler is passed to Kubernetes: a required or preferred node affinity, or none to leave the placement to the Kubernetes scheduler', default='required')
+        argparser.add_argument('--kube-ready-timeout', help='Seconds to wait for the services of a startup group to be running before starting the next group, 0 to not wait', type=int, default=30)
 
 	# Kubernetes Ingress Controller (NGINX)
         argparser.add_argument('--kube-ingress-controller', help='Kubernetes Ingress controller is used. Impacts the endpoint handling in Zoe', default='no')
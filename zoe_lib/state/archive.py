@@ -0,0 +1,173 @@
+# Copyright (c) 2017, Daniele Venzano
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Archival of terminated executions to the history tables."""
+
+import datetime
+import logging
+
+from zoe_lib.state.base import BaseRecord, BaseTable
+from zoe_lib.state.execution import ExecutionTable
+from zoe_lib.state.port import PortTable
+from zoe_lib.state.service import ServiceTable
+
+log = logging.getLogger(__name__)
+
+# Arbitrary key for the advisory lock that prevents concurrent archival runs
+ARCHIVE_LOCK_ID = 0x20e
+
+
+class ArchiveRun(BaseRecord):
+    """An archival run, that moved old executions to the history tables."""
+    __slots__ = ('time_start', 'time_end', 'cutoff', 'executions', 'services', 'ports')
+
+    def __init__(self, d, sql_manager):
+        super().__init__(d, sql_manager)
+
+        self.time_start = d['time_start']
+        self.time_end = d['time_end']
+        self.cutoff = d['cutoff']
+        self.executions = d['executions']
+        self.services = d['services']
+        self.ports = d['ports']
+
+    def serialize(self):
+        """Generates a dictionary that can be serialized in JSON."""
+        return {
+            'id': self.id,
+            'time_start': (self.time_start - datetime.datetime(1970, 1, 1)) / datetime.timedelta(seconds=1),
+            'time_end': None if self.time_end is None else (self.time_end - datetime.datetime(1970, 1, 1)) / datetime.timedelta(seconds=1),
+            'cutoff': (self.cutoff - datetime.datetime(1970, 1, 1)) / datetime.timedelta(seconds=1),
+            'executions': self.executions,
+            'services': self.services,
+            'ports': self.ports
+        }
+
+    @property
+    def is_running(self):
+        """Returns True if the run has not finished yet."""
+        return self.time_end is None
+
+
+class ArchiveTable(BaseTable):
+    """Moves terminated executions, with their services and ports, to the history tables and keeps track of the archival runs."""
+    BATCH_SIZE = 1000
+
+    def __init__(self, sql_manager):
+        super().__init__(sql_manager, "archive_run")
+
+    def create(self):
+        """Does nothing, the history tables are created by the schema migrations."""
+
+    def select(self, only_one=False, limit=-1, **kwargs):
+        """
+        Return a list of archival runs, most recent first.
+
+        :param only_one: only one result is expected
+        :type only_one: bool
+        :param limit: limit the result to this number of entries
+        :type limit: int
+        :param kwargs: filter runs based on their fields/columns
+        :return: one or more runs
+        """
+        q = 'SELECT * FROM archive_run'
+        filter_list = ['{} = %s'.format(key) for key in kwargs]
+        if len(filter_list) > 0:
+            q += ' WHERE ' + ' AND '.join(filter_list)
+        q += ' ORDER BY id DESC'
+        if limit > 0:
+            q += ' LIMIT {}'.format(limit)
+        self.cursor.execute(q, list(kwargs.values()))
+        if only_one:
+            row = self.cursor.fetchone()
+            if row is None:
+                return None
+            return ArchiveRun(row, self.sql_manager)
+        else:
+            return [ArchiveRun(x, self.sql_manager) for x in self.cursor]
+
+    def _partition_for(self, time_end: datetime.datetime):
+        """Create, if needed, the monthly execution history table for executions that ended at time_end."""
+        month_start = datetime.datetime(time_end.year, time_end.month, 1)
+        if month_start.month == 12:
+            month_end = datetime.datetime(month_start.year + 1, 1, 1)
+        else:
+            month_end = datetime.datetime(month_start.year, month_start.month + 1, 1)
+        name = 'execution_history_y{:04d}m{:02d}'.format(month_start.year, month_start.month)
+        self.cursor.execute('CREATE TABLE IF NOT EXISTS {} (CHECK (time_end >= %s AND time_end < %s)) INHERITS (execution_history)'.format(name), (month_start, month_end))
+        self.cursor.execute('CREATE INDEX IF NOT EXISTS {0}_id_idx ON {0} (id)'.format(name))
+        self.cursor.execute('CREATE INDEX IF NOT EXISTS {0}_user_id_idx ON {0} (user_id, id)'.format(name))
+        return name
+
+    def archive(self, cutoff: datetime.datetime):
+        """
+        Move terminated executions that ended before cutoff to the history tables, in batches.
+
+        Executions that failed before starting have no end time, their submission time is used instead.
+
+        :param cutoff: executions that ended before this UTC time are archived
+        :return: the ArchiveRun record, or None if another run is in progress
+        """
+        self.cursor.execute('SELECT pg_try_advisory_lock(%s)', (ARCHIVE_LOCK_ID,))
+        if not self.cursor.fetchone()[0]:
+            return None
+
+        try:
+            self.cursor.execute('INSERT INTO archive_run (time_start, cutoff) VALUES (%s, %s) RETURNING id', (datetime.datetime.utcnow(), cutoff))
+            run_id = self.cursor.fetchone()[0]
+            self.sql_manager.commit()
+            log.info('Archival run {} started for executions that ended before {}'.format(run_id, cutoff))
+
+            execution_columns = ', '.join(ExecutionTable.COLUMNS)
+            service_columns = ', '.join(ServiceTable.COLUMNS)
+            port_columns = ', '.join(PortTable.COLUMNS)
+            while True:
+                self.cursor.execute("SELECT id, COALESCE(time_end, time_submit) FROM execution WHERE status IN ('terminated', 'error') AND COALESCE(time_end, time_submit) < %s ORDER BY COALESCE(time_end, time_submit) LIMIT %s FOR UPDATE", (cutoff, self.BATCH_SIZE))
+                rows = self.cursor.fetchall()
+                if len(rows) == 0:
+                    break
+
+                partitions = {}
+                for execution_id, time_end in rows:
+                    partitions.setdefault(self._partition_for(time_end), []).append(execution_id)
+                for partition, execution_ids in partitions.items():
+                    self.cursor.execute('INSERT INTO {0} ({1}, archived_at) SELECT {1}, %s FROM execution WHERE id = ANY(%s)'.format(partition, execution_columns), (datetime.datetime.utcnow(), execution_ids))
+
+                execution_ids = [row[0] for row in rows]
+                self.cursor.execute('INSERT INTO service_history ({0}) SELECT {0} FROM service WHERE execution_id = ANY(%s)'.format(service_columns), (execution_ids,))
+                service_count = self.cursor.rowcount
+                self.cursor.execute('INSERT INTO port_history ({0}) SELECT {0} FROM port WHERE service_id IN (SELECT id FROM service WHERE execution_id = ANY(%s))'.format(port_columns), (execution_ids,))
+                port_count = self.cursor.rowcount
+                self.cursor.execute('DELETE FROM execution WHERE id = ANY(%s)', (execution_ids,))  # services and ports are deleted in cascade
+
+                self.cursor.execute('UPDATE archive_run SET executions = executions + %s, services = services + %s, ports = ports + %s WHERE id = %s', (len(execution_ids), service_count, port_count, run_id))
+                self.sql_manager.commit()
+
+            self.cursor.execute('UPDATE archive_run SET time_end = %s WHERE id = %s', (datetime.datetime.utcnow(), run_id))
+            self.sql_manager.commit()
+        except Exception:
+            self.sql_manager.rollback()
+            log.exception('Archival run failed')
+            self.cursor = self.sql_manager.cursor()  # the rollback also reverted the search path
+            self.cursor.execute('UPDATE archive_run SET time_end = %s WHERE time_end IS NULL', (datetime.datetime.utcnow(),))
+            self.sql_manager.commit()
+            raise
+        finally:
+            self.cursor.execute('SELECT pg_advisory_unlock(%s)', (ARCHIVE_LOCK_ID,))
+            self.sql_manager.commit()
+
+        run = self.select(only_one=True, id=run_id)
+        log.info('Archival run {} finished, moved {} executions, {} services and {} ports to the history tables'.format(run.id, run.executions, run.services, run.ports))
+        return run
@@ -24,6 +24,8 @@ class BaseRecord:
     """
     :type sql_manager: SQLManager
     """
+    __slots__ = ('sql_manager', 'id')
+
     def __init__(self, d, sql_manager):
         """
         :type sql_manager: SQLManager
@@ -38,10 +40,13 @@ class BaseRecord:
 
 class BaseTable:
     """Common abstraction for all tables."""
+    cached_columns = ()  # columns that can be used to look up records in the identity map
+
     def __init__(self, sql_manager, table_name):
         self.table_name = table_name
         self.sql_manager = sql_manager
         self.cursor = self.sql_manager.cursor()
+        self._cache_generation = None
 
     def create(self):
         """Create this table."""
@@ -55,6 +60,7 @@ class BaseTable:
         """Delete a record from this table."""
         query = 'DELETE FROM "{}" WHERE id = %s'.format(self.table_name)
         self.cursor.execute(query, (record_id,))
+        self._record_changed(record_id)
         self.sql_manager.commit()
 
     def update(self, record_id, **kwargs):
@@ -69,8 +75,37 @@ class BaseTable:
         q_base = 'UPDATE "{}" SET '.format(self.table_name) + set_q + ' WHERE id=%s'
         query = self.cursor.mogrify(q_base, value_list)
         self.cursor.execute(query)
+        self._updating(record_id, kwargs)
+        self._record_changed(record_id)
         self.sql_manager.commit()
 
+    def _updating(self, record_id, fields):
+        """Called before committing an update, to modify dependent records in the same transaction."""
+
     def select(self, only_one=False, limit=-1, **kwargs):
         """Select records."""
         raise NotImplementedError
+
+    def _cache_get(self, only_one, kwargs):
+        """Look up a record in the identity map, for single-record selects on a cached column."""
+        if not only_one or len(kwargs) != 1:
+            return None
+        column, value = next(iter(kwargs.items()))
+        if column not in self.cached_columns:
+            return None
+        self.sql_manager.poll_changes()
+        self._cache_generation = self.sql_manager.cache.generation
+        return self.sql_manager.cache.get(self.table_name, column, value)
+
+    def _cache_put(self, kwargs, record):
+        """Store a record selected via a cached column in the identity map."""
+        if len(kwargs) != 1:
+            return
+        column, value = next(iter(kwargs.items()))
+        if column in self.cached_columns:
+            self.sql_manager.cache.put(self.table_name, column, value, record, self._cache_generation)
+
+    def _record_changed(self, record_id):
+        """Invalidate a cached record when the transaction that modifies it commits, must be called before committing."""
+        if len(self.cached_columns) > 0:
+            self.sql_manager.record_changed(self.cursor, self.table_name, record_id)
@@ -0,0 +1,88 @@
+# Copyright (c) 2017, Daniele Venzano
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Identity map for slowly-changing records (users, roles and quotas)."""
+
+import logging
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+# Invalidating a record in one of these tables invalidates also all cached records of the dependent tables,
+# since users memoize their role and quota.
+DEPENDENT_TABLES = {
+    'role': ('user',),
+    'quota': ('user',)
+}
+
+
+class RecordCache:
+    """A thread-safe identity map with a TTL, keyed by table name and lookup column."""
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._records = {}
+        self._lock = threading.Lock()
+        self._generation = 0  # incremented by every invalidation
+
+    @property
+    def generation(self) -> int:
+        """Taken before a select, to detect invalidations that happened while the record was read."""
+        return self._generation
+
+    @property
+    def enabled(self) -> bool:
+        """The cache is disabled with a TTL of zero."""
+        return self.ttl > 0
+
+    def get(self, table, column, value):
+        """Returns the cached record, or None if it is not cached or has expired."""
+        if not self.enabled:
+            return None
+        key = (table, column, value)
+        with self._lock:
+            entry = self._records.get(key)
+            if entry is None:
+                return None
+            expiry, record = entry
+            if expiry < time.monotonic():
+                del self._records[key]
+                return None
+            return record
+
+    def put(self, table, column, value, record, generation=None):
+        """Stores a record in the cache, unless a record has been invalidated since generation was taken."""
+        if not self.enabled or record is None:
+            return
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return  # the record may have been read before the change was committed
+            self._records[(table, column, value)] = (time.monotonic() + self.ttl, record)
+
+    def invalidate(self, table, record_id=None):
+        """Drops a record, or all records of a table if record_id is None, and the records that depend on them."""
+        with self._lock:
+            self._generation += 1
+            for key, (expiry_, record) in list(self._records.items()):
+                if key[0] == table and (record_id is None or record.id == record_id):
+                    del self._records[key]
+                elif key[0] in DEPENDENT_TABLES.get(table, ()):
+                    del self._records[key]
+
+    def clear(self):
+        """Empties the cache."""
+        with self._lock:
+            self._generation += 1
+            self._records.clear()
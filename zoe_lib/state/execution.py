@@ -18,8 +18,10 @@
 import datetime
 import logging
 import functools
+import itertools
 
 import psycopg2
+import psycopg2.extras
 
 try:
     from kazoo.client import KazooClient
@@ -28,9 +30,13 @@ except ImportError:
 
 from zoe_lib.state.base import BaseRecord, BaseTable
 import zoe_lib.config
+import zoe_lib.exceptions
 
 log = logging.getLogger(__name__)
 
+# Server-side cursors need a name that is unique on the connection, streams can run concurrently in any thread
+_stream_ids = itertools.count()
+
 
 class Execution(BaseRecord):
     """
@@ -48,41 +54,75 @@ class Execution(BaseRecord):
     RUNNING_STATUS = "running"
     CLEANING_UP_STATUS = "cleaning up"
     TERMINATED_STATUS = "terminated"
+    IMAGE_DL_STATUS = "image download"
+
+    # Statuses of the executions that are not finished, they match the partial indexes on the execution table
+    ACTIVE_STATUSES = ('submitted', 'queued', 'starting', 'running', 'cleaning up', 'image download')
+
+    # Fields needed by execution listings, for select(fields=...)
+    SUMMARY_FIELDS = ['user_id', 'name', 'status', 'time_submit', 'time_start', 'time_end', 'app_name']
+
+    __slots__ = ('user_id', 'name', '_description', '_description_loaded', 'time_submit', 'time_start', 'time_end', '_status', 'error_message', '_size', '_app_name', '_service_ids', 'archived', 'kill_at')
 
     def __init__(self, d, sql_manager):
         super().__init__(d, sql_manager)
 
-        self.user_id = d['user_id']
-        self.name = d['name']
-        self.description = d['description']
+        # Records selected with a field list have None in the fields that were not selected
+        self.user_id = d.get('user_id')
+        self.name = d.get('name')
+        self._description = d.get('description')  # loaded on first access if not selected
+        self._description_loaded = 'description' in d
 
-        if isinstance(d['time_submit'], datetime.datetime):
-            self.time_submit = d['time_submit']
-        else:
-            self.time_submit = datetime.datetime.utcfromtimestamp(d['time_submit'])
+        self.time_submit = self._parse_timestamp(d.get('time_submit'))
+        self.time_start = self._parse_timestamp(d.get('time_start'))
+        self.time_end = self._parse_timestamp(d.get('time_end'))
+        self.kill_at = self._parse_timestamp(d.get('kill_at'))  # None if the owner has no run time limit
 
-        if isinstance(d['time_submit'], datetime.datetime):
-            self.time_start = d['time_start']
-        else:
-            self.time_start = datetime.datetime.utcfromtimestamp(d['time_start'])
+        self._status = d.get('status')
+        self.error_message = d.get('error_message')
 
-        if isinstance(d['time_submit'], datetime.datetime):
-            self.time_end = d['time_end']
+        self._size = float(d['size']) if d.get('size') is not None else None
+        self._app_name = d.get('app_name')
+        self.archived = bool(d.get('archived'))  # True if selected from the history tables
+
+        try:
+            self._service_ids = d['service_ids']
+        except KeyError:
+            self._service_ids = None
         else:
-            self.time_submit = datetime.datetime.utcfromtimestamp(d['time_start'])
+            if self._service_ids is None:  # array_agg over no rows
+                self._service_ids = []
 
-        self._status = d['status']
-        self.error_message = d['error_message']
+    @staticmethod
+    def _parse_timestamp(value):
+        if value is None or isinstance(value, datetime.datetime):
+            return value
+        return datetime.datetime.utcfromtimestamp(value)
 
-        if d['size'] is not None:
-            self.size = float(d['size'])
-        else:
+    @property
+    def description(self):
+        """The ZApp description of this execution, loaded on first access for records selected with a field list."""
+        if not self._description_loaded:  # also when the record has been deleted in the meantime
+            self._description = self.sql_manager.executions.select_description(self.id, history=self.archived)
+            self._description_loaded = True
+        return self._description
+
+    @property
+    def size(self):
+        """The size of this execution, as used by the scheduler policies."""
+        if self._size is None:
             try:
-                self.size = self.description['size']
+                self._size = self.description['size']
             except KeyError:
-                self.size = self.description['priority']  # zapp format v2
+                self._size = self.description['priority']  # zapp format v2
+        return self._size
 
-        self.app_name = self.description['name']
+    @property
+    def app_name(self):
+        """The name of the ZApp this execution is running."""
+        if self._app_name is None:
+            self._app_name = self.description['name']
+        return self._app_name
 
     def serialize(self):
         """Generates a dictionary that can be serialized in JSON."""
@@ -94,9 +134,10 @@ class Execution(BaseRecord):
             'time_submit': (self.time_submit - datetime.datetime(1970, 1, 1)) / datetime.timedelta(seconds=1),
             'time_start': None if self.time_start is None else (self.time_start - datetime.datetime(1970, 1, 1)) / datetime.timedelta(seconds=1),
             'time_end': None if self.time_end is None else (self.time_end - datetime.datetime(1970, 1, 1)) / datetime.timedelta(seconds=1),
+            'kill_at': None if self.kill_at is None else (self.kill_at - datetime.datetime(1970, 1, 1)) / datetime.timedelta(seconds=1),
             'status': self._status,
             'error_message': self.error_message,
-            'services': [s.id for s in self.services],
+            'services': self.service_ids,
             'size': self.size
         }
 
@@ -180,7 +221,7 @@ class Execution(BaseRecord):
 
     def set_size(self, new_size):
         """Changes the size of the execution, for policies that calculate the size automatically."""
-        self.size = new_size
+        self._size = new_size
         self.sql_manager.executions.update(self.id, size=new_size)
 
     @property
@@ -204,17 +245,24 @@ class Execution(BaseRecord):
     @property
     def services(self):
         """Getter for this execution service list."""
-        return self.sql_manager.services.select(execution_id=self.id)
+        return self.sql_manager.services.select(execution_id=self.id, history=self.archived)
+
+    @property
+    def service_ids(self):
+        """Getter for the IDs of the services of this execution, as aggregated when the execution was selected."""
+        if self._service_ids is None:
+            return [s.id for s in self.services]
+        return self._service_ids
 
     @property
     def essential_services(self):
         """Getter for this execution essential service list."""
-        return self.sql_manager.services.select(execution_id=self.id, essential=True)
+        return self.sql_manager.services.select(execution_id=self.id, essential=True, history=self.archived)
 
     @property
     def elastic_services(self):
         """Getter for this execution elastic service list."""
-        return self.sql_manager.services.select(execution_id=self.id, essential=False)
+        return self.sql_manager.services.select(execution_id=self.id, essential=False, history=self.archived)
 
     @property
     def essential_services_running(self) -> bool:
@@ -294,53 +342,110 @@ class ExecutionTable(BaseTable):
         """Create a new execution in the state."""
         status = Execution.SUBMIT_STATUS
         time_submit = datetime.datetime.utcnow()
-        query = self.cursor.mogrify('INSERT INTO execution (id, name, user_id, description, status, size, time_submit) VALUES (DEFAULT, %s,%s,%s,%s,%s,%s) RETURNING id', (name, user_id, description, status, description['size'], time_submit))
+        query = self.cursor.mogrify('INSERT INTO execution (id, name, user_id, description, status, size, time_submit, kill_at) VALUES (DEFAULT, %s,%s,%s,%s,%s,%s,(' + self.KILL_AT_QUERY + ')) RETURNING id', (name, user_id, description, status, description['size'], time_submit, time_submit, user_id))
         self.cursor.execute(query)
         self.sql_manager.commit()
         return self.cursor.fetchone()[0]
 
-    def select(self, only_one=False, limit=-1, base=0, **kwargs):
+    COLUMNS = ('id', 'name', 'user_id', 'description', 'status', 'size', 'time_submit', 'time_start', 'time_end', 'error_message', 'kill_at')
+
+    # Deadline given the submission time and the user, according to the run time limit of the user quota
+    KILL_AT_QUERY = """SELECT CASE WHEN quota.runtime_limit > 0 THEN %s + quota.runtime_limit * INTERVAL '1 hour' END FROM "user" JOIN quota ON quota.id = "user".quota_id WHERE "user".id = %s"""
+
+    # Statuses in which an execution can overrun its deadline, executions that are cleaning up are already being terminated
+    TERMINABLE_STATUSES = ('submitted', 'queued', 'starting', 'running', 'image download')
+
+    STREAM_BATCH_SIZE = 500
+
+    def _filters(self, kwargs):
+        """Translate the keyword filters into a WHERE clause and its arguments."""
+        filter_list = []
+        args_list = []
+        for key, value in kwargs.items():
+            if key == 'earlier_than_submit':
+                filter_list.append('"time_submit" <= to_timestamp(%s)')
+            elif key == 'earlier_than_start':
+                filter_list.append('"time_start" <= to_timestamp(%s)')
+            elif key == 'earlier_than_end':
+                filter_list.append('"time_end" <= to_timestamp(%s)')
+            elif key == 'later_than_submit':
+                filter_list.append('"time_submit" >= to_timestamp(%s)')
+            elif key == 'later_than_start':
+                filter_list.append('"time_start" >= to_timestamp(%s)')
+            elif key == 'later_than_end':
+                filter_list.append('"time_end" >= to_timestamp(%s)')
+            elif key == 'before_id':
+                filter_list.append('execution.id < %s')
+            else:
+                filter_list.append('{} = %s'.format(key))
+            args_list.append(value)
+        if len(filter_list) > 0:
+            return ' WHERE ' + ' AND '.join(filter_list), args_list
+        else:
+            return '', args_list
+
+    def _source(self, history):
+        """The executions to select from, including the archived ones if history is True."""
+        if not history:
+            return 'execution'
+        return '(SELECT {0}, FALSE AS archived FROM execution UNION ALL SELECT {0}, TRUE AS archived FROM execution_history) AS execution'.format(', '.join(self.COLUMNS))
+
+    def _service_ids_join(self, history):
+        """Service IDs are aggregated per execution in the same query, serialize() would otherwise run one query per execution."""
+        if history:
+            source = '(SELECT id, execution_id FROM service UNION ALL SELECT id, execution_id FROM service_history)'
+        else:
+            source = 'service'
+        return ' LEFT JOIN LATERAL (SELECT array_agg(service.id ORDER BY service.id) AS service_ids FROM {} AS service WHERE service.execution_id = execution.id) AS s ON TRUE'.format(source)
+
+    def _select_query(self, fields, history):
+        """Build the SELECT part of a query, fetching only the given fields if a list is passed."""
+        if fields is None:
+            return 'SELECT * FROM ' + self._source(history) + self._service_ids_join(history)
+        columns = ['execution.id']
+        if history:
+            columns.append('execution.archived')
+        join = ''
+        for field in fields:
+            if field == 'app_name':
+                columns.append("execution.description->>'name' AS app_name")
+            elif field == 'service_ids':
+                columns.append('service_ids')
+                join = self._service_ids_join(history)
+            elif field in self.COLUMNS:
+                if field != 'id':
+                    columns.append('execution.' + field)
+            else:
+                raise zoe_lib.exceptions.ZoeLibException('Unknown execution field {}'.format(field))
+        return 'SELECT {} FROM {}'.format(', '.join(columns), self._source(history)) + join
+
+    def select(self, only_one=False, limit=-1, base=0, fields=None, history=False, **kwargs):
         """
         Return a list of executions.
 
+        Use the before_id filter with the smallest ID of the previous page for keyset pagination, it is much cheaper than a base offset on large tables.
+        Pass a list of fields to fetch only those columns (plus app_name and service_ids, that are computed), the description
+        is then loaded only if accessed. Execution.SUMMARY_FIELDS contains what is needed for listings.
+        With history set to True archived executions are returned as well.
+
         :param only_one: only one result is expected
         :type only_one: bool
         :param limit: limit the result to this number of entries
         :type limit: int
         :type base: int
         :param base: the base value to use when limiting result count
+        :param fields: the fields to fetch, all of them if None
+        :type fields: list
+        :param history: include archived executions
+        :type history: bool
         :param kwargs: filter executions based on their fields/columns
         :return: one or more executions
         """
-        q_base = 'SELECT * FROM execution'
-        if len(kwargs) > 0:
-            q = q_base + " WHERE "
-            filter_list = []
-            args_list = []
-            for key, value in kwargs.items():
-                if key == 'earlier_than_submit':
-                    filter_list.append('"time_submit" <= to_timestamp(%s)')
-                elif key == 'earlier_than_start':
-                    filter_list.append('"time_start" <= to_timestamp(%s)')
-                elif key == 'earlier_than_end':
-                    filter_list.append('"time_end" <= to_timestamp(%s)')
-                elif key == 'later_than_submit':
-                    filter_list.append('"time_submit" >= to_timestamp(%s)')
-                elif key == 'later_than_start':
-                    filter_list.append('"time_start" >= to_timestamp(%s)')
-                elif key == 'later_than_end':
-                    filter_list.append('"time_end" >= to_timestamp(%s)')
-                else:
-                    filter_list.append('{} = %s'.format(key))
-                args_list.append(value)
-            q += ' AND '.join(filter_list)
-            if limit > 0:
-                q += ' ORDER BY id DESC LIMIT {} OFFSET {}'.format(limit, base)
-            query = self.cursor.mogrify(q, args_list)
-        else:
-            if limit > 0:
-                q_base += ' ORDER BY id DESC LIMIT {} OFFSET {}'.format(limit, base)
-            query = self.cursor.mogrify(q_base)
+        where, args_list = self._filters(kwargs)
+        q = self._select_query(fields, history) + where
+        if limit > 0:
+            q += ' ORDER BY execution.id DESC LIMIT {} OFFSET {}'.format(limit, base)
+        query = self.cursor.mogrify(q, args_list)
 
         try:
             self.cursor.execute(query)
@@ -359,38 +464,103 @@ class ExecutionTable(BaseTable):
         else:
             return [Execution(x, self.sql_manager) for x in self.cursor]
 
-    def count(self, **kwargs):
+    def stream(self, fields=None, history=False, **kwargs):
+        """
+        Iterate over executions, newest first, without loading all of them in memory.
+
+        Rows are fetched in batches through a server-side cursor, use this for unbounded listings. The generator does not use the cursor of the table,
+        it can be consumed from another thread.
+
+        :param fields: the fields to fetch, as in select()
+        :param history: include archived executions
+        :param kwargs: filter executions based on their fields/columns
+        :return: a generator of executions
+        """
+        where, args_list = self._filters(kwargs)
+        query = self._select_query(fields, history) + where + ' ORDER BY execution.id DESC'
+
+        # WITH HOLD keeps the cursor open if another user of the connection commits while we iterate
+        cursor = self.sql_manager.conn.cursor(name='execution_stream_{}'.format(next(_stream_ids)), cursor_factory=psycopg2.extras.DictCursor, withhold=True)
+        cursor.itersize = self.STREAM_BATCH_SIZE
+        try:
+            cursor.execute(query, args_list)
+            for row in cursor:
+                yield Execution(row, self.sql_manager)
+        finally:
+            cursor.close()
+
+    def select_description(self, execution_id, history=False):
+        """Fetch only the ZApp description of an execution."""
+        self.cursor.execute('SELECT description FROM {} WHERE id = %s'.format(self._source(history)), (execution_id,))
+        row = self.cursor.fetchone()
+        if row is None:
+            return None
+        return row[0]
+
+    def delete(self, record_id, history=False):
+        """Delete an execution, with history set to True an archived execution is deleted from the history tables, with its services and ports."""
+        if not history:
+            super().delete(record_id)
+            return
+        self.cursor.execute('DELETE FROM port_history WHERE service_id IN (SELECT id FROM service_history WHERE execution_id = %s)', (record_id,))
+        self.cursor.execute('DELETE FROM service_history WHERE execution_id = %s', (record_id,))
+        self.cursor.execute('DELETE FROM execution_history WHERE id = %s', (record_id,))  # the monthly tables inherit from execution_history
+        self._record_changed(record_id)
+        self.sql_manager.commit()
+
+    # Executions that count against the user quotas
+    QUOTA_STATUSES = ('submitted', 'queued', 'starting', 'running', 'image download')
+
+    def active_usage(self, user_id):
+        """
+        Sum the resources reserved by the active executions of a user, in a single query.
+
+        The minimum reservations are read from the ZApp descriptions, so that executions still waiting for their services to be created are accounted for.
+
+        :param user_id: the user
+        :return: a tuple with the number of active executions, the reserved cores and the reserved memory
+        """
+        query = """SELECT COUNT(*), COALESCE(SUM(r.cores), 0), COALESCE(SUM(r.memory), 0) FROM execution
+            LEFT JOIN LATERAL (
+                SELECT SUM((s->'resources'->'cores'->>'min')::float * (s->>'total_count')::int) AS cores,
+                       SUM((s->'resources'->'memory'->>'min')::numeric * (s->>'total_count')::int) AS memory
+                FROM json_array_elements(execution.description->'services') AS s
+            ) AS r ON TRUE
+            WHERE execution.user_id = %s AND execution.status IN %s"""
+        self.cursor.execute(query, (user_id, self.QUOTA_STATUSES))
+        count, cores, memory = self.cursor.fetchone()
+        return count, float(cores), int(round(memory))
+
+    def update_kill_at(self, user_id=None, quota_id=None):
+        """Recompute the deadlines of the active executions after a change of run time limit, for one user or for all users with a given quota."""
+        query = """UPDATE execution SET kill_at = CASE WHEN quota.runtime_limit > 0 THEN execution.time_submit + quota.runtime_limit * INTERVAL '1 hour' END
+            FROM "user" JOIN quota ON quota.id = "user".quota_id
+            WHERE execution.user_id = "user".id AND execution.status IN %s"""
+        args = [Execution.ACTIVE_STATUSES]
+        if user_id is not None:
+            query += ' AND "user".id = %s'
+            args.append(user_id)
+        if quota_id is not None:
+            query += ' AND quota.id = %s'
+            args.append(quota_id)
+        self.cursor.execute(query, args)
+
+    def select_overdue(self, now: datetime.datetime):
+        """Return the active executions that have passed their deadline and can be terminated."""
+        q = self._select_query(None, False) + ' WHERE execution.kill_at <= %s AND execution.status IN %s ORDER BY execution.kill_at'
+        self.cursor.execute(q, (now, self.TERMINABLE_STATUSES))
+        return [Execution(x, self.sql_manager) for x in self.cursor]
+
+    def count(self, history=False, **kwargs):
         """
         Return a list of executions.
 
+        :param history: include archived executions
         :param kwargs: filter executions based on their fields/columns
         :return: one or more executions
         """
-        q_base = 'SELECT COUNT(*) FROM execution'
-        if len(kwargs) > 0:
-            q = q_base + " WHERE "
-            filter_list = []
-            args_list = []
-            for key, value in kwargs.items():
-                if key == 'earlier_than_submit':
-                    filter_list.append('"time_submit" <= to_timestamp(%s)')
-                elif key == 'earlier_than_start':
-                    filter_list.append('"time_start" <= to_timestamp(%s)')
-                elif key == 'earlier_than_end':
-                    filter_list.append('"time_end" <= to_timestamp(%s)')
-                elif key == 'later_than_submit':
-                    filter_list.append('"time_submit" >= to_timestamp(%s)')
-                elif key == 'later_than_start':
-                    filter_list.append('"time_start" >= to_timestamp(%s)')
-                elif key == 'later_than_end':
-                    filter_list.append('"time_end" >= to_timestamp(%s)')
-                else:
-                    filter_list.append('{} = %s'.format(key))
-                args_list.append(value)
-            q += ' AND '.join(filter_list)
-            query = self.cursor.mogrify(q, args_list)
-        else:
-            query = self.cursor.mogrify(q_base)
+        where, args_list = self._filters(kwargs)
+        query = self.cursor.mogrify('SELECT COUNT(*) FROM ' + self._source(history) + where, args_list)
 
         try:
             self.cursor.execute(query)
@@ -0,0 +1,91 @@
+# Copyright (c) 2017, Daniele Venzano
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Forward-only migrations of the Zoe SQL schema."""
+
+import logging
+
+log = logging.getLogger(__name__)
+
+# Version of the schema created from scratch by the create() methods of the tables, migrations are applied on top of it
+BASE_SCHEMA_VERSION = 7
+
+ACTIVE_EXECUTION_STATUSES = "('submitted', 'queued', 'starting', 'running', 'cleaning up', 'image download')"
+
+
+def _v8_query_indexes(cur):
+    """Indexes matching the queries run by the API, the scheduler and the back-end synchronizers."""
+    # Active executions are a tiny fraction of the table: used by the scheduler, the quota checks and the runtime limit enforcement
+    cur.execute('CREATE INDEX execution_active_status_idx ON execution (status, user_id) WHERE status IN ' + ACTIVE_EXECUTION_STATUSES)
+    # Per-user listings, ordered by id
+    cur.execute('CREATE INDEX execution_user_id_idx ON execution (user_id, id)')
+    cur.execute('CREATE INDEX execution_name_idx ON execution (name)')
+    cur.execute('CREATE INDEX service_execution_id_idx ON service (execution_id)')
+    cur.execute('CREATE INDEX service_backend_idx ON service (backend_host, backend_id)')
+    # Services running on a host, used for the status page and core limit adjustments
+    cur.execute("CREATE INDEX service_started_host_idx ON service (backend_host) WHERE backend_status = 'started'")
+    cur.execute('CREATE INDEX port_service_id_idx ON port (service_id)')
+
+
+def _v9_history_tables(cur):
+    """History tables for archived executions, services and ports."""
+    # Executions are partitioned by month of time_end, the monthly tables are created on demand by the archival
+    cur.execute('CREATE TABLE execution_history (LIKE execution, archived_at TIMESTAMP NOT NULL)')
+    cur.execute('CREATE TABLE service_history (LIKE service)')
+    cur.execute('CREATE INDEX service_history_execution_id_idx ON service_history (execution_id)')
+    cur.execute('CREATE INDEX service_history_id_idx ON service_history (id)')
+    cur.execute('CREATE TABLE port_history (LIKE port)')
+    cur.execute('CREATE INDEX port_history_service_id_idx ON port_history (service_id)')
+    cur.execute('''CREATE TABLE archive_run (
+        id SERIAL PRIMARY KEY,
+        time_start TIMESTAMP NOT NULL,
+        time_end TIMESTAMP NULL,
+        cutoff TIMESTAMP NOT NULL,
+        executions INT NOT NULL DEFAULT 0,
+        services INT NOT NULL DEFAULT 0,
+        ports INT NOT NULL DEFAULT 0
+    )''')
+    # Candidates for archival
+    cur.execute("CREATE INDEX execution_ended_idx ON execution (time_end) WHERE status IN ('terminated', 'error')")
+
+
+def _v10_kill_at(cur):
+    """Deadline column for the run time limit enforcement."""
+    cur.execute('ALTER TABLE execution ADD COLUMN kill_at TIMESTAMP NULL')
+    cur.execute('ALTER TABLE execution_history ADD COLUMN kill_at TIMESTAMP NULL')  # propagated to the monthly tables
+    cur.execute('''UPDATE execution SET kill_at = execution.time_submit + quota.runtime_limit * INTERVAL '1 hour'
+        FROM "user" JOIN quota ON quota.id = "user".quota_id
+        WHERE execution.user_id = "user".id AND quota.runtime_limit > 0 AND execution.status IN ''' + ACTIVE_EXECUTION_STATUSES)
+    cur.execute('CREATE INDEX execution_kill_at_idx ON execution (kill_at) WHERE status IN ' + ACTIVE_EXECUTION_STATUSES)
+
+
+def _v11_ended_time_submit(cur):
+    """Archival candidates without an end time, sorted by submission time."""
+    cur.execute('DROP INDEX execution_ended_idx')
+    cur.execute("CREATE INDEX execution_ended_idx ON execution (COALESCE(time_end, time_submit)) WHERE status IN ('terminated', 'error')")
+
+
+# Numbered migration steps, in order. Never modify a step once released, add a new one and increment SQL_SCHEMA_VERSION.
+MIGRATIONS = [
+    (8, _v8_query_indexes),
+    (9, _v9_history_tables),
+    (10, _v10_kill_at),
+    (11, _v11_ended_time_submit),
+]
+
+
+def pending_migrations(from_version):
+    """Returns the migration steps that need to be applied to a schema at from_version."""
+    return [(version, step) for version, step in MIGRATIONS if version > from_version]
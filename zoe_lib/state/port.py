@@ -26,6 +26,7 @@ log = logging.getLogger(__name__)
 
 class Port(BaseRecord):
     """A tcp or udp port that should be exposed by the backend."""
+    __slots__ = ('internal_name', 'external_ip', 'external_port', 'description', 'internal_number', 'protocol', 'url_template', 'readable_name', 'enable_proxy')
 
     def __init__(self, d, sql_manager):
         super().__init__(d, sql_manager)
@@ -76,6 +77,8 @@ class Port(BaseRecord):
 
 class PortTable(BaseTable):
     """Abstraction for the port table in the database."""
+    COLUMNS = ('id', 'service_id', 'internal_name', 'external_ip', 'external_port', 'description')
+
     def __init__(self, sql_manager):
         super().__init__(sql_manager, "port")
 
@@ -97,7 +100,7 @@ class PortTable(BaseTable):
         self.sql_manager.commit()
         return self.cursor.fetchone()[0]
 
-    def select(self, only_one=False, limit=-1, **kwargs):
+    def select(self, only_one=False, limit=-1, history=False, **kwargs):
         """
         Return a list of ports.
 
@@ -105,10 +108,15 @@ class PortTable(BaseTable):
         :type only_one: bool
         :param limit: limit the result to this number of entries
         :type limit: int
+        :param history: include the ports of archived services
+        :type history: bool
         :param kwargs: filter services based on their fields/columns
         :return: one or more ports
         """
-        q_base = 'SELECT * FROM port'
+        if history:
+            q_base = 'SELECT * FROM (SELECT {0} FROM port UNION ALL SELECT {0} FROM port_history) AS port'.format(', '.join(self.COLUMNS))
+        else:
+            q_base = 'SELECT * FROM port'
         if len(kwargs) > 0:
             q = q_base + " WHERE "
             filter_list = []
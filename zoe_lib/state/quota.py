@@ -24,6 +24,7 @@ log = logging.getLogger(__name__)
 
 class Quota(BaseRecord):
     """A quota object describes limits imposed to users on resource usage."""
+    __slots__ = ('name', 'concurrent_executions', 'memory', 'cores', 'runtime_limit')
 
     def __init__(self, d, sql_manager):
         super().__init__(d, sql_manager)
@@ -48,22 +49,22 @@ class Quota(BaseRecord):
     def set_concurrent_executions(self, value):
         """Setter for concurrent execution limit."""
         self.concurrent_executions = value
-        self.sql_manager.quota_update(self.id, concurrent_executions=value)
+        self.sql_manager.quota.update(self.id, concurrent_executions=value)
 
     def set_memory(self, value):
         """Setter for memory limit."""
         self.memory = value
-        self.sql_manager.quota_update(self.id, memory=value)
+        self.sql_manager.quota.update(self.id, memory=value)
 
     def set_cores(self, value):
         """Setter for cores limit."""
         self.cores = value
-        self.sql_manager.quota_update(self.id, cores=value)
+        self.sql_manager.quota.update(self.id, cores=value)
 
     def set_runtime_limit(self, value):
         """Setter for the runtime limit."""
         self.runtime_limit = value
-        self.sql_manager.quota_update(self.id, runtime_limit=value)
+        self.sql_manager.quota.update(self.id, runtime_limit=value)
 
     def __repr__(self):
         return self.name
@@ -77,9 +78,16 @@ class Quota(BaseRecord):
 
 class QuotaTable(BaseTable):
     """Abstraction for the quota table in the database."""
+    cached_columns = ('id',)
+
     def __init__(self, sql_manager):
         super().__init__(sql_manager, "quota")
 
+    def _updating(self, record_id, fields):
+        """Keep the deadlines of the active executions in sync with the run time limit."""
+        if 'runtime_limit' in fields:
+            self.sql_manager.executions.update_kill_at(quota_id=record_id)
+
     def create(self):
         """Create the quota table."""
         self.cursor.execute('''CREATE TABLE quota (
@@ -101,6 +109,10 @@ class QuotaTable(BaseTable):
         :param kwargs: filter services based on their fields/columns
         :return: one or more ports
         """
+        cached = self._cache_get(only_one, kwargs)
+        if cached is not None:
+            return cached
+
         q_base = 'SELECT * FROM quota'
         if len(kwargs) > 0:
             q = q_base + " WHERE "
@@ -119,7 +131,9 @@ class QuotaTable(BaseTable):
             row = self.cursor.fetchone()
             if row is None:
                 return None
-            return Quota(row, self.sql_manager)
+            record = Quota(row, self.sql_manager)
+            self._cache_put(kwargs, record)
+            return record
         else:
             return [Quota(x, self.sql_manager) for x in self.cursor]
 
@@ -136,4 +150,5 @@ class QuotaTable(BaseTable):
         self.cursor.execute(query, (record_id,))
         query = "DELETE FROM quota WHERE id = %s"
         self.cursor.execute(query, (record_id,))
+        self._record_changed(record_id)
         self.sql_manager.commit()
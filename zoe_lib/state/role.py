@@ -24,6 +24,7 @@ log = logging.getLogger(__name__)
 
 class Role(BaseRecord):
     """A role object describes the permissions of groups of users."""
+    __slots__ = ('name', 'can_see_status', 'can_change_config', 'can_operate_others', 'can_delete_executions', 'can_access_api', 'can_customize_resources', 'can_access_full_zapp_shop')
 
     def __init__(self, d, sql_manager):
         super().__init__(d, sql_manager)
@@ -63,6 +64,8 @@ class Role(BaseRecord):
 
 class RoleTable(BaseTable):
     """Abstraction for the role table in the database."""
+    cached_columns = ('id',)
+
     def __init__(self, sql_manager):
         super().__init__(sql_manager, "role")
 
@@ -92,6 +95,10 @@ class RoleTable(BaseTable):
         :param kwargs: filter services based on their fields/columns
         :return: one or more ports
         """
+        cached = self._cache_get(only_one, kwargs)
+        if cached is not None:
+            return cached
+
         q_base = 'SELECT * FROM role'
         if len(kwargs) > 0:
             q = q_base + " WHERE "
@@ -110,7 +117,9 @@ class RoleTable(BaseTable):
             row = self.cursor.fetchone()
             if row is None:
                 return None
-            return Role(row, self.sql_manager)
+            record = Role(row, self.sql_manager)
+            self._cache_put(kwargs, record)
+            return record
         else:
             return [Role(x, self.sql_manager) for x in self.cursor]
 
@@ -127,4 +136,5 @@ class RoleTable(BaseTable):
         self.cursor.execute(query, (role_id,))
         query = "DELETE FROM role WHERE id = %s"
         self.cursor.execute(query, (role_id,))
+        self._record_changed(role_id)
         self.sql_manager.commit()
@@ -18,6 +18,7 @@
 import logging
 
 from zoe_lib.config import get_conf
+import zoe_lib.exceptions
 
 from zoe_lib.state.base import BaseTable, BaseRecord
 
@@ -111,55 +112,139 @@ class Service(BaseRecord):
     BACKEND_DESTROY_STATUS = 'destroyed'
     BACKEND_OOM_STATUS = 'oom-killed'
 
+    __slots__ = ('name', 'status', 'error_message', 'execution_id', '_description', '_description_loaded', 'service_group', 'backend_id', 'backend_status', 'backend_host', 'restart_count', 'ip_address', 'essential', 'archived',
+                 '_parsed', '_image_name', '_is_monitor', '_startup_order', '_environment', '_command', '_resource_reservation', '_volumes', '_work_dir', '_load_balancer', '_labels', '_network')
+
     def __init__(self, d, sql_manager):
         super().__init__(d, sql_manager)
 
-        self.name = d['name']
-        self.status = d['status']
-        self.error_message = d['error_message']
-        self.execution_id = d['execution_id']
-        self.description = d['description']
-        self.service_group = d['service_group']
-        self.backend_id = d['backend_id']
-        self.backend_status = d['backend_status']
-        self.backend_host = d['backend_host']
-        self.restart_count = d['restart_count']
-
-        self.ip_address = d['ip_address']
+        # Records selected with a field list have None in the fields that were not selected
+        self.name = d.get('name')
+        self.status = d.get('status')
+        self.error_message = d.get('error_message')
+        self.execution_id = d.get('execution_id')
+        self._description = d.get('description')  # loaded on first access if not selected
+        self._description_loaded = 'description' in d
+        self.service_group = d.get('service_group')
+        self.backend_id = d.get('backend_id')
+        self.backend_status = d.get('backend_status')
+        self.backend_host = d.get('backend_host')
+        self.restart_count = d.get('restart_count')
+
+        self.ip_address = d.get('ip_address')
         if self.ip_address is not None and ('/32' in self.ip_address or '/128' in self.ip_address):
             self.ip_address = self.ip_address.split('/')[0]
 
-        self.essential = d['essential']
-
-        # Fields parsed from the JSON description
-        self.image_name = self.description['image']
-        self.is_monitor = self.description['monitor']
-        self.startup_order = self.description['startup_order']
-        self.environment = self.description['environment']
-        self.command = self.description['command']
-        self.resource_reservation = ResourceReservation(self.description['resources'])
-        self.volumes = [VolumeDescriptionHostPath(v['name'], v['path'], v['read_only']) for v in self.description['volumes']]
+        self.essential = d.get('essential')
+        self.archived = bool(d.get('archived'))  # True if selected from the history tables
+
+        # Fields parsed from the JSON description on first access
+        self._parsed = False
+        self._image_name = None
+        self._is_monitor = None
+        self._startup_order = None
+        self._environment = None
+        self._command = None
+        self._resource_reservation = None
+        self._volumes = None
+        self._work_dir = None
+        self._load_balancer = None
+        self._labels = None
+        self._network = None
+
+    def _parse_description(self):
+        """Parse the fields derived from the JSON description."""
+        if self._parsed:
+            return
+        description = self.description
+        self._image_name = description['image']
+        self._is_monitor = description['monitor']
+        self._startup_order = description['startup_order']
+        self._environment = description['environment']
+        self._command = description['command']
+        self._resource_reservation = ResourceReservation(description['resources'])
+        self._volumes = [VolumeDescriptionHostPath(v['name'], v['path'], v['read_only']) for v in description['volumes']]
 
         # Optional zapp fields
-        try:
-            self.work_dir = self.description['work_dir']
-        except KeyError:
-            self.work_dir = None
-
-        try:
-            self.load_balancer = self.description['loadBalancer']
-        except KeyError:
-            self.load_balancer = None
-
-        try:
-            self.labels = self.description['labels']
-        except KeyError:
-            self.labels = []
-
-        try:
-            self.network = self.description['network']
-        except KeyError:
-            self.network = None
+        self._work_dir = description.get('work_dir', None)
+        self._load_balancer = description.get('loadBalancer', None)
+        self._labels = description.get('labels', [])
+        self._network = description.get('network', None)
+        self._parsed = True
+
+    @property
+    def description(self):
+        """The service description from the ZApp, loaded on first access for records selected with a field list."""
+        if not self._description_loaded:  # also when the record has been deleted in the meantime
+            self._description = self.sql_manager.services.select_description(self.id, history=self.archived)
+            self._description_loaded = True
+        return self._description
+
+    @property
+    def image_name(self):
+        """The container image."""
+        self._parse_description()
+        return self._image_name
+
+    @property
+    def is_monitor(self):
+        """True if the execution terminates when this service terminates."""
+        self._parse_description()
+        return self._is_monitor
+
+    @property
+    def startup_order(self):
+        """Services with a lower startup order are started first."""
+        self._parse_description()
+        return self._startup_order
+
+    @property
+    def environment(self):
+        """The environment variables, as a list of name, value pairs."""
+        self._parse_description()
+        return self._environment
+
+    @property
+    def command(self):
+        """The command to run, None to use the image default."""
+        self._parse_description()
+        return self._command
+
+    @property
+    def resource_reservation(self) -> ResourceReservation:
+        """The memory and cores reserved for this service."""
+        self._parse_description()
+        return self._resource_reservation
+
+    @property
+    def volumes(self):
+        """The volumes to mount."""
+        self._parse_description()
+        return self._volumes
+
+    @property
+    def work_dir(self):
+        """The working directory, None to use the image default."""
+        self._parse_description()
+        return self._work_dir
+
+    @property
+    def load_balancer(self):
+        """Load balancer configuration, used by the Kubernetes back-end."""
+        self._parse_description()
+        return self._load_balancer
+
+    @property
+    def labels(self):
+        """The labels a node must have to run this service."""
+        self._parse_description()
+        return self._labels
+
+    @property
+    def network(self):
+        """The network to attach to, None for the default one."""
+        self._parse_description()
+        return self._network
 
     def serialize(self):
         """Generates a dictionary that can be serialized in JSON."""
@@ -253,13 +338,13 @@ class Service(BaseRecord):
     @property
     def user_id(self):
         """Getter for the user_id, that is actually taken from the parent execution."""
-        execution = self.sql_manager.executions.select(only_one=True, id=self.execution_id)
+        execution = self.sql_manager.executions.select(only_one=True, id=self.execution_id, fields=['user_id'], history=self.archived)
         return execution.user_id
 
     @property
     def ports(self):
         """Getter for the ports exposed by this service."""
-        return self.sql_manager.ports.select(service_id=self.id)
+        return self.sql_manager.ports.select(service_id=self.id, history=self.archived)
 
     @property
     def proxy_address(self):
@@ -281,7 +366,7 @@ class Service(BaseRecord):
     @property
     def execution(self):
         """Return the parent execution."""
-        return self.sql_manager.executions.select(only_one=True, id=self.execution_id)
+        return self.sql_manager.executions.select(only_one=True, id=self.execution_id, history=self.archived)
 
     def restarted(self):
         """The service has restarted, keep track in the database."""
@@ -291,6 +376,8 @@ class Service(BaseRecord):
 
 class ServiceTable(BaseTable):
     """Abstraction for the service table in the database."""
+    COLUMNS = ('id', 'status', 'error_message', 'description', 'execution_id', 'service_group', 'name', 'backend_id', 'backend_status', 'backend_host', 'ip_address', 'essential', 'restart_count')
+
     def __init__(self, sql_manager):
         super().__init__(sql_manager, "service")
 
@@ -320,7 +407,13 @@ class ServiceTable(BaseTable):
         self.sql_manager.commit()
         return self.cursor.fetchone()[0]
 
-    def select(self, only_one=False, limit=-1, **kwargs):
+    def _source(self, history):
+        """The services to select from, including the archived ones if history is True."""
+        if not history:
+            return 'service'
+        return '(SELECT {0}, FALSE AS archived FROM service UNION ALL SELECT {0}, TRUE AS archived FROM service_history) AS service'.format(', '.join(self.COLUMNS))
+
+    def select(self, only_one=False, limit=-1, fields=None, history=False, **kwargs):
         """
         Return a list of services.
 
@@ -328,10 +421,23 @@ class ServiceTable(BaseTable):
         :type only_one: bool
         :param limit: limit the result to this number of entries
         :type limit: int
-        :param kwargs: filter services based on their fields/columns
+        :param fields: the columns to fetch, all of them if None. The description is loaded only if accessed.
+        :type fields: list
+        :param history: include the services of archived executions
+        :type history: bool
+        :param kwargs: filter services based on their fields/columns, a list value matches any of its elements
         :return: one or more services
         """
-        q_base = 'SELECT * FROM service'
+        if fields is None:
+            q_base = 'SELECT * FROM ' + self._source(history)
+        else:
+            for field in fields:
+                if field not in self.COLUMNS:
+                    raise zoe_lib.exceptions.ZoeLibException('Unknown service field {}'.format(field))
+            columns = ['id'] + [f for f in fields if f != 'id']
+            if history:
+                columns.append('archived')
+            q_base = 'SELECT {} FROM {}'.format(', '.join(columns), self._source(history))
         if len(kwargs) > 0:
             q = q_base + " WHERE "
             filter_list = []
@@ -339,6 +445,9 @@ class ServiceTable(BaseTable):
             for key, value in kwargs.items():
                 if key.startswith('not_'):
                     filter_list.append('{} != %s'.format(key[4:]))
+                elif isinstance(value, (list, tuple)):
+                    filter_list.append('{} = ANY(%s)'.format(key))
+                    value = list(value)
                 else:
                     filter_list.append('{} = %s'.format(key))
                 args_list.append(value)
@@ -359,3 +468,29 @@ class ServiceTable(BaseTable):
             return Service(row, self.sql_manager)
         else:
             return [Service(x, self.sql_manager) for x in self.cursor]
+
+    def update_backend_status(self, statuses):
+        """
+        Change the backend status of many services in one transaction, with the same side effects as Service.set_backend_status().
+
+        :param statuses: a dictionary mapping service IDs to their new backend status
+        """
+        if len(statuses) == 0:
+            return
+        values = ','.join(self.cursor.mogrify('(%s, %s)', (service_id, status)).decode('utf-8') for service_id, status in statuses.items())
+        self.cursor.execute('''UPDATE service SET backend_status = v.status,
+            ip_address = CASE WHEN v.status = %s THEN service.ip_address END,
+            backend_id = CASE WHEN v.status != %s THEN service.backend_id END
+            FROM (VALUES ''' + values + ''') AS v(id, status) WHERE service.id = v.id''', (Service.BACKEND_START_STATUS, Service.BACKEND_DESTROY_STATUS))
+        dead = [service_id for service_id, status in statuses.items() if status != Service.BACKEND_START_STATUS]
+        if len(dead) > 0:
+            self.cursor.execute('UPDATE port SET external_ip = NULL, external_port = NULL WHERE service_id = ANY(%s)', (dead,))
+        self.sql_manager.commit()
+
+    def select_description(self, service_id, history=False):
+        """Fetch only the description of a service."""
+        self.cursor.execute('SELECT description FROM {} WHERE id = %s'.format(self._source(history)), (service_id,))
+        row = self.cursor.fetchone()
+        if row is None:
+            return None
+        return row[0]
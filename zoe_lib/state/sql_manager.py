@@ -15,7 +15,9 @@
 
 """Interface to PostgresQL for Zoe state."""
 
+import copy
 import logging
+import threading
 
 import psycopg2
 import psycopg2.extras
@@ -24,6 +26,9 @@ from zoe_lib.config import get_conf
 from zoe_lib.version import SQL_SCHEMA_VERSION
 import zoe_lib.exceptions
 
+from .archive import ArchiveTable
+from .cache import RecordCache
+from .migrations import BASE_SCHEMA_VERSION, MIGRATIONS, pending_migrations
 from .service import ServiceTable
 from .execution import ExecutionTable
 from .port import PortTable
@@ -46,16 +51,63 @@ class SQLManager:
         self.dbname = conf.dbname
         self.schema = conf.deployment_name
         self.conn = None
+        self.cache = RecordCache(conf.dbcache_ttl)
+        self.listen_conn = None
+        self._listen_lock = threading.Lock()
+        self._tables = threading.local()
+        self._changed = []
+        self._generation = 0
         self._connect()
+        self._connect_listener()
+
+    def _dsn(self):
+        return 'dbname=' + self.dbname + \
+               ' user=' + self.dbuser + \
+               ' password=' + self.password + \
+               ' host=' + self.host + \
+               ' port=' + str(self.port)
 
     def _connect(self):
-        dsn = 'dbname=' + self.dbname + \
-              ' user=' + self.dbuser + \
-              ' password=' + self.password + \
-              ' host=' + self.host + \
-              ' port=' + str(self.port)
+        self.conn = psycopg2.connect(self._dsn())
+        self._generation += 1
+
+    @property
+    def _change_channel(self):
+        return 'zoe_state_{}'.format(self.schema)
+
+    def _connect_listener(self):
+        """Open a dedicated connection to receive record change notifications sent by other Zoe processes."""
+        if not self.cache.enabled:
+            return
+        try:
+            self.listen_conn = psycopg2.connect(self._dsn())
+            self.listen_conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+            self.listen_conn.cursor().execute('LISTEN {}'.format(self._change_channel))
+        except psycopg2.Error as e:
+            log.warning('Cannot listen for state changes, cached records may be stale for up to {} seconds: {}'.format(self.cache.ttl, e))
+            self.listen_conn = None
+
+    def poll_changes(self):
+        """Apply the cache invalidations notified by other Zoe processes."""
+        if self.listen_conn is None:
+            return
+        with self._listen_lock:
+            try:
+                self.listen_conn.poll()
+            except psycopg2.Error:
+                log.warning('Lost the state change notification connection, reconnecting')
+                self.cache.clear()
+                self._connect_listener()
+                return
+            while self.listen_conn.notifies:
+                notify = self.listen_conn.notifies.pop(0)
+                table, record_id = notify.payload.split(':')
+                self.cache.invalidate(table, int(record_id))
 
-        self.conn = psycopg2.connect(dsn)
+    def record_changed(self, cursor, table, record_id):
+        """Invalidate a cached record when the transaction that modifies it commits, here and in all other Zoe processes."""
+        self._changed.append((table, record_id))
+        cursor.execute('SELECT pg_notify(%s, %s)', (self._change_channel, '{}:{}'.format(table, record_id)))
 
     def cursor(self):
         """Get a cursor, making sure the connection to the database is established."""
@@ -75,36 +127,86 @@ class SQLManager:
     def commit(self):
         """Commit a transaction."""
         self.conn.commit()
+        # After the commit, so that a select running in another thread cannot cache the old version of the record again
+        changed, self._changed = self._changed, []
+        for table, record_id in changed:
+            self.cache.invalidate(table, record_id)
+
+    def rollback(self):
+        """Abort a transaction."""
+        self.conn.rollback()
+        self._changed = []
+        self._generation += 1  # the rollback also reverted the search path set by the cursors
+
+    def _table(self, table_class):
+        """The table object of the calling thread, created again when its cursor can no longer be used."""
+        tables = getattr(self._tables, 'tables', None)
+        if tables is None or self._tables.generation != self._generation:
+            tables = self._tables.tables = {}
+            self._tables.generation = self._generation
+        table = tables.get(table_class)
+        if table is None or table.cursor.closed or self.conn.get_transaction_status() == psycopg2.extensions.TRANSACTION_STATUS_INERROR:
+            table = table_class(self)  # cursor() reconnects if needed
+            if self._tables.generation != self._generation:
+                tables = self._tables.tables = {}
+                self._tables.generation = self._generation
+            tables[table_class] = table
+        return table
+
+    def session(self) -> 'SQLManager':
+        """
+        A manager with a connection of its own, that shares the record cache of this one.
+
+        Its transactions are not committed by the other threads that use this manager: use it for row locks that must be held across several queries.
+        """
+        other = copy.copy(self)
+        other.listen_conn = None  # the change notifications are received by this manager
+        other._tables = threading.local()  # pylint: disable=protected-access
+        other._changed = []  # pylint: disable=protected-access
+        other._connect()  # pylint: disable=protected-access
+        return other
+
+    def close(self):
+        """Close the connections to the database."""
+        if self.listen_conn is not None:
+            self.listen_conn.close()
+            self.listen_conn = None
+        self.conn.close()
 
     @property
     def executions(self) -> ExecutionTable:
         """Access the execution state."""
-        return ExecutionTable(self)
+        return self._table(ExecutionTable)
 
     @property
     def services(self) -> ServiceTable:
         """Access the service state."""
-        return ServiceTable(self)
+        return self._table(ServiceTable)
 
     @property
     def ports(self) -> PortTable:
         """Access the port state."""
-        return PortTable(self)
+        return self._table(PortTable)
 
     @property
     def quota(self) -> QuotaTable:
         """Access the quota state."""
-        return QuotaTable(self)
+        return self._table(QuotaTable)
 
     @property
     def role(self) -> RoleTable:
         """Access the role state."""
-        return RoleTable(self)
+        return self._table(RoleTable)
 
     @property
     def user(self) -> UserTable:
         """Access the user state."""
-        return UserTable(self)
+        return self._table(UserTable)
+
+    @property
+    def archive(self) -> ArchiveTable:
+        """Access the execution history."""
+        return self._table(ArchiveTable)
 
     def _create_tables(self):
         self.quota.create()
@@ -117,33 +219,60 @@ class SQLManager:
     def init_db(self, force=False):
         """DB init entrypoint."""
         cur = self.conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+        # A session lock survives the commit of each migration step, it keeps other Zoe processes out until the schema is up to date
+        lock_name = 'zoe_schema_{}'.format(get_conf().deployment_name)
+        cur.execute('SELECT pg_advisory_lock(hashtext(%s))', (lock_name,))
+        try:
+            cur.execute("CREATE TABLE IF NOT EXISTS public.versions (deployment text, version integer)")
 
-        cur.execute("CREATE TABLE IF NOT EXISTS public.versions (deployment text, version integer)")
+            cur.execute('SET search_path TO {},public'.format(get_conf().deployment_name))
 
-        cur.execute('SET search_path TO {},public'.format(get_conf().deployment_name))
+            if force:
+                self.cache.clear()
+                cur.execute("DELETE FROM public.versions WHERE deployment = %s", (get_conf().deployment_name,))
+                cur.execute('DROP SCHEMA IF EXISTS {} CASCADE'.format(get_conf().deployment_name))
 
-        if force:
-            cur.execute("DELETE FROM public.versions WHERE deployment = %s", (get_conf().deployment_name,))
-            cur.execute('DROP SCHEMA IF EXISTS {} CASCADE'.format(get_conf().deployment_name))
+            version = self._check_schema_version(cur, get_conf().deployment_name)
+            if version is None:
+                self._create_tables()
+                version = BASE_SCHEMA_VERSION
 
-        if not self._check_schema_version(cur, get_conf().deployment_name):
-            self._create_tables()
+            self._migrate(cur, get_conf().deployment_name, version)
 
-        self.commit()
-        cur.close()
+            self.commit()
+        except Exception:
+            self.rollback()
+            raise
+        finally:
+            try:
+                cur.execute('SELECT pg_advisory_unlock(hashtext(%s))', (lock_name,))
+                self.commit()
+            except psycopg2.Error:  # the lock is released anyway when the connection is closed
+                log.warning('Cannot release the schema lock of deployment {}'.format(get_conf().deployment_name))
+            cur.close()
 
     def _check_schema_version(self, cur, deployment_name):
-        """Check if the schema version matches this source code version."""
+        """Check if the schema version can be used or migrated by this source code version, returns None for new deployments."""
+        assert MIGRATIONS[-1][0] == SQL_SCHEMA_VERSION
         cur.execute("SELECT version FROM public.versions WHERE deployment = %s", (deployment_name,))
         row = cur.fetchone()
         if row is None:
-            cur.execute("INSERT INTO public.versions (deployment, version) VALUES (%s, %s)", (deployment_name, SQL_SCHEMA_VERSION))
+            cur.execute("INSERT INTO public.versions (deployment, version) VALUES (%s, %s)", (deployment_name, BASE_SCHEMA_VERSION))
             cur.execute("SELECT EXISTS(SELECT 1 FROM pg_catalog.pg_namespace WHERE nspname = %s)", (deployment_name,))
             if not cur.fetchone()[0]:
                 cur.execute('CREATE SCHEMA {}'.format(deployment_name))
-            return False  # Tables need to be created
+            return None  # Tables need to be created
+        elif row[0] > SQL_SCHEMA_VERSION:
+            raise zoe_lib.exceptions.ZoeLibException('SQL database schema version {} is newer than this version of Zoe supports ({})'.format(row[0], SQL_SCHEMA_VERSION))
+        elif row[0] < BASE_SCHEMA_VERSION:
+            raise zoe_lib.exceptions.ZoeLibException('SQL database schema version {} is too old to be migrated, need at least {}'.format(row[0], BASE_SCHEMA_VERSION))
         else:
-            if row[0] == SQL_SCHEMA_VERSION:
-                return True
-            else:
-                raise zoe_lib.exceptions.ZoeLibException('SQL database schema version mismatch: need {}, found {}'.format(SQL_SCHEMA_VERSION, row[0]))
+            return row[0]
+
+    def _migrate(self, cur, deployment_name, from_version):
+        """Apply the pending schema migrations, each one in its own transaction."""
+        for version, step in pending_migrations(from_version):
+            log.info('Migrating SQL schema of deployment {} to version {}: {}'.format(deployment_name, version, step.__doc__))
+            step(cur)
+            cur.execute("UPDATE public.versions SET version = %s WHERE deployment = %s", (version, deployment_name))
+            self.commit()
@@ -0,0 +1,102 @@
+# Copyright (c) 2017, Daniele Venzano
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Test the archival of old executions against a real PostgreSQL database."""
+
+from argparse import Namespace
+import datetime
+
+import psycopg2
+import pytest
+
+from zoe_lib.config import load_configuration, get_conf
+from zoe_lib.state import SQLManager
+from zoe_lib.state.archive import ARCHIVE_LOCK_ID
+from zoe_lib.tests.config_mock import zoe_configuration  # pylint: disable=unused-import
+
+SERVICE_DESCRIPTION = {
+    'name': 'test', 'image': 'test', 'monitor': True, 'startup_order': 0, 'environment': [], 'command': None, 'volumes': [],
+    'resources': {'memory': {'min': 1, 'max': 1}, 'cores': {'min': 1, 'max': 1}},
+    'ports': [{'name': 'http', 'port_number': 80, 'protocol': 'tcp', 'url_template': 'http://{ip_port}/'}]
+}
+
+
+class TestArchive:
+    """Test moving executions to the history tables."""
+
+    @pytest.fixture
+    def sql_manager(self, zoe_configuration):  # pylint: disable=redefined-outer-name
+        """A SQLManager connected to a freshly initialized test deployment."""
+        conf = Namespace(**vars(zoe_configuration))
+        conf.deployment_name = 'test_archive'
+        load_configuration(conf)
+        try:
+            sql_manager = SQLManager(conf)
+        except psycopg2.OperationalError:
+            pytest.skip('PostgreSQL is not available')
+        sql_manager.init_db(force=True)
+        yield sql_manager
+        cur = sql_manager.cursor()
+        cur.execute("DELETE FROM public.versions WHERE deployment = %s", (conf.deployment_name,))
+        cur.execute('DROP SCHEMA {} CASCADE'.format(conf.deployment_name))
+        sql_manager.commit()
+
+    def _execution(self, sql_manager, time_end):
+        """Create a terminated execution with one service and one port."""
+        execution_id = sql_manager.executions.insert('test', 1, {'name': 'test', 'size': 1, 'services': [SERVICE_DESCRIPTION]})
+        service_id = sql_manager.services.insert(execution_id, 'test', 'test', SERVICE_DESCRIPTION, True)
+        sql_manager.ports.insert(service_id, 'http/tcp', SERVICE_DESCRIPTION['ports'][0])
+        sql_manager.executions.update(execution_id, status='terminated', time_end=time_end)
+        return execution_id
+
+    def test_archive(self, sql_manager):
+        """Old executions are moved to the history tables and can still be selected."""
+        old_id = self._execution(sql_manager, datetime.datetime(2017, 3, 5))
+        new_id = self._execution(sql_manager, datetime.datetime.utcnow())
+
+        run = sql_manager.archive.archive(datetime.datetime.utcnow() - datetime.timedelta(days=30))
+        assert (run.executions, run.services, run.ports) == (1, 1, 1)
+        assert not run.is_running
+
+        assert [e.id for e in sql_manager.executions.select()] == [new_id]
+        assert sql_manager.executions.count(history=True) == 2
+        archived = sql_manager.executions.select(only_one=True, id=old_id, history=True)
+        assert archived.archived
+        assert [len(s.ports) for s in archived.services] == [1]
+        assert archived.description['name'] == 'test'
+
+        sql_manager.executions.delete(old_id, history=True)
+        assert sql_manager.executions.select(only_one=True, id=old_id, history=True) is None
+        assert sql_manager.services.select(execution_id=old_id, history=True) == []
+
+    def test_archive_no_end_time(self, sql_manager):
+        """Executions that failed without an end time are archived by submission time."""
+        execution_id = sql_manager.executions.insert('test', 1, {'name': 'test', 'size': 1, 'services': [SERVICE_DESCRIPTION]})
+        sql_manager.executions.update(execution_id, status='error', time_submit=datetime.datetime(2017, 3, 5))
+
+        run = sql_manager.archive.archive(datetime.datetime.utcnow() - datetime.timedelta(days=30))
+        assert run.executions == 1
+        archived = sql_manager.executions.select(only_one=True, id=execution_id, history=True)
+        assert archived.archived
+        assert archived.time_end is None
+
+    def test_archive_locked(self, sql_manager):
+        """Only one archival runs at a time."""
+        other = SQLManager(get_conf())
+        other.cursor().execute('SELECT pg_advisory_lock(%s)', (ARCHIVE_LOCK_ID,))
+        try:
+            assert sql_manager.archive.archive(datetime.datetime.utcnow()) is None
+        finally:
+            other.close()
@@ -0,0 +1,150 @@
+# Copyright (c) 2017, Daniele Venzano
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Test the record identity map."""
+
+from collections import namedtuple
+
+import psycopg2.extensions
+
+from zoe_lib.state.cache import RecordCache
+from zoe_lib.state.sql_manager import SQLManager
+from zoe_lib.state.user import UserTable
+
+FakeRecord = namedtuple('FakeRecord', ['id', 'name'])
+Conf = namedtuple('Conf', ['dbuser', 'dbpass', 'dbhost', 'dbport', 'dbname', 'dbcache_ttl', 'deployment_name'])
+
+
+class FakeCursor:
+    """A cursor that records the queries it executes."""
+    def __init__(self, connection):
+        self.connection = connection
+        self.closed = False
+
+    def execute(self, query, args=None):
+        """Record the query."""
+        self.connection.queries.append(query)
+
+
+class FakeConnection:
+    """A connection that is always idle, commits are recorded."""
+    def __init__(self):
+        self.queries = []
+        self.cursors = 0
+        self.events = []
+
+    def cursor(self, cursor_factory=None):
+        """A new cursor."""
+        self.cursors += 1
+        return FakeCursor(self)
+
+    def commit(self):
+        """Record the commit."""
+        self.events.append('commit')
+
+    def rollback(self):
+        """Record the rollback."""
+        self.events.append('rollback')
+
+    @staticmethod
+    def get_transaction_status():
+        """Always idle."""
+        return psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+
+class FakeSQLManager(SQLManager):
+    """An SQL manager that does not connect to a database."""
+    def __init__(self):
+        super().__init__(Conf(dbuser='', dbpass='', dbhost='', dbport=5432, dbname='', dbcache_ttl=60, deployment_name='test'))
+
+    def _connect(self):
+        self.conn = FakeConnection()
+        self._generation += 1
+
+    def _connect_listener(self):
+        pass
+
+
+class TestRecordCache:
+    """Test the RecordCache class."""
+
+    def test_get_put(self):
+        """Cached records are returned by any of their lookup columns."""
+        cache = RecordCache(60)
+        user = FakeRecord(1, 'alice')
+        cache.put('user', 'id', 1, user)
+        cache.put('user', 'username', 'alice', user)
+        assert cache.get('user', 'id', 1) is user
+        assert cache.get('user', 'username', 'alice') is user
+        assert cache.get('user', 'id', 2) is None
+
+    def test_ttl(self):
+        """Expired records are not returned and a zero TTL disables the cache."""
+        cache = RecordCache(-1)
+        cache.put('user', 'id', 1, FakeRecord(1, 'alice'))
+        assert cache.get('user', 'id', 1) is None
+        cache = RecordCache(0)
+        cache.put('user', 'id', 1, FakeRecord(1, 'alice'))
+        assert cache.get('user', 'id', 1) is None
+
+    def test_invalidate(self):
+        """Invalidation drops all keys of a record and the records that depend on it."""
+        cache = RecordCache(60)
+        alice = FakeRecord(1, 'alice')
+        cache.put('user', 'id', 1, alice)
+        cache.put('user', 'username', 'alice', alice)
+        cache.put('user', 'id', 2, FakeRecord(2, 'bob'))
+        cache.put('role', 'id', 1, FakeRecord(1, 'admin'))
+        cache.invalidate('user', 1)
+        assert cache.get('user', 'id', 1) is None
+        assert cache.get('user', 'username', 'alice') is None
+        assert cache.get('user', 'id', 2) is not None
+        cache.invalidate('role', 1)
+        assert cache.get('role', 'id', 1) is None
+        assert cache.get('user', 'id', 2) is None
+
+    def test_generation(self):
+        """A record read before an invalidation is not cached."""
+        cache = RecordCache(60)
+        generation = cache.generation
+        cache.invalidate('user', 1)
+        cache.put('user', 'id', 1, FakeRecord(1, 'alice'), generation)
+        assert cache.get('user', 'id', 1) is None
+        cache.put('user', 'id', 1, FakeRecord(1, 'alice'), cache.generation)
+        assert cache.get('user', 'id', 1) is not None
+
+
+class TestSQLManagerCache:
+    """Test the table reuse and the invalidations of the SQL manager."""
+
+    def test_table_reuse(self):
+        """The tables, and their cursors, are created once per thread until a rollback."""
+        sql = FakeSQLManager()
+        user_table = sql.user
+        assert isinstance(user_table, UserTable)
+        assert sql.user is user_table
+        assert sql.conn.cursors == 1
+        sql.rollback()
+        assert sql.user is not user_table
+        assert sql.conn.cursors == 2
+
+    def test_invalidate_after_commit(self):
+        """Changed records stay cached until the transaction commits."""
+        sql = FakeSQLManager()
+        sql.cache.put('user', 'id', 1, FakeRecord(1, 'alice'))
+        sql.record_changed(sql.cursor(), 'user', 1)
+        assert sql.cache.get('user', 'id', 1) is not None
+        sql.commit()
+        assert sql.cache.get('user', 'id', 1) is None
@@ -0,0 +1,86 @@
+# Copyright (c) 2017, Daniele Venzano
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Test the execution table against a real PostgreSQL database."""
+
+from argparse import Namespace
+import datetime
+
+import psycopg2
+import pytest
+
+from zoe_lib.config import load_configuration
+from zoe_lib.state import SQLManager
+from zoe_lib.state.execution import ExecutionTable
+from zoe_lib.tests.config_mock import zoe_configuration  # pylint: disable=unused-import
+
+
+class TestExecutionTable:
+    """Test the queries of the execution table."""
+
+    @pytest.fixture
+    def sql_manager(self, zoe_configuration):  # pylint: disable=redefined-outer-name
+        """A SQLManager connected to a freshly initialized test deployment."""
+        conf = Namespace(**vars(zoe_configuration))
+        conf.deployment_name = 'test_execution'
+        load_configuration(conf)
+        try:
+            sql_manager = SQLManager(conf)
+        except psycopg2.OperationalError:
+            pytest.skip('PostgreSQL is not available')
+        sql_manager.init_db(force=True)
+        yield sql_manager
+        cur = sql_manager.cursor()
+        cur.execute("DELETE FROM public.versions WHERE deployment = %s", (conf.deployment_name,))
+        cur.execute('DROP SCHEMA {} CASCADE'.format(conf.deployment_name))
+        sql_manager.commit()
+
+    def test_overlapping_streams(self, sql_manager):
+        """Streams opened on the same connection at the same time use distinct cursors."""
+        ids = [sql_manager.executions.insert('test', 1, {'name': 'test', 'size': 1, 'services': []}) for _ in range(3)]
+        first = ExecutionTable(sql_manager).stream()
+        second = ExecutionTable(sql_manager).stream()
+        assert next(first).id == ids[2]
+        assert next(second).id == ids[2]
+        assert [e.id for e in first] == [ids[1], ids[0]]
+        assert [e.id for e in second] == [ids[1], ids[0]]
+        assert sql_manager.executions.select(only_one=True, id=ids[0]).id == ids[0]
+
+    def test_select_overdue(self, sql_manager):
+        """Active executions past their deadline are returned, oldest deadline first."""
+        now = datetime.datetime.utcnow()
+        cases = [
+            ('running', now - datetime.timedelta(minutes=1), True),
+            ('starting', now - datetime.timedelta(hours=1), True),
+            ('image download', now - datetime.timedelta(minutes=2), True),
+            ('queued', now + datetime.timedelta(hours=1), False),
+            ('cleaning up', now - datetime.timedelta(hours=1), False),
+            ('terminated', now - datetime.timedelta(hours=1), False),
+            ('running', None, False)
+        ]
+        expected = []
+        for status, kill_at, overdue in cases:
+            execution_id = sql_manager.executions.insert('test', 1, {'name': 'test', 'size': 1, 'services': []})
+            sql_manager.executions.update(execution_id, status=status, kill_at=kill_at)
+            if overdue:
+                expected.append((kill_at, execution_id))
+        assert [e.id for e in sql_manager.executions.select_overdue(now)] == [execution_id for kill_at_, execution_id in sorted(expected)]
+
+    def test_active_usage(self, sql_manager):
+        """Reservations written as JSON floats, as allowed by the ZApp schema, are summed."""
+        service = {'name': 'test', 'total_count': 2, 'resources': {'memory': {'min': 536870912.0, 'max': 536870912.0}, 'cores': {'min': 0.5, 'max': 1}}}
+        sql_manager.executions.insert('test', 1, {'name': 'test', 'size': 1, 'services': [service]})
+        assert sql_manager.executions.active_usage(1) == (1, 1.0, 1073741824)
+        assert sql_manager.executions.active_usage(2) == (0, 0.0, 0)
@@ -0,0 +1,128 @@
+# Copyright (c) 2017, Daniele Venzano
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Test the schema migrations against a real PostgreSQL database."""
+
+from argparse import Namespace
+import threading
+
+import psycopg2
+import pytest
+
+from zoe_lib.config import get_conf, load_configuration
+from zoe_lib.state import SQLManager
+from zoe_lib.state.migrations import BASE_SCHEMA_VERSION
+from zoe_lib.tests.config_mock import zoe_configuration  # pylint: disable=unused-import
+from zoe_lib.version import SQL_SCHEMA_VERSION
+
+# Query shapes issued by Zoe and the index each one is expected to use
+HOT_QUERIES = [
+    ("SELECT * FROM execution WHERE status = 'running'", 'execution_active_status_idx'),
+    ("SELECT * FROM execution WHERE status = 'queued' AND user_id = 2", 'execution_active_status_idx'),
+    ("SELECT * FROM execution WHERE user_id = 2 ORDER BY id DESC LIMIT 10", 'execution_user_id_idx'),
+    ("SELECT * FROM execution WHERE name = 'test'", 'execution_name_idx'),
+    ("SELECT * FROM service WHERE execution_id = 1", 'service_execution_id_idx'),
+    ("SELECT * FROM service WHERE backend_host = 'node1' AND backend_id = 'abc'", 'service_backend_idx'),
+    ("SELECT * FROM service WHERE backend_host = 'node1' AND backend_status = 'started'", 'service_started_host_idx'),
+    ("SELECT * FROM port WHERE service_id = 1", 'port_service_id_idx'),
+    ("SELECT id FROM execution WHERE status IN ('terminated', 'error') AND COALESCE(time_end, time_submit) < '2018-01-01'", 'execution_ended_idx'),
+    ("SELECT * FROM execution WHERE kill_at <= '2018-01-01' AND status IN ('submitted', 'queued', 'starting', 'running', 'image download')", 'execution_kill_at_idx'),
+]
+
+
+class TestMigrations:
+    """Test the migration framework and the indexes it creates."""
+
+    @pytest.fixture
+    def sql_manager(self, zoe_configuration):  # pylint: disable=redefined-outer-name
+        """A SQLManager connected to a freshly initialized test deployment."""
+        conf = Namespace(**vars(zoe_configuration))
+        conf.deployment_name = 'test_migrations'
+        load_configuration(conf)
+        try:
+            sql_manager = SQLManager(conf)
+        except psycopg2.OperationalError:
+            pytest.skip('PostgreSQL is not available')
+        sql_manager.init_db(force=True)
+        yield sql_manager
+        cur = sql_manager.cursor()
+        cur.execute("DELETE FROM public.versions WHERE deployment = %s", (conf.deployment_name,))
+        cur.execute('DROP SCHEMA {} CASCADE'.format(conf.deployment_name))
+        sql_manager.commit()
+
+    def _schema_version(self, sql_manager):
+        cur = sql_manager.cursor()
+        cur.execute("SELECT version FROM public.versions WHERE deployment = 'test_migrations'")
+        return cur.fetchone()[0]
+
+    def test_new_deployment(self, sql_manager):
+        """A new deployment is created at the latest schema version."""
+        assert self._schema_version(sql_manager) == SQL_SCHEMA_VERSION
+
+    def test_migrate_base_schema(self, sql_manager):
+        """A deployment at the base schema version is migrated forward."""
+        cur = sql_manager.cursor()
+        for index in {index for _, index in HOT_QUERIES}:
+            cur.execute('DROP INDEX {}'.format(index))
+        cur.execute('DROP TABLE execution_history, service_history, port_history, archive_run CASCADE')
+        cur.execute('ALTER TABLE execution DROP COLUMN kill_at')
+        cur.execute("UPDATE public.versions SET version = %s WHERE deployment = 'test_migrations'", (BASE_SCHEMA_VERSION,))
+        sql_manager.commit()
+
+        sql_manager.init_db()
+        assert self._schema_version(sql_manager) == SQL_SCHEMA_VERSION
+        cur = sql_manager.cursor()
+        cur.execute("SELECT indexname FROM pg_indexes WHERE schemaname = 'test_migrations'")
+        indexes = [row[0] for row in cur]
+        for _, index in HOT_QUERIES:
+            assert index in indexes
+
+    def test_concurrent_migrations(self, sql_manager):
+        """Processes starting at the same time apply each migration step once."""
+        cur = sql_manager.cursor()
+        cur.execute('DROP TABLE execution_history, service_history, port_history, archive_run CASCADE')
+        cur.execute('DROP INDEX execution_ended_idx')
+        cur.execute('ALTER TABLE execution DROP COLUMN kill_at')
+        cur.execute("UPDATE public.versions SET version = %s WHERE deployment = 'test_migrations'", (BASE_SCHEMA_VERSION + 1,))
+        sql_manager.commit()
+
+        errors = []
+
+        def _init():
+            other = SQLManager(get_conf())
+            try:
+                other.init_db()
+            except Exception as e:  # pylint: disable=broad-except
+                errors.append(e)
+            finally:
+                other.close()
+
+        threads = [threading.Thread(target=_init) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert errors == []
+        assert self._schema_version(sql_manager) == SQL_SCHEMA_VERSION
+
+    def test_query_plans(self, sql_manager):
+        """The hot queries are answered using the expected indexes."""
+        cur = sql_manager.cursor()
+        cur.execute('SET enable_seqscan = off')  # the test tables are empty, so a sequential scan would always win
+        for query, index in HOT_QUERIES:
+            cur.execute('EXPLAIN ' + query)
+            plan = '\n'.join(row[0] for row in cur)
+            assert index in plan, plan
+        cur.execute('RESET enable_seqscan')
@@ -21,13 +21,13 @@ from collections import namedtuple
 from zoe_lib.state.sql_manager import SQLManager
 
 
-Conf = namedtuple('Conf', ['dbuser', 'dbpass', 'dbhost', 'dbport', 'dbname', 'deployment_name'])
+Conf = namedtuple('Conf', ['dbuser', 'dbpass', 'dbhost', 'dbport', 'dbname', 'dbcache_ttl', 'deployment_name'])
 
 
 class MockSQLManager(SQLManager):
     """A mock SQL manager."""
     def __init__(self):
-        fake_conf = Conf(dbuser='', dbpass='', dbhost='', dbport=5432, dbname='', deployment_name='test')
+        fake_conf = Conf(dbuser='', dbpass='', dbhost='', dbport=5432, dbname='', dbcache_ttl=0, deployment_name='test')
         super().__init__(fake_conf)
 
     def _connect(self):
@@ -0,0 +1,67 @@
+# Copyright (c) 2017, Daniele Venzano
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Test the lazy loading of the service descriptions."""
+
+from zoe_lib.state.service import Service
+
+SERVICE_DESCRIPTION = {
+    'name': 'test', 'image': 'test:1', 'monitor': True, 'startup_order': 0, 'environment': [], 'command': None, 'volumes': [],
+    'resources': {'memory': {'min': 1, 'max': 1}, 'cores': {'min': 1, 'max': 1}}, 'ports': []
+}
+
+
+class MockServiceTable:
+    """Counts the description queries."""
+    def __init__(self, description):
+        self.description = description
+        self.queries = 0
+
+    def select_description(self, service_id, history=False):  # pylint: disable=unused-argument
+        """Return the description given at creation."""
+        self.queries += 1
+        return self.description
+
+
+class MockSQLManager:
+    """Only the service table."""
+    def __init__(self, description):
+        self.services = MockServiceTable(description)
+
+
+class TestService:
+    """Test the Service record."""
+
+    def test_description_selected(self):
+        """A description selected with the record is parsed without queries."""
+        sql_manager = MockSQLManager(None)
+        service = Service({'id': 1, 'name': 'test', 'description': SERVICE_DESCRIPTION}, sql_manager)
+        assert service.image_name == 'test:1'
+        assert service.resource_reservation.cores.min == 1
+        assert sql_manager.services.queries == 0
+
+    def test_description_loaded_once(self):
+        """A description that was not selected is loaded on first access, also when the service no longer exists."""
+        sql_manager = MockSQLManager(SERVICE_DESCRIPTION)
+        service = Service({'id': 1, 'name': 'test'}, sql_manager)
+        assert service.is_monitor
+        assert service.description['name'] == 'test'
+        assert sql_manager.services.queries == 1
+
+        sql_manager = MockSQLManager(None)
+        service = Service({'id': 1, 'name': 'test'}, sql_manager)
+        assert service.description is None
+        assert service.description is None
+        assert sql_manager.services.queries == 1
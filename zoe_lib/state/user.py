@@ -27,6 +27,7 @@ log = logging.getLogger(__name__)
 
 class User(BaseRecord):
     """An user object describes a Zoe user."""
+    __slots__ = ('username', 'password', 'fs_uid', 'email', 'priority', 'enabled', 'auth_source', 'role_id', 'quota_id', '_role', '_quota')
 
     def __init__(self, d, sql_manager):
         super().__init__(d, sql_manager)
@@ -40,6 +41,8 @@ class User(BaseRecord):
         self.auth_source = d['auth_source']
         self.role_id = d['role_id']
         self.quota_id = d['quota_id']
+        self._role = None
+        self._quota = None
 
         if self.auth_source == "pam":
             try:
@@ -100,13 +103,17 @@ class User(BaseRecord):
 
     @property
     def role(self):
-        """Get the role from the DB."""
-        return self.sql_manager.role.select(only_one=True, id=self.role_id)
+        """Get the role from the DB, memoized until the role_id changes."""
+        if self._role is None or self._role.id != self.role_id:
+            self._role = self.sql_manager.role.select(only_one=True, id=self.role_id)
+        return self._role
 
     @property
     def quota(self):
-        """Get the quota for this user."""
-        return self.sql_manager.quota.select(only_one=True, id=self.quota_id)
+        """Get the quota for this user, memoized until the quota_id changes."""
+        if self._quota is None or self._quota.id != self.quota_id:
+            self._quota = self.sql_manager.quota.select(only_one=True, id=self.quota_id)
+        return self._quota
 
     def __repr__(self):
         return self.username
@@ -120,6 +127,8 @@ class User(BaseRecord):
 
 class UserTable(BaseTable):
     """Abstraction for the user table in the database."""
+    cached_columns = ('id', 'username')
+
     def __init__(self, sql_manager):
         super().__init__(sql_manager, "user")
 
@@ -152,6 +161,10 @@ class UserTable(BaseTable):
         :param kwargs: filter services based on their fields/columns
         :return: one or more ports
         """
+        cached = self._cache_get(only_one, kwargs)
+        if cached is not None:
+            return cached
+
         q_base = 'SELECT * FROM "user"'
         if len(kwargs) > 0:
             q = q_base + " WHERE "
@@ -170,7 +183,9 @@ class UserTable(BaseTable):
             row = self.cursor.fetchone()
             if row is None:
                 return None
-            return User(row, self.sql_manager)
+            record = User(row, self.sql_manager)
+            self._cache_put(kwargs, record)
+            return record
         else:
             return [User(x, self.sql_manager) for x in self.cursor]
 
@@ -184,12 +199,29 @@ class UserTable(BaseTable):
         self.sql_manager.commit()
         return self.cursor.fetchone()[0]
 
+    def _updating(self, record_id, fields):
+        """A new quota may have a different run time limit, recompute the deadlines of the active executions."""
+        if 'quota_id' in fields:
+            self.sql_manager.executions.update_kill_at(user_id=record_id)
+
+    def lock(self, user_id):
+        """Lock a user row until the end of the current transaction, to serialize concurrent operations on behalf of the same user."""
+        self.cursor.execute('SELECT id FROM "user" WHERE id = %s FOR UPDATE', (user_id,))
+
     def delete(self, user_id):
         """Delete a user from the state."""
         query = 'DELETE FROM execution WHERE user_id=%s'
         self.cursor.execute(query, (user_id,))
+        # The history tables have no foreign keys, archived records are removed explicitly
+        query = 'DELETE FROM port_history WHERE service_id IN (SELECT id FROM service_history WHERE execution_id IN (SELECT id FROM execution_history WHERE user_id = %s))'
+        self.cursor.execute(query, (user_id,))
+        query = 'DELETE FROM service_history WHERE execution_id IN (SELECT id FROM execution_history WHERE user_id = %s)'
+        self.cursor.execute(query, (user_id,))
+        query = 'DELETE FROM execution_history WHERE user_id = %s'
+        self.cursor.execute(query, (user_id,))
         query = 'DELETE FROM "user" WHERE id = %s'
         self.cursor.execute(query, (user_id,))
+        self._record_changed(user_id)
         self.sql_manager.commit()
 
     def update(self, user_id, **fields):
@@ -31,8 +31,10 @@ def zoe_configuration():
     zoe_api_args.dbuser = 'zoeuser'
     zoe_api_args.dbpass = 'zoepass'
     zoe_api_args.dbname = 'zoe'
+    zoe_api_args.dbcache_ttl = 60
     zoe_api_args.api_listen_uri = 'tcp://*:4850'
     zoe_api_args.kairosdb_enable = False
+    zoe_api_args.metrics_max_age = 60
     zoe_api_args.workspace_base_path = '/tmp'
     zoe_api_args.workspace_deployment_path = zoe_api_args.workspace_base_path
     zoe_api_args.overlay_network_name = 'zoe'
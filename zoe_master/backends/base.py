@@ -15,7 +15,7 @@
 
 """The base class that all back-ends should implement."""
 
-from typing import List
+from typing import Any, Dict, Iterable, Iterator, List, Tuple, Union
 
 from zoe_lib.state import Service
 from zoe_master.stats import ClusterStats
@@ -48,6 +48,15 @@ class BaseBackend:
         """
         raise NotImplementedError
 
+    def spawn_services(self, service_instances: List[ServiceInstance]) -> List[Tuple[str, str, Dict[int, int]]]:
+        """Create the containers for a group of services that have the same startup order.
+
+        The backend can submit the requests concurrently. If any service cannot be started, the backend removes what it created for the group and raises the same exceptions as ``spawn_service``, otherwise it returns the tuples that ``spawn_service`` would return, in the same order as the service instances.
+
+        Backends that do not implement this method get their services started one at a time with ``spawn_service``.
+        """
+        raise NotImplementedError
+
     def terminate_service(self, service: Service) -> None:
         """Terminate the container corresponding to a service."""
         raise NotImplementedError
@@ -60,10 +69,23 @@ class BaseBackend:
         """Make a service image available."""
         raise NotImplementedError
 
+    def prefetch_images(self, images: Dict[str, Iterable[str]]) -> None:
+        """Start making images available on nodes, the images dictionary maps image names to node names."""
+        raise NotImplementedError
+
+    def image_pulls(self) -> List[Dict[str, Any]]:
+        """The image pulls in progress."""
+        raise NotImplementedError
+
     def update_service(self, service, cores=None, memory=None):
         """Update a service reservation."""
         raise NotImplementedError
 
+    @classmethod
+    def service_log_stream(cls, service: Service, since=None, tail='all', follow=False) -> Union[Iterator[bytes], None]:
+        """Stream the log of a service as byte chunks, optionally only after the since timestamp or the last tail lines, and following new output. The stream has a close() method that must always be called, also from another thread to interrupt a read. Return None if the service does not run on this back-end. This method is called on the class, also by processes that do not run the back-ends, like the API."""
+        raise NotImplementedError
+
     def node_list(self) -> List[str]:
         """List node names configured in the back-end."""
         raise NotImplementedError
@@ -71,3 +93,7 @@ class BaseBackend:
     def list_available_images(self, node_name):
         """List the images available on the specified node."""
         raise NotImplementedError
+
+    def image_nodes(self, image_name):
+        """Return the names of the nodes where an image is available."""
+        raise NotImplementedError
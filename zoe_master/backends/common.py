@@ -15,6 +15,8 @@
 
 """The high-level interface that Zoe uses to talk to the configured container backend."""
 
+import functools
+import re
 from typing import Dict, List
 
 from zoe_lib.config import get_conf
@@ -22,6 +24,9 @@ from zoe_lib.state import Service, Execution, VolumeDescription, VolumeDescripti
 from zoe_master.exceptions import ZoeStartExecutionFatalException
 from zoe_master.workspace.filesystem import ZoeFSWorkspace
 
+# [registry/][namespace/]name[:tag|@digest]
+IMAGE_REFERENCE_RE = re.compile(r'^(?:([^/]+)/)?(?:([^/]+)/)?([^@:/]+)(?:[@:](.+))?$')
+
 
 def gen_environment(execution: Execution, service: Service, env_subst_dict: Dict):
     """ Generate a dictionary containing the current cluster status (before the new container is spawned)
@@ -77,3 +82,26 @@ def gen_labels(service: Service, execution: Execution):
         'zoe_deployment_name': get_conf().deployment_name,
         'zoe_type': 'app_service'
     }
+
+
+@functools.lru_cache(maxsize=4096)
+def normalize_image_name(image_name: str) -> str:
+    """Expand an image reference the way the Docker Engine does, so that 'ubuntu', 'ubuntu:latest' and 'docker.io/library/ubuntu:latest' compare equal."""
+    name, sep, digest = image_name.partition('@')
+    components = name.split('/')
+    if len(components) == 1 or ('.' not in components[0] and ':' not in components[0] and components[0] != 'localhost'):
+        components.insert(0, 'docker.io')
+    elif components[0] == 'index.docker.io':
+        components[0] = 'docker.io'
+    if components[0] == 'docker.io' and len(components) == 2:
+        components.insert(1, 'library')
+    if sep == '' and ':' not in components[-1]:
+        components[-1] += ':latest'
+    return '/'.join(components) + sep + digest
+
+
+@functools.lru_cache(maxsize=4096)
+def image_has_version(image_name: str) -> bool:
+    """Return True if an image reference has a tag or a digest."""
+    parsed_name = IMAGE_REFERENCE_RE.search(image_name)
+    return parsed_name is not None and parsed_name.group(4) is not None
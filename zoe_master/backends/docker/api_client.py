@@ -16,13 +16,14 @@
 """Interface to the low-level Docker API."""
 
 import logging
-from typing import List, Callable, Dict, Any
+import threading
+import time
+from typing import List, Callable, Dict, Any, Union
 
 import docker
 import docker.tls
 import docker.errors
 import docker.utils
-import docker.models.containers
 
 import requests.exceptions
 
@@ -34,16 +35,80 @@ from zoe_master.exceptions import ZoeException, ZoeNotEnoughResourcesException
 
 log = logging.getLogger(__name__)
 
-try:
-    docker.DockerClient()
-except AttributeError:
+if not hasattr(docker, 'DockerClient'):
     log.error('Docker package does not have the DockerClient attribute')
     raise ImportError('Wrong Docker library version')
 
 
+def container_state(status: str):
+    """Translate a docker container status into a Zoe backend status and a running flag."""
+    if status == 'running' or status == 'restarting' or status == 'removing':
+        return Service.BACKEND_START_STATUS, True
+    elif status == 'paused' or status == 'exited' or status == 'dead':
+        return Service.BACKEND_DIE_STATUS, False
+    elif status == 'OOMKilled':
+        return Service.BACKEND_OOM_STATUS, False
+    elif status == 'created':
+        return Service.BACKEND_CREATE_STATUS, False
+    else:
+        log.error('Unknown container status: {}'.format(status))
+        return Service.BACKEND_UNDEFINED_STATUS, False
+
+
+def container_summary(docker_config: DockerHostConfig, attrs: Dict[str, Any]) -> Dict[str, Any]:
+    """Translate the output of a container inspection into a simple dictionary."""
+    info = {
+        "id": attrs['Id'],
+        "ip_address": {},
+        "name": attrs['Name'].lstrip('/'),
+        'labels': attrs['Config']['Labels'],
+        'external_address': docker_config.external_address
+    }  # type: Dict[str, Any]
+    try:
+        info['host'] = attrs['Node']['Name']
+    except KeyError:
+        info['host'] = 'N/A'
+
+    info["state"], info["running"] = container_state(attrs['State']['Status'])
+
+    info['ports'] = {}
+    if 'Ports' in attrs['NetworkSettings'] and attrs['NetworkSettings']['Ports'] is not None:
+        for port in attrs['NetworkSettings']['Ports']:
+            if attrs['NetworkSettings']['Ports'][port] is not None:
+                info['ports'][port] = attrs['NetworkSettings']['Ports'][port][0]['HostPort']
+            else:
+                info['ports'][port] = None
+
+    info.update(container_limits(attrs['HostConfig']))
+    return info
+
+
+def container_limits(host_config: Dict[str, Any]) -> Dict[str, int]:
+    """Extract the resource limits from the HostConfig section of a container inspection."""
+    return {
+        'cpu_period': host_config['CpuPeriod'],
+        'cpu_quota': host_config['CpuQuota'],
+        'memory_hard_limit': host_config['Memory'],
+        'memory_soft_limit': host_config['MemoryReservation']
+    }
+
+
+def container_brief(cont_info: Dict[str, Any]) -> Dict[str, Any]:
+    """Translate an entry of the container list into a dictionary with the id, name, status, state, running and labels fields."""
+    state, running = container_state(cont_info['State'])
+    return {
+        'id': cont_info['Id'],
+        'name': cont_info['Names'][0].lstrip('/') if cont_info.get('Names') else cont_info['Id'],
+        'status': cont_info['State'],
+        'state': state,
+        'running': running,
+        'labels': cont_info.get('Labels') or {}
+    }
+
+
 class DockerClient:
     """The client class that wraps the Docker API."""
-    def __init__(self, docker_config: DockerHostConfig, mock_client=None) -> None:
+    def __init__(self, docker_config: DockerHostConfig, mock_client=None, version="auto") -> None:
         self.name = docker_config.name
         self.docker_config = docker_config
         if not docker_config.tls:
@@ -57,32 +122,34 @@ class DockerClient:
             return
 
         try:
-            self.cli = docker.DockerClient(base_url=docker_config.address, version="auto", tls=tls)
+            self.cli = docker.DockerClient(base_url=docker_config.address, version=version, tls=tls)
         except docker.errors.DockerException as e:
             raise ZoeException("Cannot connect to Docker host {} at address {}: {}".format(docker_config.name, docker_config.address, str(e)))
 
+    @property
+    def api_version(self) -> str:
+        """The API version negotiated with the engine, can be passed to new clients to skip the negotiation."""
+        return self.cli.api.api_version
+
+    def close(self) -> None:
+        """Close the HTTP connections to the engine."""
+        self.cli.api.close()
+
     def info(self) -> Dict:
         """Retrieve engine statistics."""
         return self.cli.info()
 
     def spawn_container(self, service_instance: ServiceInstance) -> Dict[str, Any]:
-        """Create and start a new container."""
-        run_args = {
-            'detach': True,
-            'ports': {},
-            'environment': {},
-            'volumes': {},
-            'working_dir': service_instance.work_dir,
+        """Create and start a new container, with one create, one start and one inspect request."""
+        time_start = time.time()
+        ports = [(str(port.number), port.proto) for port in service_instance.ports]
+        host_config_args = {
+            'port_bindings': {'/'.join(port): None for port in ports},
+            'binds': {},
             'mem_limit': 0,
             'mem_reservation': 0,
             'memswap_limit': 0,
-            'name': service_instance.name,
-            'network_disabled': False,
             'network_mode': service_instance.network,
-            'image': service_instance.image_name,
-            'command': service_instance.command,
-            'hostname': service_instance.hostname,
-            'labels': service_instance.labels,
             'cpu_period': 100000,
             'cpu_quota': 100000,
             'log_config': {
@@ -90,33 +157,28 @@ class DockerClient:
                 "config": {}
             }
         }
-        for port in service_instance.ports:
-            run_args['ports'][str(port.number) + '/' + port.proto] = None
-
-        for name, value in service_instance.environment:
-            run_args['environment'][name] = value
 
         for volume in service_instance.volumes:
             if volume.type == "host_directory":
                 assert isinstance(volume, VolumeDescriptionHostPath)
-                run_args['volumes'][volume.path] = {'bind': volume.mount_point, 'mode': ("ro" if volume.readonly else "rw")}
+                host_config_args['binds'][volume.path] = {'bind': volume.mount_point, 'mode': ("ro" if volume.readonly else "rw")}
             else:
                 log.error('Docker backend does not support volume type {}'.format(volume.type))
 
         if service_instance.memory_limit is not None:
-            run_args['mem_limit'] = service_instance.memory_limit.min
-#            run_args['mem_reservation'] = service_instance.memory_limit.min
+            host_config_args['mem_limit'] = service_instance.memory_limit.min
+#            host_config_args['mem_reservation'] = service_instance.memory_limit.min
 #            if service_instance.memory_limit.max == service_instance.memory_limit.min:
-#                run_args['mem_reservation'] -= 1
+#                host_config_args['mem_reservation'] -= 1
 
         if service_instance.core_limit is not None:
-            run_args['cpu_quota'] = int(100000 * service_instance.core_limit.min)
+            host_config_args['cpu_quota'] = int(100000 * service_instance.core_limit.min)
 
         if service_instance.shm_size > 0:
-            run_args['shm_size'] = service_instance.shm_size
+            host_config_args['shm_size'] = service_instance.shm_size
 
         if get_conf().gelf_address != '':
-            run_args['log_config'] = {
+            host_config_args['log_config'] = {
                 "type": "gelf",
                 "config": {
                     'gelf-address': get_conf().gelf_address,
@@ -124,71 +186,50 @@ class DockerClient:
                 }
             }
 
-        cont = None
+        docker_id = None
         try:
-            cont = self.cli.containers.run(**run_args)
+            docker_id = self.cli.api.create_container(
+                image=service_instance.image_name,
+                command=service_instance.command,
+                hostname=service_instance.hostname,
+                detach=True,
+                ports=ports,
+                environment={name: value for name, value in service_instance.environment},
+                volumes=[bind['bind'] for bind in host_config_args['binds'].values()],
+                working_dir=service_instance.work_dir,
+                labels=service_instance.labels,
+                name=service_instance.name,
+                network_disabled=False,
+                host_config=self.cli.api.create_host_config(**host_config_args)
+            )['Id']
+            time_created = time.time()
+            self.cli.api.start(docker_id)
+            time_started = time.time()
+            cont_info = container_summary(self.docker_config, self.cli.api.inspect_container(docker_id))  # the host ports are assigned at start
         except docker.errors.ImageNotFound:
             raise ZoeException(message='Image not found')
         except docker.errors.APIError as e:
-            if cont is not None:
-                cont.remove(force=True)
+            if docker_id is not None:
+                self._remove_quietly(docker_id)
             if e.explanation == b'no resources available to schedule container':
                 raise ZoeNotEnoughResourcesException(message=str(e))
             else:
                 raise ZoeException(message=str(e))
         except Exception as e:
-            if cont is not None:
-                cont.remove(force=True)
+            if docker_id is not None:
+                self._remove_quietly(docker_id)
             raise ZoeException(str(e))
 
-        cont = self.cli.containers.get(cont.id)
-        return self._container_summary(cont)
-
-    def _container_summary(self, container: docker.models.containers.Container):
-        """Translate a docker-specific container object into a simple dictionary."""
-        info = {
-            "id": container.id,
-            "ip_address": {},
-            "name": container.name,
-            'labels': container.attrs['Config']['Labels'],
-            'external_address': self.docker_config.external_address
-        }  # type: Dict[str, Any]
-        try:
-            info['host'] = container.attrs['Node']['Name']
-        except KeyError:
-            info['host'] = 'N/A'
-
-        if container.status == 'running' or container.status == 'restarting' or container.status == 'removing':
-            info["state"] = Service.BACKEND_START_STATUS
-            info["running"] = True
-        elif container.status == 'paused' or container.status == 'exited' or container.status == 'dead':
-            info["state"] = Service.BACKEND_DIE_STATUS
-            info["running"] = False
-        elif container.status == 'OOMKilled':
-            info["state"] = Service.BACKEND_OOM_STATUS
-            info["running"] = False
-        elif container.status == 'created':
-            info["state"] = Service.BACKEND_CREATE_STATUS
-            info["running"] = False
-        else:
-            log.error('Unknown container status: {}'.format(container.status))
-            info["state"] = Service.BACKEND_UNDEFINED_STATUS
-            info["running"] = False
+        time_end = time.time()
+        log.debug('Container {} spawned on host {} in {:.3f}s: create {:.3f}s, start {:.3f}s, inspect {:.3f}s'.format(service_instance.name, self.name, time_end - time_start, time_created - time_start, time_started - time_created, time_end - time_started))
+        return cont_info
 
-        info['ports'] = {}
-        if 'Ports' in container.attrs['NetworkSettings'] and container.attrs['NetworkSettings']['Ports'] is not None:
-            for port in container.attrs['NetworkSettings']['Ports']:
-                if container.attrs['NetworkSettings']['Ports'][port] is not None:
-                    info['ports'][port] = container.attrs['NetworkSettings']['Ports'][port][0]['HostPort']
-                else:
-                    info['ports'][port] = None
-
-        info['cpu_period'] = container.attrs['HostConfig']['CpuPeriod']
-        info['cpu_quota'] = container.attrs['HostConfig']['CpuQuota']
-        info['memory_hard_limit'] = container.attrs['HostConfig']['Memory']
-        info['memory_soft_limit'] = container.attrs['HostConfig']['MemoryReservation']
-
-        return info
+    def _remove_quietly(self, docker_id: str) -> None:
+        """Remove a container that failed to start."""
+        try:
+            self.cli.api.remove_container(docker_id, force=True)
+        except (docker.errors.APIError, requests.exceptions.RequestException) as e:
+            log.warning('Cannot remove container {}: {}'.format(docker_id, e))
 
     def inspect_container(self, docker_id: str) -> Dict[str, Any]:
         """Retrieve information about a running container."""
@@ -196,7 +237,7 @@ class DockerClient:
             cont = self.cli.containers.get(docker_id)
         except Exception as e:
             raise ZoeException(str(e))
-        return self._container_summary(cont)
+        return container_summary(self.docker_config, cont.attrs)
 
     def terminate_container(self, docker_id: str, delete=False) -> None:
         """
@@ -223,25 +264,29 @@ class DockerClient:
         except docker.errors.APIError as e:
             log.warning(str(e))
 
-    def event_listener(self, callback: Callable[[str], bool]) -> None:
-        """An infinite loop that listens for events from Swarm."""
-        event_gen = self.cli.events(decode=True)
-        while True:
-            try:
-                event = next(event_gen)
-            except requests.exceptions.RequestException:
-                log.warning('Docker closed event connection, retrying...')
-                event_gen = self.cli.events(decode=True)
-                continue
+    def event_listener(self, callback: Callable[[Dict[str, Any]], bool], filters=None, since=None, until=None) -> None:
+        """
+        Listen for events from the engine, until the callback returns False or the until time is reached.
 
-            try:
-                res = callback(event)
-            except Exception:
-                log.exception('Uncaught exception in swarm event callback')
-                log.warning('event was: {}'.format(event))
-                continue
-            if not res:
-                break
+        :param callback: called for each event, returns False to stop listening
+        :param filters: filter events, ex. {'type': 'container'}
+        :param since: replay events from this UTC timestamp
+        :param until: stop listening at this UTC timestamp
+        :raises ZoeException: if the connection to the engine is lost
+        """
+        try:
+            event_gen = self.cli.events(decode=True, filters=filters, since=since, until=until)
+            for event in event_gen:
+                try:
+                    res = callback(event)
+                except Exception:
+                    log.exception('Uncaught exception in docker event callback')
+                    log.warning('event was: {}'.format(event))
+                    continue
+                if not res:
+                    break
+        except (docker.errors.APIError, requests.exceptions.RequestException) as e:
+            raise ZoeException('Lost the event stream of Docker host {}: {}'.format(self.name, e))
 
     def list(self, only_label=None, status=None) -> List[dict]:
         """
@@ -264,10 +309,36 @@ class DockerClient:
             raise ZoeException(str(ex))
         conts = []
         for cont_info in ret:
-            conts.append(self._container_summary(cont_info))
+            conts.append(container_summary(self.docker_config, cont_info.attrs))
 
         return conts
 
+    def list_brief(self) -> List[dict]:
+        """
+        List all containers with one API call, without inspecting them.
+
+        :return: a list of containers with only the id, name, status, state, running and labels fields
+        """
+        try:
+            ret = self.cli.api.containers(all=True)
+        except (docker.errors.APIError, requests.exceptions.RequestException) as ex:
+            raise ZoeException(str(ex))
+        return [container_brief(cont_info) for cont_info in ret]
+
+    def resource_limits(self, docker_id: str) -> Union[Dict[str, int], None]:
+        """
+        Read the resource limits of a container.
+
+        :return: the limits, or None if the container does not exist anymore
+        """
+        try:
+            host_config = self.cli.api.inspect_container(docker_id)['HostConfig']
+        except docker.errors.NotFound:
+            return None
+        except (docker.errors.APIError, requests.exceptions.RequestException) as ex:
+            raise ZoeException(str(ex))
+        return container_limits(host_config)
+
     def stats(self, docker_id: str, stream: bool):
         """Retrieves container stats based on resource usage."""
         try:
@@ -286,24 +357,24 @@ class DockerClient:
         except ValueError:
             raise ZoeException('Docker API decoding error')
 
-    def logs(self, docker_id: str, stream: bool, follow=None):
+    def logs(self, docker_id: str, since=None, tail='all', follow=False) -> 'ContainerLogStream':
         """
-        Retrieves the logs of the selected container.
-
-        :param docker_id:
-        :param stream:
-        :param follow:
-        :return:
+        Stream the logs of the selected container, as they are sent by the engine. Closing the stream closes this client, use a dedicated client.
+
+        :param docker_id: the container ID
+        :param since: only logs after this UNIX timestamp
+        :param tail: only this number of lines from the end of the log, or 'all'
+        :param follow: keep streaming new log lines until the container stops
+        :return: an iterator of byte chunks, lines prefixed by their timestamp
+        :raises ZoeException: if the logs cannot be read
         """
         try:
-            cont = self.cli.containers.get(docker_id)
-        except (docker.errors.NotFound, docker.errors.APIError):
-            return None
-
-        try:
-            return cont.logs(stdout=True, stderr=True, follow=follow, stream=stream, timestamps=True, tail='all')
-        except docker.errors.APIError:
-            return None
+            chunks = self.cli.api.logs(docker_id, stdout=True, stderr=True, stream=True, timestamps=True, tail=tail, since=since, follow=follow)
+        except docker.errors.NotFound:
+            raise ZoeException('Container {} not found'.format(docker_id))
+        except (docker.errors.APIError, requests.exceptions.RequestException) as e:
+            raise ZoeException('Cannot read the logs of container {}: {}'.format(docker_id, e))
+        return ContainerLogStream(self, chunks, docker_id)
 
     def list_images(self):
         """Retrieve the list of images available on this node."""
@@ -312,11 +383,22 @@ class DockerClient:
         except (docker.errors.NotFound, docker.errors.APIError):
             return []
 
-    def pull_image(self, image_name):
-        """Pulls an image in the docker engine."""
+    def pull_image(self, image_name, progress: Callable[[Dict[str, Any]], None] = None):
+        """
+        Pulls an image in the docker engine.
+
+        :param image_name: the image to pull
+        :param progress: called with each progress message sent by the engine, ex. {'status': 'Downloading', 'id': layer, 'progressDetail': {'current': 10, 'total': 100}}
+        :raises ZoeException: if the image cannot be pulled
+        """
+        repository, tag = docker.utils.parse_repository_tag(image_name)
         try:
-            self.cli.images.pull(image_name)
-        except docker.errors.APIError as e:
+            for message in self.cli.api.pull(repository, tag=tag, stream=True, decode=True):
+                if 'error' in message:
+                    raise ZoeException('Cannot download image {}: {}'.format(image_name, message['error']))
+                if progress is not None:
+                    progress(message)
+        except (docker.errors.APIError, requests.exceptions.RequestException) as e:
             log.error('Cannot download image {}: {}'.format(image_name, e))
             raise ZoeException('Cannot download image {}: {}'.format(image_name, e))
 
@@ -339,3 +421,46 @@ class DockerClient:
             cont.update(**kwargs)
         except docker.errors.APIError:
             pass
+
+
+class ContainerLogStream:
+    """
+    The log of a container, as an iterator of byte chunks, read with a client that is used only by this stream.
+
+    close() must always be called, also when the stream has not been read. It can be called from another thread to interrupt a read that waits for
+    new output of the container.
+    """
+    def __init__(self, client: DockerClient, chunks, docker_id: str) -> None:
+        self.client = client
+        self.chunks = chunks
+        self.docker_id = docker_id
+        self.closed = False
+        self._lock = threading.Lock()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> bytes:
+        if self.closed:
+            raise StopIteration
+        try:
+            return next(self.chunks)
+        except requests.exceptions.RequestException as e:
+            if self.closed:
+                raise StopIteration
+            raise ZoeException('Lost the log stream of container {}: {}'.format(self.docker_id, e))
+        except OSError:  # the connection has been shut down by close()
+            raise StopIteration
+
+    def close(self):
+        """Close the connection to the engine, a read in progress in another thread returns."""
+        with self._lock:
+            if self.closed:
+                return
+            self.closed = True
+        if hasattr(self.chunks, 'close'):  # docker >= 3.5 returns a stream that can be cancelled
+            try:
+                self.chunks.close()
+            except Exception:  # pylint: disable=broad-except
+                log.debug('Cannot cancel the log stream of container {}'.format(self.docker_id))
+        self.client.close()
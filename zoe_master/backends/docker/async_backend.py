@@ -0,0 +1,427 @@
+# Copyright (c) 2017, Daniele Venzano
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Zoe backend implementation for many Docker Engines, all driven by a single event loop."""
+
+import concurrent.futures
+import logging
+import threading
+import time
+from typing import Any, Callable, List, Union
+
+import tornado.concurrent
+import tornado.gen
+import tornado.ioloop
+import tornado.locks
+
+from zoe_lib.state import Service, SQLManager  # pylint: disable=unused-import
+import zoe_master.backends.base
+from zoe_master.backends.common import image_has_version
+from zoe_master.backends.docker.async_client import AsyncDockerClient, PULL_TIMEOUT, REQUEST_TIMEOUT
+import zoe_master.backends.docker.config
+from zoe_master.backends.docker.config import DockerHostConfig  # pylint: disable=unused-import
+from zoe_master.backends.docker.images import ImagePuller
+from zoe_master.backends.docker.pool import container_log_stream
+from zoe_master.backends.docker.threads import DockerHostsState, CHECK_INTERVAL, RECONCILE_INTERVAL, EVENT_WINDOW
+from zoe_master.backends.service_instance import ServiceInstance
+from zoe_master.exceptions import ZoeStartExecutionRetryException, ZoeStartExecutionFatalException, ZoeException, ZoeNotEnoughResourcesException
+from zoe_master.stats import ClusterStats, ImageIndex
+
+log = logging.getLogger(__name__)
+
+# The event loop and the state of the hosts
+_checker = None
+# The image distribution workers
+_puller = None
+
+
+class AsyncDockerStateSynchronizer(DockerHostsState):
+    """
+    Runs an event loop in a dedicated thread, with two coroutines per host: one follows the event stream and one reconciles the state.
+
+    Other threads run operations on the engines through call(). Database queries and the host locks are left to a single worker thread, that
+    keeps the events in order, so that a slow query does not stall the other hosts.
+    """
+
+    def __init__(self, state: SQLManager, host_configs) -> None:
+        super().__init__(state, host_configs)
+        self.host_configs = host_configs
+        self.loop = None
+        self._clients = {}
+        self._wakeup = {}
+        self._stopping = False
+        self._tasks = []
+        self._db_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        ready = threading.Event()
+        self._thread = threading.Thread(target=self._loop_thread, args=(ready,), name='docker_loop', daemon=True)
+        self._thread.start()
+        ready.wait()
+        self.loop.add_callback(self._start_hosts)
+
+    def _loop_thread(self, ready: threading.Event):
+        self.loop = tornado.ioloop.IOLoop()
+        ready.set()
+        log.info("Docker event loop started")
+        self.loop.start()
+        for client in self._clients.values():
+            client.close()
+        self.loop.close()
+        log.info("Docker event loop stopped")
+
+    def _start_hosts(self):
+        for host_config in self.host_configs:
+            self._wakeup[host_config.name] = tornado.locks.Event()
+            self._tasks.append(self._host_loop(host_config))
+            self._tasks.append(self._event_loop(host_config))
+
+    def client(self, host_config: DockerHostConfig) -> AsyncDockerClient:
+        """The client for a host, must be called from the loop thread."""
+        if host_config.name not in self._clients:
+            self._clients[host_config.name] = AsyncDockerClient(host_config)
+        return self._clients[host_config.name]
+
+    def call(self, host_config: DockerHostConfig, operation: Callable[[AsyncDockerClient], Any], timeout: float, cleanup: Callable[[AsyncDockerClient, Any], Any] = None):
+        """
+        Run operation(client) on the event loop and wait at most timeout seconds for the result of the coroutine it returns.
+
+        A coroutine that is still running at the timeout cannot be interrupted: if it completes later, cleanup(client, result) is run on the loop to undo it.
+
+        :raises ZoeException: on timeout or if the event loop is stopped
+        """
+        if self._stopping:
+            raise ZoeException('The event loop of Docker host {} is stopped'.format(host_config.name))
+        result = concurrent.futures.Future()
+        running = {}
+
+        def _start():
+            if not result.set_running_or_notify_cancel():
+                return  # the caller has given up before the operation could start
+            try:
+                running['future'] = operation(self.client(host_config))
+            except Exception as e:  # pylint: disable=broad-except
+                result.set_exception(e)
+                return
+            tornado.concurrent.chain_future(running['future'], result)
+
+        def _abandon():
+            if cleanup is not None and 'future' in running:
+                self.loop.add_future(running['future'], lambda future: self._late_result(host_config, future, cleanup))
+
+        self.loop.add_callback(_start)
+        try:
+            return result.result(timeout=timeout)
+        except concurrent.futures.TimeoutError:
+            if not result.cancel():  # already running, runs on the loop after _start
+                self.loop.add_callback(_abandon)
+            raise ZoeException('Timeout while waiting for Docker host {}'.format(host_config.name))
+
+    def _late_result(self, host_config: DockerHostConfig, future, cleanup: Callable[[AsyncDockerClient, Any], Any]):
+        """Undo an operation that completed after its caller timed out."""
+        if future.exception() is not None:
+            return
+        log.warning('Operation on Docker host {} completed after its timeout, cleaning up'.format(host_config.name))
+
+        def _cleanup_done(cleanup_future):
+            if cleanup_future.exception() is not None:
+                log.error('Cannot clean up after a timeout on Docker host {}: {}'.format(host_config.name, cleanup_future.exception()))
+
+        self.loop.add_future(cleanup(self.client(host_config), future.result()), _cleanup_done)
+
+    def _container_event(self, host_config: DockerHostConfig, event) -> bool:
+        """Apply a container event in the database thread."""
+        def _apply():
+            try:
+                super(AsyncDockerStateSynchronizer, self)._container_event(host_config, event)
+            except Exception:  # pylint: disable=broad-except
+                log.exception('Cannot apply event {} of host {}'.format(event, host_config.name))
+
+        self._db_executor.submit(_apply)
+        return True
+
+    def _locked_host_containers(self, host_config: DockerHostConfig, all_containers, info):
+        with self._host_locks[host_config.name]:
+            return self._host_containers(host_config, all_containers, info)
+
+    def _locked_reconcile(self, host_config: DockerHostConfig, container_list, info, missing_limits, limits, listing_seq):
+        with self._host_locks[host_config.name]:
+            self._store_limits(host_config, missing_limits, limits)
+            return self._reconcile(host_config, container_list, info, listing_seq)
+
+    @tornado.gen.coroutine
+    def _host_loop(self, host_config: DockerHostConfig):
+        log.info("Synchro coroutine for host {} started".format(host_config.name))
+        while not self._stopping:
+            time_start = time.time()
+            self._wakeup[host_config.name].clear()
+            try:
+                yield self._update_host(host_config, time_start)
+            except ZoeException as e:
+                self.host_stats[host_config.name].status = 'offline'
+                log.error(str(e))
+                log.info('Node {} is offline'.format(host_config.name))
+            except Exception:  # pylint: disable=broad-except
+                log.exception('Unexpected error while synchronizing host {}'.format(host_config.name))
+
+            interval = RECONCILE_INTERVAL if self._events_connected[host_config.name] else CHECK_INTERVAL
+            sleep_time = interval - (time.time() - time_start)
+            if sleep_time <= 0:
+                log.warning('synchro coroutine for host {} is late by {:.2f} seconds'.format(host_config.name, sleep_time * -1))
+                sleep_time = 0
+            try:
+                yield self._wakeup[host_config.name].wait(timeout=self.loop.time() + sleep_time)
+            except tornado.gen.TimeoutError:
+                pass
+        log.info("Synchro coroutine for host {} stopped".format(host_config.name))
+
+    @tornado.gen.coroutine
+    def _event_loop(self, host_config: DockerHostConfig):
+        log.info("Event coroutine for host {} started".format(host_config.name))
+        filters = {'type': ['container', 'image']}
+        since = int(time.time())
+        while not self._stopping:
+            until = int(time.time()) + EVENT_WINDOW
+            try:
+                yield self.client(host_config).event_listener(lambda event: self._event(host_config, event), filters=filters, since=since, until=until)
+            except ZoeException as e:
+                if self._events_connected[host_config.name]:
+                    log.warning(str(e))
+                    self._events_connected[host_config.name] = False
+                yield tornado.gen.sleep(CHECK_INTERVAL)
+                continue  # since is not moved forward, the missed events are replayed when the stream is back
+            if not self._events_connected[host_config.name]:
+                log.info('Receiving events from host {}'.format(host_config.name))
+                self._events_connected[host_config.name] = True
+                self._wakeup[host_config.name].set()  # catch up with what happened while the stream was down
+            since = until  # events at the boundary second are received twice, their processing is idempotent
+            if self._images_dirty[host_config.name]:
+                try:
+                    yield self._update_images(host_config)
+                except ZoeException as e:
+                    log.warning(str(e))
+            if until > time.time():  # an engine whose clock is ahead answers at once, since the window has already passed for it
+                yield tornado.gen.sleep(until - time.time())
+        log.info("Event coroutine for host {} stopped".format(host_config.name))
+
+    @tornado.gen.coroutine
+    def _update_host(self, host_config: DockerHostConfig, time_start: float):
+        """Refresh the statistics of a host and the status of the services running on it."""
+        engine = self.client(host_config)
+        listing_seq = self._listing_seq(host_config.name)  # the events received during the listing are applied after it is requested
+        all_containers, info = yield [engine.list_brief(), engine.info()]
+
+        container_list, missing_limits = yield self._db_executor.submit(self._locked_host_containers, host_config, all_containers, info)
+        limits = yield [engine.resource_limits(cont_id) for cont_id in missing_limits]
+        to_terminate = yield self._db_executor.submit(self._locked_reconcile, host_config, container_list, info, missing_limits, limits, listing_seq)
+        yield [engine.terminate_container(cont_id, delete=True) for cont_id in to_terminate]
+
+        if self._images_dirty[host_config.name] or not self._events_connected[host_config.name]:
+            yield self._update_images(host_config)
+        self.host_stats[host_config.name].timestamp = time_start
+        self.host_stats[host_config.name].valid = True
+
+    @tornado.gen.coroutine
+    def _update_images(self, host_config: DockerHostConfig):
+        """Rebuild the image index of a host."""
+        self._images_dirty[host_config.name] = False  # an event received during the listing marks the index dirty again
+        images = yield self.client(host_config).list_images()
+        self._set_images(host_config, images)
+
+    def refresh_images(self, host_config: DockerHostConfig):
+        """Refresh the image index of a host, for example after pulling an image."""
+        self.call(host_config, lambda engine: self._update_images(host_config), timeout=REQUEST_TIMEOUT)
+
+    def quit(self):
+        """Stops the coroutines and the event loop."""
+        @tornado.gen.coroutine
+        def _stop():
+            self._stopping = True
+            for wakeup in self._wakeup.values():
+                wakeup.set()
+            yield self._tasks
+            self.loop.stop()
+
+        self.loop.add_callback(_stop)
+        self._thread.join()
+        self._db_executor.shutdown()
+
+
+class AsyncDockerEngineBackend(zoe_master.backends.base.BaseBackend):
+    """Zoe backend implementation for stand-alone Docker Engines, with non-blocking I/O."""
+    def __init__(self, opts):
+        super().__init__(opts)
+        self._host_configs = zoe_master.backends.docker.config.host_configs()
+        self.docker_config = list(self._host_configs.values())
+
+    def _get_config(self, host) -> Union[DockerHostConfig, None]:
+        return self._host_configs.get(host)
+
+    @classmethod
+    def init(cls, state):
+        """Starts the event loop and the synchronization of all the hosts."""
+        global _checker, _puller
+        _checker = AsyncDockerStateSynchronizer(state, list(zoe_master.backends.docker.config.host_configs().values()))
+        _puller = ImagePuller(on_pulled=_checker.refresh_images, pull_image=cls._pull_image)
+
+    @classmethod
+    def shutdown(cls):
+        """Stops the event loop and the image pulls."""
+        _puller.shutdown()
+        _checker.quit()
+
+    @staticmethod
+    def _pull_image(host_config: DockerHostConfig, image_name: str, progress: Callable):
+        _checker.call(host_config, lambda engine: engine.pull_image(image_name, progress), timeout=PULL_TIMEOUT + REQUEST_TIMEOUT)
+
+    def spawn_service(self, service_instance: ServiceInstance):
+        """Spawn a service, translating a Zoe Service into a Docker container."""
+        if not image_has_version(service_instance.image_name):
+            raise ZoeStartExecutionFatalException('Image {} does not have a version tag'.format(service_instance.image_name))
+        conf = self._get_config(service_instance.backend_host)
+        try:
+            cont_info = _checker.call(conf, lambda engine: engine.spawn_container(service_instance), timeout=REQUEST_TIMEOUT * 3,
+                                      cleanup=lambda engine, late_info: engine.terminate_container(late_info['id'], delete=True))
+        except ZoeNotEnoughResourcesException:
+            raise ZoeStartExecutionRetryException('Not enough free resources to satisfy reservation request for service {}'.format(service_instance.name))
+        except ZoeException as e:
+            raise ZoeStartExecutionFatalException(str(e))
+
+        return cont_info["id"], cont_info['external_address'], cont_info['ports']
+
+    def spawn_services(self, service_instances: List[ServiceInstance]):
+        """Spawn a group of services, the containers are created concurrently by the event loop."""
+        for service_instance in service_instances:
+            if not image_has_version(service_instance.image_name):
+                raise ZoeStartExecutionFatalException('Image {} does not have a version tag'.format(service_instance.image_name))
+        confs = [self._get_config(service_instance.backend_host) for service_instance in service_instances]
+
+        @tornado.gen.coroutine
+        def _spawn(conf: DockerHostConfig, service_instance: ServiceInstance):
+            try:
+                cont_info = yield _checker.client(conf).spawn_container(service_instance)
+            except ZoeException as e:
+                return None, e
+            return cont_info, None
+
+        @tornado.gen.coroutine
+        def _remove(cont_infos):
+            yield [_checker.client(conf).terminate_container(cont_info['id'], delete=True) for conf, cont_info in zip(confs, cont_infos) if cont_info is not None]
+
+        @tornado.gen.coroutine
+        def _spawn_all(engine):  # pylint: disable=unused-argument
+            results = yield [_spawn(conf, service_instance) for conf, service_instance in zip(confs, service_instances)]
+            errors = [error for cont_info, error in results if error is not None]
+            if len(errors) > 0:
+                yield _remove([cont_info for cont_info, error in results])
+                not_enough = [error for error in errors if isinstance(error, ZoeNotEnoughResourcesException)]
+                raise not_enough[0] if len(not_enough) > 0 else errors[0]
+            return [cont_info for cont_info, error in results]
+
+        try:
+            cont_infos = _checker.call(confs[0], _spawn_all, timeout=REQUEST_TIMEOUT * 3, cleanup=lambda engine, late_infos: _remove(late_infos))
+        except ZoeNotEnoughResourcesException:
+            raise ZoeStartExecutionRetryException('Not enough free resources to satisfy reservation request for services {}'.format(', '.join(si.name for si in service_instances)))
+        except ZoeException as e:
+            raise ZoeStartExecutionFatalException(str(e))
+
+        return [(cont_info["id"], cont_info['external_address'], cont_info['ports']) for cont_info in cont_infos]
+
+    def terminate_service(self, service: Service) -> None:
+        """Terminate and delete a container."""
+        conf = self._get_config(service.backend_host)
+        service.set_terminating()
+        if service.backend_id is not None:
+            try:
+                _checker.call(conf, lambda engine: engine.terminate_container(service.backend_id, delete=True), timeout=REQUEST_TIMEOUT)
+            except ZoeException as e:
+                log.error('Cannot terminate service {}: {}'.format(service.id, str(e)))
+                return
+        else:
+            log.error('Cannot terminate service {}, since it has no backend ID'.format(service.name))
+        service.set_backend_status(service.BACKEND_DESTROY_STATUS)
+
+    def platform_state(self) -> ClusterStats:
+        """Get the platform state."""
+        platform_stats = ClusterStats()
+        for host_conf in self.docker_config:  # type: DockerHostConfig
+            try:
+                node_stats = _checker.host_stats[host_conf.name]
+            except KeyError:
+                continue
+            platform_stats.nodes.append(node_stats)
+
+        platform_stats.timestamp = time.time()
+        return platform_stats
+
+    def node_list(self):
+        """Return a list of node names."""
+        return [node.name for node in self.docker_config]
+
+    def preload_image(self, image_name):
+        """Pull an image from a Docker registry into all hosts in parallel, waiting for the pulls to finish."""
+        if not image_has_version(image_name):
+            raise ZoeException('Image {} does not have a version tag'.format(image_name))
+        pulls = _puller.pull_all(image_name, self.docker_config)
+        if not _puller.wait(pulls):
+            raise ZoeException('Cannot pull image {}'.format(image_name))
+
+    def prefetch_images(self, images):
+        """Start pulling images on the nodes that do not have them yet, without waiting."""
+        for image_name, node_names in images.items():
+            for node_name in node_names:
+                conf = self._get_config(node_name)
+                if conf is not None and image_name not in _checker.host_stats[node_name].images:
+                    _puller.pull(conf, image_name)
+
+    def image_pulls(self):
+        """The image pulls in progress and the ones finished recently."""
+        return [pull.serialize() for pull in _puller.progress()]
+
+    @classmethod
+    def service_log_stream(cls, service: Service, since=None, tail='all', follow=False):
+        """Stream the log of a service from its container, with a client that is not shared with the back-end operations."""
+        return container_log_stream(service, since, tail, follow)
+
+    def list_available_images(self, node_name):
+        """List the images available on the specified node."""
+        node_stats = _checker.host_stats[node_name]
+
+        if node_stats.status == 'offline':
+            return ImageIndex()
+        return node_stats.images
+
+    def image_nodes(self, image_name):
+        """Return the names of the nodes where an image is available."""
+        return _checker.image_nodes(image_name)
+
+    def update_service(self, service, cores=None, memory=None):
+        """Update a service reservation."""
+        conf = self._get_config(service.backend_host)
+        if service.backend_id is not None:
+            @tornado.gen.coroutine
+            def _update(engine):
+                info = yield engine.info()
+                new_cores = min(cores, info['NCPU']) if cores is not None else None
+                new_memory = min(memory, info['MemTotal']) if memory is not None else None
+                yield engine.update(service.backend_id, cpu_quota=int(new_cores * 100000) if new_cores is not None else None, mem_reservation=new_memory)
+
+            try:
+                _checker.call(conf, _update, timeout=REQUEST_TIMEOUT)
+            except ZoeException as e:
+                log.error(str(e))
+                return
+        else:
+            log.error('Cannot update reservations for service {} ({}), since it has no backend ID'.format(service.name, service.id))
+            if service.status == service.INACTIVE_STATUS:
+                service.set_backend_status(service.BACKEND_UNDEFINED_STATUS)
@@ -0,0 +1,338 @@
+# Copyright (c) 2017, Daniele Venzano
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Non-blocking client for the Docker Engine API, built on the Tornado HTTP client."""
+
+import json
+import logging
+import socket
+import time
+from typing import Any, Callable, Dict, List, Union
+from urllib.parse import quote, urlencode
+
+import docker.utils
+import tornado.gen
+import tornado.httpclient
+import tornado.netutil
+
+from zoe_lib.config import get_conf
+from zoe_lib.state import VolumeDescriptionHostPath
+from zoe_master.backends.docker.api_client import container_brief, container_limits, container_summary
+from zoe_master.backends.docker.config import DockerHostConfig  # pylint: disable=unused-import
+from zoe_master.backends.service_instance import ServiceInstance
+from zoe_master.exceptions import ZoeException, ZoeNotEnoughResourcesException
+
+log = logging.getLogger(__name__)
+
+REQUEST_TIMEOUT = 60  # seconds, for calls that do not stream
+PULL_TIMEOUT = 3600  # seconds, for a whole image pull
+CONNECT_TIMEOUT = 10
+MAX_CLIENTS = 16  # concurrent requests to a single host, the others are queued by the HTTP client
+
+
+class _UnixResolver(tornado.netutil.Resolver):
+    """Resolves every host name to the unix socket of the engine."""
+    def initialize(self, socket_path):  # pylint: disable=arguments-differ
+        """Called by the constructor with the path of the socket."""
+        self.socket_path = socket_path
+
+    @tornado.gen.coroutine
+    def resolve(self, host, port, family=socket.AF_UNSPEC):
+        """The socket path is returned for any host."""
+        return [(socket.AF_UNIX, self.socket_path)]
+
+
+class _JSONLines:
+    """Decodes a stream of JSON documents, one per line, as chunks arrive."""
+    def __init__(self, callback: Callable[[Dict[str, Any]], None]) -> None:
+        self.callback = callback
+        self._buffer = b''
+
+    def __call__(self, chunk: bytes):
+        self._buffer += chunk
+        lines = self._buffer.split(b'\n')
+        self._buffer = lines.pop()
+        for line in lines:
+            line = line.strip()
+            if len(line) > 0:
+                self.callback(json.loads(line.decode('utf-8')))
+
+
+class AsyncDockerClient:
+    """
+    Talks to a Docker Engine through its HTTP API, over TCP, TLS or a unix socket.
+
+    All methods are coroutines that must run on the IOLoop the client was created on. Errors are raised as ZoeException.
+    """
+    def __init__(self, docker_config: DockerHostConfig) -> None:
+        self.name = docker_config.name
+        self.docker_config = docker_config
+        self._request_defaults = {
+            'connect_timeout': CONNECT_TIMEOUT,
+            'request_timeout': REQUEST_TIMEOUT
+        }
+        address = docker_config.address
+        if address.startswith('unix://'):
+            self.base_url = 'http://docker'
+            resolver = _UnixResolver(socket_path=address[len('unix://'):])
+        else:
+            address = address.split('://', 1)[-1]
+            self.base_url = ('https://' if docker_config.tls else 'http://') + address
+            resolver = None
+            if docker_config.tls:
+                self._request_defaults.update({
+                    'client_cert': docker_config.tls_cert,
+                    'client_key': docker_config.tls_key,
+                    'ca_certs': docker_config.tls_ca
+                })
+        self.http = tornado.httpclient.AsyncHTTPClient(force_instance=True, max_clients=MAX_CLIENTS, resolver=resolver)
+
+    def close(self) -> None:
+        """Close the HTTP connections to the engine."""
+        self.http.close()
+
+    @tornado.gen.coroutine
+    def _request(self, method: str, path: str, params=None, body=None, allow_codes=(), **kwargs):
+        """Send a request to the engine, raising ZoeException on errors, unless the status code is in allow_codes."""
+        url = self.base_url + path
+        if params:
+            url += '?' + urlencode({key: value for key, value in params.items() if value is not None})
+        if body is not None:
+            body = json.dumps(body)
+            kwargs.setdefault('headers', {})['Content-Type'] = 'application/json'
+        elif method == 'POST':
+            body = ''
+        request_args = dict(self._request_defaults)
+        request_args.update(kwargs)
+        request = tornado.httpclient.HTTPRequest(url, method=method, body=body, **request_args)
+        try:
+            response = yield self.http.fetch(request, raise_error=False)
+        except (OSError, tornado.httpclient.HTTPError) as e:
+            raise ZoeException('Cannot connect to Docker host {}: {}'.format(self.name, e))
+        if response.code == 599:  # connection errors and timeouts
+            raise ZoeException('Cannot connect to Docker host {}: {}'.format(self.name, response.error))
+        if response.code >= 400 and response.code not in allow_codes:
+            raise ZoeException('Docker host {} returned {} for {} {}: {}'.format(self.name, response.code, method, path, self._error_message(response)))
+        return response
+
+    @staticmethod
+    def _error_message(response) -> str:
+        try:
+            return json.loads(response.body.decode('utf-8'))['message']
+        except (ValueError, KeyError, TypeError, AttributeError):
+            return str(response.error)
+
+    @staticmethod
+    def _json(response):
+        return json.loads(response.body.decode('utf-8'))
+
+    @tornado.gen.coroutine
+    def info(self) -> Dict:
+        """Retrieve engine statistics."""
+        response = yield self._request('GET', '/info')
+        return self._json(response)
+
+    @tornado.gen.coroutine
+    def list_brief(self) -> List[dict]:
+        """List all containers, with the same fields as DockerClient.list_brief()."""
+        response = yield self._request('GET', '/containers/json', params={'all': 1})
+        return [container_brief(cont_info) for cont_info in self._json(response)]
+
+    @tornado.gen.coroutine
+    def inspect_container(self, docker_id: str) -> Dict[str, Any]:
+        """Retrieve information about a container."""
+        response = yield self._request('GET', '/containers/{}/json'.format(quote(docker_id)))
+        return container_summary(self.docker_config, self._json(response))
+
+    @tornado.gen.coroutine
+    def resource_limits(self, docker_id: str) -> Union[Dict[str, int], None]:
+        """Read the resource limits of a container, None if the container does not exist anymore."""
+        response = yield self._request('GET', '/containers/{}/json'.format(quote(docker_id)), allow_codes=(404,))
+        if response.code == 404:
+            return None
+        return container_limits(self._json(response)['HostConfig'])
+
+    @tornado.gen.coroutine
+    def spawn_container(self, service_instance: ServiceInstance) -> Dict[str, Any]:
+        """Create and start a new container, with one create, one start and one inspect request."""
+        time_start = time.time()
+        response = yield self._request('POST', '/containers/create', params={'name': service_instance.name}, body=self._create_body(service_instance), allow_codes=(404,))
+        if response.code == 404:
+            raise ZoeException(message='Image not found')
+        docker_id = self._json(response)['Id']
+        time_created = time.time()
+
+        response = yield self._request('POST', '/containers/{}/start'.format(docker_id), allow_codes=(400, 500))
+        if response.code >= 400:
+            message = self._error_message(response)
+            yield self._request('DELETE', '/containers/{}'.format(docker_id), params={'force': 1}, allow_codes=(404,))
+            if message == 'no resources available to schedule container':
+                raise ZoeNotEnoughResourcesException(message=message)
+            raise ZoeException(message=message)
+
+        time_started = time.time()
+        cont_info = yield self.inspect_container(docker_id)  # the host ports are assigned at start
+        time_end = time.time()
+        log.debug('Container {} spawned on host {} in {:.3f}s: create {:.3f}s, start {:.3f}s, inspect {:.3f}s'.format(service_instance.name, self.name, time_end - time_start, time_created - time_start, time_started - time_created, time_end - time_started))
+        return cont_info
+
+    @staticmethod
+    def _create_body(service_instance: ServiceInstance) -> Dict[str, Any]:
+        """The container configuration, the same that DockerClient.spawn_container() passes to docker-py."""
+        host_config = {
+            'Binds': [],
+            'PortBindings': {},
+            'NetworkMode': service_instance.network,
+            'Memory': 0,
+            'MemoryReservation': 0,
+            'MemorySwap': 0,
+            'CpuPeriod': 100000,
+            'CpuQuota': 100000,
+            'LogConfig': {
+                'Type': 'json-file',
+                'Config': {}
+            }
+        }  # type: Dict[str, Any]
+        body = {
+            'Image': service_instance.image_name,
+            'Cmd': service_instance.command,
+            'Hostname': service_instance.hostname,
+            'WorkingDir': service_instance.work_dir,
+            'Labels': service_instance.labels,
+            'Env': ['{}={}'.format(name, value) for name, value in service_instance.environment],
+            'ExposedPorts': {},
+            'NetworkDisabled': False,
+            'HostConfig': host_config
+        }  # type: Dict[str, Any]
+        if isinstance(body['Cmd'], str):
+            body['Cmd'] = docker.utils.split_command(body['Cmd'])
+
+        for port in service_instance.ports:
+            port_name = str(port.number) + '/' + port.proto
+            body['ExposedPorts'][port_name] = {}
+            host_config['PortBindings'][port_name] = [{'HostIp': '', 'HostPort': ''}]
+
+        for volume in service_instance.volumes:
+            if volume.type == "host_directory":
+                assert isinstance(volume, VolumeDescriptionHostPath)
+                host_config['Binds'].append('{}:{}:{}'.format(volume.path, volume.mount_point, "ro" if volume.readonly else "rw"))
+            else:
+                log.error('Docker backend does not support volume type {}'.format(volume.type))
+
+        if service_instance.memory_limit is not None:
+            host_config['Memory'] = service_instance.memory_limit.min
+        if service_instance.core_limit is not None:
+            host_config['CpuQuota'] = int(100000 * service_instance.core_limit.min)
+        if service_instance.shm_size > 0:
+            host_config['ShmSize'] = service_instance.shm_size
+
+        if get_conf().gelf_address != '':
+            host_config['LogConfig'] = {
+                'Type': 'gelf',
+                'Config': {
+                    'gelf-address': get_conf().gelf_address,
+                    'labels': ",".join(service_instance.labels)
+                }
+            }
+        return body
+
+    @tornado.gen.coroutine
+    def terminate_container(self, docker_id: str, delete=False):
+        """Terminate a container, and delete its files if delete is True."""
+        try:
+            if delete:
+                yield self._request('DELETE', '/containers/{}'.format(quote(docker_id)), params={'force': 1}, allow_codes=(404,))
+            else:
+                yield self._request('POST', '/containers/{}/stop'.format(quote(docker_id)), params={'t': 5}, allow_codes=(304, 404))
+        except ZoeException as e:
+            log.warning(str(e))
+
+    @tornado.gen.coroutine
+    def update(self, docker_id, cpu_quota=None, mem_reservation=None, mem_limit=None):
+        """Update the resource reservation for a container."""
+        body = {}
+        if cpu_quota is not None:
+            body['CpuQuota'] = cpu_quota
+        if mem_reservation is not None:
+            body['MemoryReservation'] = mem_reservation
+        if mem_limit is not None:
+            body['Memory'] = mem_limit
+        try:
+            yield self._request('POST', '/containers/{}/update'.format(quote(docker_id)), body=body, allow_codes=(404,))
+        except ZoeException as e:
+            log.warning(str(e))
+
+    @tornado.gen.coroutine
+    def stats(self, docker_id: str) -> Dict[str, Any]:
+        """Retrieve one sample of the resource usage statistics of a container."""
+        response = yield self._request('GET', '/containers/{}/stats'.format(quote(docker_id)), params={'stream': 0}, allow_codes=(404,))
+        if response.code == 404:
+            raise ZoeException('Container not found')
+        return self._json(response)
+
+    @tornado.gen.coroutine
+    def list_images(self) -> List[Dict[str, Any]]:
+        """Retrieve the list of images available on this node, in the format used by ImageIndex."""
+        response = yield self._request('GET', '/images/json')
+        images = []
+        for image in self._json(response):
+            images.append({
+                'id': image['Id'],
+                'size': image['Size'],
+                'names': [tag for tag in image.get('RepoTags') or [] if tag != '<none>:<none>'],
+                'digests': [digest for digest in image.get('RepoDigests') or [] if digest != '<none>@<none>']
+            })
+        return images
+
+    @tornado.gen.coroutine
+    def pull_image(self, image_name, progress: Callable[[Dict[str, Any]], None] = None):
+        """Pull an image, calling progress with each message sent by the engine."""
+        errors = []
+
+        def _message(message):
+            if 'error' in message:
+                errors.append(message['error'])
+            elif progress is not None:
+                progress(message)
+
+        repository, tag = docker.utils.parse_repository_tag(image_name)
+        yield self._request('POST', '/images/create', params={'fromImage': repository, 'tag': tag}, streaming_callback=_JSONLines(_message), request_timeout=PULL_TIMEOUT)
+        if len(errors) > 0:
+            raise ZoeException('Cannot download image {}: {}'.format(image_name, errors[0]))
+
+    @tornado.gen.coroutine
+    def event_listener(self, callback: Callable[[Dict[str, Any]], Any], filters=None, since=None, until=None):
+        """
+        Listen for events from the engine until the until time is reached.
+
+        :raises ZoeException: if the connection to the engine is lost
+        """
+        def _event(event):
+            try:
+                callback(event)
+            except Exception:
+                log.exception('Uncaught exception in docker event callback')
+                log.warning('event was: {}'.format(event))
+
+        params = {
+            'filters': json.dumps(filters) if filters is not None else None,
+            'since': since,
+            'until': until
+        }
+        request_timeout = REQUEST_TIMEOUT if until is None else max(until - time.time(), 0) + REQUEST_TIMEOUT
+        try:
+            yield self._request('GET', '/events', params=params, streaming_callback=_JSONLines(_event), request_timeout=request_timeout)
+        except ZoeException as e:
+            raise ZoeException('Lost the event stream of Docker host {}: {}'.format(self.name, e))
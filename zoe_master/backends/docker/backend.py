@@ -15,59 +15,85 @@
 
 """Zoe backend implementation for one or more Docker Engines."""
 
+from concurrent.futures import wait
+from functools import partial
 import logging
-import re
 import time
-from typing import Union
+from typing import List, Union
 
-from zoe_lib.config import get_conf
 from zoe_lib.state import Service
 import zoe_master.backends.base
+from zoe_master.backends.common import image_has_version
 from zoe_master.backends.docker.api_client import DockerClient
-from zoe_master.backends.docker.config import DockerConfig, DockerHostConfig  # pylint: disable=unused-import
+from zoe_master.backends.docker.config import DockerHostConfig, host_configs  # pylint: disable=unused-import
+from zoe_master.backends.docker.images import ImagePuller
+from zoe_master.backends.docker.pool import container_log_stream, get_pool
 from zoe_master.backends.docker.threads import DockerStateSynchronizer
 from zoe_master.backends.service_instance import ServiceInstance
 from zoe_master.exceptions import ZoeStartExecutionRetryException, ZoeStartExecutionFatalException, ZoeException, ZoeNotEnoughResourcesException
-from zoe_master.stats import ClusterStats
+from zoe_master.stats import ClusterStats, ImageIndex
 
 log = logging.getLogger(__name__)
 
+# Seconds to wait for the create, start and inspect requests of a spawn, including the time spent waiting for a thread of the host
+SPAWN_TIMEOUT = 180
+
 # This module-level variable holds the references to the synchro threads
 _checker = None
+# The image distribution workers
+_puller = None
+
+
+def _spawn(service_instance: ServiceInstance, engine: DockerClient):
+    return engine.spawn_container(service_instance)
+
+
+def _remove_late(engine: DockerClient, cont_info):
+    """Remove a container whose spawn completed after the back-end gave up on it."""
+    engine.terminate_container(cont_info['id'], delete=True)
+
+
+def _update(container_id, cores, memory, engine: DockerClient):
+    info = engine.info()
+    if cores is not None and cores > info['NCPU']:
+        cores = info['NCPU']
+    if memory is not None and memory > info['MemTotal']:
+        memory = info['MemTotal']
+    cpu_quota = int(cores * 100000)
+    engine.update(container_id, cpu_quota=cpu_quota, mem_reservation=memory)
 
 
 class DockerEngineBackend(zoe_master.backends.base.BaseBackend):
     """Zoe backend implementation for old-style stand-alone Docker Swarm."""
     def __init__(self, opts):
         super().__init__(opts)
-        self.docker_config = DockerConfig(get_conf().backend_docker_config_file).read_config()
+        self._host_configs = host_configs()
+        self.docker_config = list(self._host_configs.values())
 
     def _get_config(self, host) -> Union[DockerHostConfig, None]:
-        for conf in self.docker_config:
-            if conf.name == host:
-                return conf
-        return None
+        return self._host_configs.get(host)
 
     @classmethod
     def init(cls, state):
         """Initializes Swarm backend starting the event monitoring thread."""
-        global _checker
-        _checker = DockerStateSynchronizer(state)
+        global _checker, _puller
+        _checker = DockerStateSynchronizer(state, list(host_configs().values()))
+        _puller = ImagePuller(on_pulled=_checker.refresh_images)
 
     @classmethod
     def shutdown(cls):
         """Performs a clean shutdown of the resources used by Swarm backend."""
+        _puller.shutdown()
         _checker.quit()
+        get_pool().close()
 
     def spawn_service(self, service_instance: ServiceInstance):
         """Spawn a service, translating a Zoe Service into a Docker container."""
-        parsed_name = re.search(r'^(?:([^/]+)/)?(?:([^/]+)/)?([^@:/]+)(?:[@:](.+))?$', service_instance.image_name)
-        if parsed_name.group(4) is None:
+        if not image_has_version(service_instance.image_name):
             raise ZoeStartExecutionFatalException('Image {} does not have a version tag'.format(service_instance.image_name))
         conf = self._get_config(service_instance.backend_host)
         try:
-            engine = DockerClient(conf)
-            cont_info = engine.spawn_container(service_instance)
+            cont_info = get_pool().call(conf, partial(_spawn, service_instance), timeout=SPAWN_TIMEOUT, cleanup=_remove_late)
         except ZoeNotEnoughResourcesException:
             raise ZoeStartExecutionRetryException('Not enough free resources to satisfy reservation request for service {}'.format(service_instance.name))
         except ZoeException as e:
@@ -75,17 +101,53 @@ class DockerEngineBackend(zoe_master.backends.base.BaseBackend):
 
         return cont_info["id"], cont_info['external_address'], cont_info['ports']
 
+    def spawn_services(self, service_instances: List[ServiceInstance]):
+        """Spawn a group of services, the containers are created in parallel by the threads of their hosts."""
+        for service_instance in service_instances:
+            if not image_has_version(service_instance.image_name):
+                raise ZoeStartExecutionFatalException('Image {} does not have a version tag'.format(service_instance.image_name))
+
+        futures = []
+        errors = []
+        for service_instance in service_instances:
+            try:
+                futures.append(get_pool().submit(self._get_config(service_instance.backend_host), partial(_spawn, service_instance)))
+            except ZoeException as e:  # unavailable host, fail fast
+                errors.append(e)
+                break
+        done, not_done = wait(futures, timeout=SPAWN_TIMEOUT)
+        for service_instance, future in zip(service_instances, futures):
+            if future in not_done:
+                get_pool().abandon(self._get_config(service_instance.backend_host), future, cleanup=_remove_late)
+                errors.append(ZoeException('Timeout waiting for Docker host {}'.format(service_instance.backend_host)))
+        errors += [future.exception() for future in futures if future in done and future.exception() is not None]
+
+        if len(errors) > 0:
+            for service_instance, future in zip(service_instances, futures):
+                if future in done and future.exception() is None:
+                    self._remove_container(service_instance.backend_host, future.result()['id'])
+            if any(isinstance(error, ZoeNotEnoughResourcesException) for error in errors):
+                raise ZoeStartExecutionRetryException('Not enough free resources to satisfy reservation request for services {}'.format(', '.join(si.name for si in service_instances)))
+            raise ZoeStartExecutionFatalException(str(errors[0]))
+
+        return [(cont_info["id"], cont_info['external_address'], cont_info['ports']) for cont_info in (future.result() for future in futures)]
+
+    def _remove_container(self, host, container_id):
+        try:
+            get_pool().call(self._get_config(host), lambda engine: engine.terminate_container(container_id, delete=True))
+        except ZoeException as e:
+            log.error('Cannot remove container {} on host {}: {}'.format(container_id, host, e))
+
     def terminate_service(self, service: Service) -> None:
         """Terminate and delete a container."""
         conf = self._get_config(service.backend_host)
         service.set_terminating()
-        try:
-            engine = DockerClient(conf)
-        except ZoeException as e:
-            log.error('Cannot terminate service {}: {}'.format(service.id, str(e)))
-            return
         if service.backend_id is not None:
-            engine.terminate_container(service.backend_id, delete=True)
+            try:
+                get_pool().call(conf, lambda engine: engine.terminate_container(service.backend_id, delete=True))
+            except ZoeException as e:
+                log.error('Cannot terminate service {}: {}'.format(service.id, str(e)))
+                return
         else:
             log.error('Cannot terminate service {}, since it has no backend ID'.format(service.name))
         service.set_backend_status(service.BACKEND_DESTROY_STATUS)
@@ -107,57 +169,52 @@ class DockerEngineBackend(zoe_master.backends.base.BaseBackend):
         """Return a list of node names."""
         return [node.name for node in self.docker_config]
 
-    def service_log(self, service: Service):
-        """Get the log."""
-        conf = self._get_config(service.backend_host)
-        engine = DockerClient(conf)
-        return engine.logs(service.backend_id, True, False)
-
     def preload_image(self, image_name):
-        """Pull an image from a Docker registry into each host. We shuffle the list to prevent the scheduler to find always the first host in the list."""
-        parsed_name = re.search(r'^(?:([^/]+)/)?(?:([^/]+)/)?([^@:/]+)(?:[@:](.+))?$', image_name)
-        if parsed_name.group(4) is None:
+        """Pull an image from a Docker registry into all hosts in parallel, waiting for the pulls to finish."""
+        if not image_has_version(image_name):
             raise ZoeException('Image {} does not have a version tag'.format(image_name))
-        one_success = False
-        for host_conf in self.docker_config:
-            log.debug('Pre-loading image {} on host {}'.format(image_name, host_conf.name))
-            time_start = time.time()
-            my_engine = DockerClient(host_conf)
-            try:
-                my_engine.pull_image(image_name)
-            except ZoeException:
-                log.error('Image {} pre-loading failed on host {}'.format(image_name, host_conf.name))
-                continue
-            else:
-                one_success = True
-            log.debug('Image {} pre-loaded on host {} in {:.2f}s'.format(image_name, host_conf.name, time.time() - time_start))
-        if not one_success:
+        pulls = _puller.pull_all(image_name, self.docker_config)
+        if not _puller.wait(pulls):
             raise ZoeException('Cannot pull image {}'.format(image_name))
 
+    def prefetch_images(self, images):
+        """Start pulling images on the nodes that do not have them yet, without waiting."""
+        for image_name, node_names in images.items():
+            for node_name in node_names:
+                conf = self._get_config(node_name)
+                if conf is not None and image_name not in _checker.host_stats[node_name].images:
+                    _puller.pull(conf, image_name)
+
+    def image_pulls(self):
+        """The image pulls in progress and the ones finished recently."""
+        return [pull.serialize() for pull in _puller.progress()]
+
+    @classmethod
+    def service_log_stream(cls, service: Service, since=None, tail='all', follow=False):
+        """Stream the log of a service from its container, with a client that is not shared with the back-end operations."""
+        return container_log_stream(service, since, tail, follow)
+
     def list_available_images(self, node_name):
         """List the images available on the specified node."""
         node_stats = _checker.host_stats[node_name]
 
         if node_stats.status == 'offline':
-            return []
+            return ImageIndex()
         return node_stats.images
 
+    def image_nodes(self, image_name):
+        """Return the names of the nodes where an image is available."""
+        return _checker.image_nodes(image_name)
+
     def update_service(self, service, cores=None, memory=None):
         """Update a service reservation."""
         conf = self._get_config(service.backend_host)
-        try:
-            engine = DockerClient(conf)
-        except ZoeException as e:
-            log.error(str(e))
-            return
         if service.backend_id is not None:
-            info = engine.info()
-            if cores is not None and cores > info['NCPU']:
-                cores = info['NCPU']
-            if memory is not None and memory > info['MemTotal']:
-                memory = info['MemTotal']
-            cpu_quota = int(cores * 100000)
-            engine.update(service.backend_id, cpu_quota=cpu_quota, mem_reservation=memory)
+            try:
+                get_pool().call(conf, partial(_update, service.backend_id, cores, memory))
+            except ZoeException as e:
+                log.error(str(e))
+                return
         else:
             log.error('Cannot update reservations for service {} ({}), since it has no backend ID'.format(service.name, service.id))
             if service.status == service.INACTIVE_STATUS:
@@ -17,10 +17,17 @@
 
 import configparser
 import logging
-from typing import List
+import threading
+from typing import Dict, List
+
+from zoe_lib.config import get_conf
 
 log = logging.getLogger(__name__)
 
+# The configuration file that has been parsed and its hosts, indexed by name
+_loaded = None
+_loaded_lock = threading.Lock()
+
 
 class DockerHostConfig:
     """A class that holds static information about a host."""
@@ -67,3 +74,13 @@ class DockerConfig:
         if len(hosts) == 0:
             log.error('Host list is empty, verify your docker backend configuration!')
         return hosts
+
+
+def host_configs() -> Dict[str, DockerHostConfig]:
+    """The hosts of the Docker back-end configuration file, indexed by name, the file is parsed only once per process."""
+    global _loaded
+    config_file = get_conf().backend_docker_config_file
+    with _loaded_lock:
+        if _loaded is None or _loaded[0] != config_file:
+            _loaded = config_file, {host.name: host for host in DockerConfig(config_file).read_config()}
+        return _loaded[1]
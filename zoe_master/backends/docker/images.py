@@ -0,0 +1,175 @@
+# Copyright (c) 2017, Daniele Venzano
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Distribution of images to the Docker hosts, with a bounded number of concurrent pulls."""
+
+import concurrent.futures
+import logging
+import threading
+import time
+from typing import Callable, Dict, List, Tuple, Iterable
+
+from zoe_master.backends.common import normalize_image_name
+from zoe_master.backends.docker.config import DockerHostConfig  # pylint: disable=unused-import
+from zoe_master.backends.docker.pool import get_pool
+from zoe_master.exceptions import ZoeException
+
+log = logging.getLogger(__name__)
+
+# Pulls running at the same time across all hosts, the others wait in a queue
+MAX_CONCURRENT_PULLS = 4
+# Seconds before a failed pull of the same image on the same host is attempted again
+RETRY_INTERVAL = 60
+# Seconds finished pulls are kept for progress reporting
+HISTORY_TIME = 600
+
+
+class ImagePull:
+    """The progress of the pull of an image on one host."""
+    QUEUED_STATUS = 'queued'
+    PULLING_STATUS = 'pulling'
+    DONE_STATUS = 'done'
+    ERROR_STATUS = 'error'
+
+    def __init__(self, host_name, image_name):
+        self.host = host_name
+        self.image = image_name
+        self.status = self.QUEUED_STATUS
+        self.error = None
+        self.time_submit = time.time()
+        self.time_end = None
+        self.future = None
+        self._layers = {}  # type: Dict[str, Tuple[int, int]]
+
+    def progress(self, message):
+        """Account for a progress message sent by the engine."""
+        layer = message.get('id')
+        if layer is None:
+            return
+        detail = message.get('progressDetail') or {}
+        if message.get('status') == 'Downloading' and 'total' in detail:
+            self._layers[layer] = (detail.get('current', 0), detail['total'])
+        elif message.get('status') in ('Download complete', 'Pull complete') and layer in self._layers:
+            self._layers[layer] = (self._layers[layer][1], self._layers[layer][1])
+
+    @property
+    def is_active(self):
+        """True if the pull is queued or in progress."""
+        return self.status in (self.QUEUED_STATUS, self.PULLING_STATUS)
+
+    def serialize(self):
+        """Convert the object into a dict."""
+        layers = list(self._layers.values())
+        return {
+            'host': self.host,
+            'image': self.image,
+            'status': self.status,
+            'error': self.error,
+            'time_submit': self.time_submit,
+            'time_end': self.time_end,
+            'bytes_downloaded': sum(layer[0] for layer in layers),
+            'bytes_total': sum(layer[1] for layer in layers)
+        }
+
+
+class ImagePuller:
+    """
+    Pulls images on the Docker hosts from a pool of worker threads.
+
+    A pull of an image on a host that is already queued or running is not started again, the caller gets the one in progress.
+    The pulls are made with docker-py, unless a different pull_image function is given.
+    """
+    def __init__(self, on_pulled: Callable[[DockerHostConfig], None] = None, pull_image: Callable[[DockerHostConfig, str, Callable], None] = None):
+        self._pull_image = pull_image if pull_image is not None else self._docker_pull
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=MAX_CONCURRENT_PULLS)
+        self._pulls = {}  # type: Dict[Tuple[str, str], ImagePull]
+        self._lock = threading.Lock()
+        self._on_pulled = on_pulled
+
+    def pull(self, host_config: DockerHostConfig, image_name: str) -> ImagePull:
+        """Queue the pull of an image on a host, unless it is already in progress or has failed recently."""
+        key = (host_config.name, normalize_image_name(image_name))
+        with self._lock:
+            self._prune()
+            pull = self._pulls.get(key)
+            if pull is not None and (pull.is_active or (pull.status == ImagePull.ERROR_STATUS and time.time() - pull.time_end < RETRY_INTERVAL)):
+                return pull
+            pull = ImagePull(host_config.name, image_name)
+            pull.future = self._executor.submit(self._pull_thread, host_config, pull)
+            self._pulls[key] = pull
+        log.debug('Pull of image {} on host {} queued'.format(image_name, host_config.name))
+        return pull
+
+    def pull_all(self, image_name: str, host_configs: Iterable[DockerHostConfig]) -> List[ImagePull]:
+        """Queue the pull of an image on many hosts."""
+        return [self.pull(host_config, image_name) for host_config in host_configs]
+
+    @staticmethod
+    def wait(pulls: List[ImagePull], timeout=None) -> bool:
+        """Wait for pulls to finish, returns True if at least one of them was successful."""
+        concurrent.futures.wait([pull.future for pull in pulls], timeout=timeout)
+        return any(pull.status == ImagePull.DONE_STATUS for pull in pulls)
+
+    def _pull_thread(self, host_config: DockerHostConfig, pull: ImagePull):
+        pull.status = ImagePull.PULLING_STATUS
+        time_start = time.time()
+        try:
+            self._pull_image(host_config, pull.image, pull.progress)
+        except Exception as e:  # pylint: disable=broad-except
+            # a pull that is never marked as finished would block all the following pulls of the same image
+            pull.error = str(e)
+            pull.time_end = time.time()
+            pull.status = ImagePull.ERROR_STATUS
+            log.error('Pull of image {} on host {} failed: {}'.format(pull.image, host_config.name, e))
+            return
+
+        pull.time_end = time.time()
+        pull.status = ImagePull.DONE_STATUS
+        log.info('Image {} pulled on host {} in {:.2f}s'.format(pull.image, host_config.name, pull.time_end - time_start))
+        if self._on_pulled is not None:
+            try:
+                self._on_pulled(host_config)
+            except ZoeException as e:
+                log.warning(str(e))
+
+    @staticmethod
+    def _docker_pull(host_config: DockerHostConfig, image_name: str, progress: Callable):
+        my_engine = get_pool().dedicated_client(host_config)  # a pull can take minutes, it should not hold a slot of the pool
+        try:
+            my_engine.pull_image(image_name, progress)
+        finally:
+            my_engine.close()
+
+    def _prune(self):
+        """Forget the pulls that finished more than HISTORY_TIME seconds ago. Must be called with the lock held."""
+        for key, pull in list(self._pulls.items()):
+            if not pull.is_active and time.time() - pull.time_end > HISTORY_TIME:
+                del self._pulls[key]
+
+    def progress(self) -> List[ImagePull]:
+        """The pulls in progress and the ones finished recently."""
+        with self._lock:
+            self._prune()
+            return sorted(self._pulls.values(), key=lambda p: p.time_submit)
+
+    def shutdown(self):
+        """Drop the queued pulls, the running ones are left to finish."""
+        with self._lock:
+            for pull in self._pulls.values():
+                if pull.future.cancel():
+                    pull.error = 'cancelled'
+                    pull.time_end = time.time()
+                    pull.status = ImagePull.ERROR_STATUS
+        self._executor.shutdown(wait=False)
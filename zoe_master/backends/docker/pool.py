@@ -0,0 +1,276 @@
+# Copyright (c) 2017, Daniele Venzano
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Pool of Docker Engine clients, one per host, shared by all back-end operations."""
+
+import contextlib
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, TypeVar, Union
+
+import requests.exceptions
+
+from zoe_lib.state import Service
+from zoe_master.backends.docker.api_client import ContainerLogStream, DockerClient
+from zoe_master.backends.docker.config import DockerHostConfig, host_configs
+from zoe_master.exceptions import ZoeException
+
+log = logging.getLogger(__name__)
+
+# Requests in flight to the same engine, lower than the size of the HTTP connection pool of the Docker library (10)
+MAX_CONCURRENT_REQUESTS = 8
+# Seconds to wait before trying again to connect to an engine that failed
+RETRY_INTERVAL = 5
+# Threads that run the back-end operations submitted for each engine
+WORKERS_PER_HOST = 4
+# Operations waiting or running for the same engine, beyond this limit new operations are refused
+MAX_PENDING_OPERATIONS = 64
+
+T = TypeVar('T')
+
+
+def _is_connection_error(exc: BaseException) -> bool:
+    """True if the exception, or the one it was raised from, means the engine cannot be reached."""
+    while exc is not None:
+        if isinstance(exc, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+            return True
+        exc = exc.__cause__ or exc.__context__
+    return False
+
+
+class _PooledHost:
+    """The client and the health information for one Docker Engine."""
+    def __init__(self, host_config: DockerHostConfig):
+        self.config = host_config
+        self.client = None
+        self.api_version = "auto"
+        self.semaphore = threading.BoundedSemaphore(MAX_CONCURRENT_REQUESTS)
+        self.lock = threading.Lock()
+        self.healthy = True
+        self.failures = 0
+        self.last_failure = 0
+        self.last_error = None
+        self.executor = None
+        self.pending = 0
+
+    def unavailable(self) -> bool:
+        """True while the circuit is open: the engine failed less than RETRY_INTERVAL seconds ago."""
+        return not self.healthy and time.time() - self.last_failure < RETRY_INTERVAL
+
+
+class DockerClientPool:
+    """
+    Keeps one DockerClient per host, so that HTTP connections are kept alive and reused, and the API version is negotiated only once.
+
+    Hosts that cannot be reached are marked unhealthy, and for RETRY_INTERVAL seconds requests to them fail immediately instead of waiting for a connection timeout.
+    After that interval the next request tries to connect again, and a success marks the host healthy.
+
+    Back-end operations can also be submitted to a small pool of threads dedicated to each host, with a bounded number of pending operations, so that a slow
+    engine does not hold the threads of the callers.
+    """
+    def __init__(self):
+        self._hosts = {}  # type: Dict[str, _PooledHost]
+        self._lock = threading.Lock()
+
+    def _host(self, host_config: DockerHostConfig) -> _PooledHost:
+        with self._lock:
+            host = self._hosts.get(host_config.name)
+            if host is None or host.config.address != host_config.address:
+                if host is not None and host.client is not None:
+                    host.client.close()
+                if host is not None and host.executor is not None:
+                    host.executor.shutdown(wait=False)
+                host = _PooledHost(host_config)
+                self._hosts[host_config.name] = host
+            return host
+
+    def _connect(self, host: _PooledHost) -> DockerClient:
+        if host.client is not None:
+            return host.client
+        if host.unavailable():
+            raise ZoeException('Docker host {} is unavailable: {}'.format(host.config.name, host.last_error))
+        try:
+            host.client = DockerClient(host.config, version=host.api_version)
+        except ZoeException as e:
+            self._failed(host, e)
+            raise
+        host.api_version = host.client.api_version  # pinned for the next connections
+        return host.client
+
+    def _failed(self, host: _PooledHost, exc: BaseException):
+        if host.healthy:
+            log.warning('Docker host {} is unavailable: {}'.format(host.config.name, exc))
+        host.healthy = False
+        host.failures += 1
+        host.last_failure = time.time()
+        host.last_error = str(exc)
+        if host.client is not None:
+            host.client.close()
+            host.client = None
+
+    @contextlib.contextmanager
+    def client(self, host_config: DockerHostConfig):
+        """
+        Borrow the client for a host, waiting if too many requests are in flight to the same engine.
+
+        :raises ZoeException: if the host cannot be reached
+        """
+        host = self._host(host_config)
+        with host.semaphore:
+            with host.lock:
+                client = self._connect(host)
+            try:
+                yield client
+            except Exception as e:
+                if _is_connection_error(e):
+                    with host.lock:
+                        self._failed(host, e)
+                raise
+            if not host.healthy:
+                with host.lock:
+                    log.info('Docker host {} is available again'.format(host_config.name))
+                    host.healthy = True
+                    host.failures = 0
+
+    def dedicated_client(self, host_config: DockerHostConfig) -> DockerClient:
+        """A new client outside the pool, with the pinned API version, for long-lived streams that should not hold a pool slot."""
+        host = self._host(host_config)
+        if host.unavailable():
+            raise ZoeException('Docker host {} is unavailable: {}'.format(host_config.name, host.last_error))
+        client = DockerClient(host_config, version=host.api_version)
+        host.api_version = client.api_version  # pinned for the next connections
+        return client
+
+    def set_offline(self, host_config: DockerHostConfig, reason: str):
+        """Mark a host as unavailable, for example when its synchronization fails, so that the operations submitted for it fail fast."""
+        host = self._host(host_config)
+        with host.lock:
+            self._failed(host, reason)
+
+    def submit(self, host_config: DockerHostConfig, operation: Callable[[DockerClient], T]) -> 'Future[T]':
+        """
+        Run operation(client) in one of the threads of the host, returns a future with the result.
+
+        :raises ZoeException: immediately, if the host is unavailable or has too many pending operations
+        """
+        host = self._host(host_config)
+        with host.lock:
+            if host.unavailable():
+                raise ZoeException('Docker host {} is unavailable: {}'.format(host_config.name, host.last_error))
+            if host.pending >= MAX_PENDING_OPERATIONS:
+                raise ZoeException('Docker host {} has too many pending operations'.format(host_config.name))
+            if host.executor is None:
+                host.executor = ThreadPoolExecutor(max_workers=WORKERS_PER_HOST)  # thread_name_prefix needs Python 3.6, the workers are named in _run
+            executor = host.executor
+            host.pending += 1
+        try:
+            future = executor.submit(self._run, host_config, operation)
+        except RuntimeError:  # the executor has been shut down by close() in the meantime
+            self._operation_done(host)
+            raise ZoeException('Docker host {} is shutting down'.format(host_config.name))
+        future.add_done_callback(lambda _: self._operation_done(host))
+        return future
+
+    def _run(self, host_config: DockerHostConfig, operation: Callable[[DockerClient], T]) -> T:
+        threading.current_thread().name = 'docker_' + host_config.name
+        with self.client(host_config) as engine:
+            return operation(engine)
+
+    @staticmethod
+    def _operation_done(host: _PooledHost):
+        with host.lock:
+            host.pending -= 1
+
+    def call(self, host_config: DockerHostConfig, operation: Callable[[DockerClient], T], timeout=None, cleanup: Callable[[DockerClient, T], Any] = None) -> T:
+        """
+        Run operation(client) in one of the threads of the host and wait for the result.
+
+        An operation that is still running at the timeout cannot be interrupted: if it completes later, cleanup(client, result) is run to undo it.
+
+        :raises ZoeException: if the host is unavailable, if it has too many pending operations or if the operation takes more than timeout seconds
+        """
+        future = self.submit(host_config, operation)
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeoutError:
+            self.abandon(host_config, future, cleanup)
+            raise ZoeException('Timeout waiting for Docker host {}'.format(host_config.name))
+
+    def abandon(self, host_config: DockerHostConfig, future: 'Future[T]', cleanup: Callable[[DockerClient, T], Any] = None):
+        """Give up on a submitted operation: it is cancelled if it has not started yet, otherwise cleanup(client, result) is run once it completes."""
+        if future.cancel() or cleanup is None:
+            return
+
+        def _late_result(done: 'Future[T]'):
+            if done.cancelled() or done.exception() is not None:
+                return
+            log.warning('Operation on Docker host {} completed after its timeout, cleaning up'.format(host_config.name))
+            try:
+                cleanup_future = self.submit(host_config, lambda engine: cleanup(engine, done.result()))
+            except ZoeException as e:
+                log.error('Cannot clean up after a timeout on Docker host {}: {}'.format(host_config.name, e))
+                return
+            cleanup_future.add_done_callback(_cleanup_done)
+
+        def _cleanup_done(done: Future):
+            if done.exception() is not None:
+                log.error('Cannot clean up after a timeout on Docker host {}: {}'.format(host_config.name, done.exception()))
+
+        future.add_done_callback(_late_result)
+
+    def health(self) -> Dict[str, Dict[str, Any]]:
+        """The health of the hosts used so far."""
+        with self._lock:
+            return {name: {'healthy': host.healthy, 'failures': host.failures, 'last_error': host.last_error, 'api_version': host.api_version, 'pending': host.pending} for name, host in self._hosts.items()}
+
+    def close(self):
+        """Close all connections and stop the threads of the hosts."""
+        with self._lock:
+            for host in self._hosts.values():
+                if host.client is not None:
+                    host.client.close()
+                    host.client = None
+                if host.executor is not None:
+                    host.executor.shutdown(wait=False)
+                    host.executor = None
+
+
+# The pool is shared by the backend instances, the synchronization threads and the image pulls
+_pool = DockerClientPool()
+
+
+def docker_client(host_config: DockerHostConfig):
+    """Borrow the pooled client for a host, to be used in a with statement."""
+    return _pool.client(host_config)
+
+
+def get_pool() -> DockerClientPool:
+    """The shared client pool."""
+    return _pool
+
+
+def container_log_stream(service: Service, since=None, tail='all', follow=False) -> Union[ContainerLogStream, None]:
+    """Open the log of the container of a service with a dedicated client, None if its host is not in the Docker back-end configuration."""
+    host_config = host_configs().get(service.backend_host)
+    if host_config is None:
+        return None
+    engine = _pool.dedicated_client(host_config)  # a followed log can stay open as long as the container runs
+    try:
+        return engine.logs(service.backend_id, since, tail, follow)
+    except ZoeException:
+        engine.close()
+        raise
@@ -15,6 +15,7 @@
 
 """Unit tests"""
 
+import threading
 import time
 
 import pytest
@@ -352,6 +353,29 @@ class MockContainer:
         return
 
 
+class MockChunks:
+    """A log stream of an idle container, a read waits until the stream is cancelled."""
+    def __init__(self):
+        self.cancelled = threading.Event()
+
+    def __next__(self):
+        self.cancelled.wait(5)
+        raise OSError('socket shut down')
+
+    def close(self):
+        """Cancel the stream."""
+        self.cancelled.set()
+
+
+class MockLogClient:
+    """A DockerClient that records when it is closed."""
+    closed = False
+
+    def close(self):
+        """Close the connections."""
+        self.closed = True
+
+
 class TestDockerEngineApiClient:
     """Docker low-level wrapper testing."""
 
@@ -392,3 +416,16 @@ class TestDockerEngineApiClient:
         cli = api_client.DockerClient(dhc, mock_client)
         cli.terminate_container('test')
         cli.terminate_container('test', delete=True)
+
+    def test_log_stream_close(self):
+        """Closing a log stream from another thread interrupts a read waiting for the container and closes the client."""
+        client = MockLogClient()
+        stream = api_client.ContainerLogStream(client, MockChunks(), 'abc')
+        chunks = []
+        reader = threading.Thread(target=lambda: chunks.append(next(stream, None)))
+        reader.start()
+        stream.close()
+        reader.join(5)
+        assert not reader.is_alive()
+        assert chunks == [None]
+        assert client.closed
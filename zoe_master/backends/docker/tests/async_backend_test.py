@@ -0,0 +1,141 @@
+# Copyright (c) 2017, Daniele Venzano
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for the event loop of the non-blocking Docker back-end."""
+
+from argparse import Namespace
+import threading
+
+import pytest
+import tornado.gen
+
+from zoe_lib.config import load_configuration
+from zoe_lib.tests.config_mock import zoe_configuration  # pylint: disable=unused-import
+from zoe_master.backends.docker import async_backend
+from zoe_master.backends.docker.async_backend import AsyncDockerStateSynchronizer
+from zoe_master.backends.docker.config import DockerHostConfig
+from zoe_master.exceptions import ZoeException, ZoeNotEnoughResourcesException, ZoeStartExecutionFatalException, ZoeStartExecutionRetryException
+
+
+def _host_config():
+    dhc = DockerHostConfig()
+    dhc.name = 'test'
+    dhc.address = 'tcp://127.0.0.1:2375'
+    return dhc
+
+
+class MockAsyncClient:
+    """An engine that creates the containers of the services named in its constructor, and refuses the others."""
+    def __init__(self, refused, error=ZoeException):
+        self.refused = refused
+        self.error = error
+        self.removed = []
+
+    @tornado.gen.coroutine
+    def spawn_container(self, service_instance):
+        """Create and start a container."""
+        yield tornado.gen.moment
+        if service_instance.name in self.refused:
+            raise self.error('cannot start {}'.format(service_instance.name))
+        return {'id': 'id-' + service_instance.name, 'external_address': '10.0.0.1', 'ports': {}}
+
+    @tornado.gen.coroutine
+    def terminate_container(self, docker_id, delete=False):  # pylint: disable=unused-argument
+        """Remove a container."""
+        self.removed.append(docker_id)
+
+
+class TestAsyncDockerStateSynchronizer:
+    """Event loop testing."""
+
+    def test_call_exception(self):
+        """Test that an exception raised before the coroutine starts reaches the caller."""
+        checker = AsyncDockerStateSynchronizer(None, [])
+        try:
+            def _operation(engine):
+                raise ZoeException('broken')
+            with pytest.raises(ZoeException, match='broken'):
+                checker.call(_host_config(), _operation, timeout=5)
+        finally:
+            checker.quit()
+
+    def test_call_timeout(self):
+        """Test that the result of a coroutine that completes after the timeout is cleaned up."""
+        checker = AsyncDockerStateSynchronizer(None, [])
+        cleaned = threading.Event()
+
+        @tornado.gen.coroutine
+        def _operation(engine):  # pylint: disable=unused-argument
+            yield tornado.gen.sleep(0.2)
+            return {'id': 'late'}
+
+        @tornado.gen.coroutine
+        def _cleanup(engine, result):  # pylint: disable=unused-argument
+            assert result['id'] == 'late'
+            cleaned.set()
+
+        try:
+            with pytest.raises(ZoeException, match='Timeout'):
+                checker.call(_host_config(), _operation, timeout=0.01, cleanup=_cleanup)
+            assert cleaned.wait(timeout=5)
+        finally:
+            checker.quit()
+
+    def test_call_stopped(self):
+        """Test that calls fail immediately once the loop is stopped."""
+        checker = AsyncDockerStateSynchronizer(None, [])
+        checker.quit()
+        with pytest.raises(ZoeException, match='stopped'):
+            checker.call(_host_config(), lambda engine: None, timeout=60)
+
+
+class TestAsyncDockerEngineBackend:
+    """Back-end operations on the event loop."""
+
+    @pytest.fixture
+    def backend(self, zoe_configuration, monkeypatch):  # pylint: disable=redefined-outer-name
+        """A back-end with one host, whose client is replaced by a mock."""
+        load_configuration(zoe_configuration)
+        monkeypatch.setattr(async_backend.zoe_master.backends.docker.config, 'host_configs', lambda: {'test': _host_config()})
+        checker = AsyncDockerStateSynchronizer(None, [])
+        monkeypatch.setattr(async_backend, '_checker', checker)
+        yield async_backend.AsyncDockerEngineBackend(zoe_configuration), checker
+        checker.quit()
+
+    @staticmethod
+    def _instances(*names):
+        return [Namespace(name=name, image_name='image:1', backend_host='test') for name in names]
+
+    def test_spawn_services(self, backend, monkeypatch):
+        """All the services of a group are started, in order."""
+        backend, checker = backend
+        engine = MockAsyncClient(refused=[])
+        monkeypatch.setattr(checker, 'client', lambda host_config: engine)
+        assert backend.spawn_services(self._instances('a', 'b')) == [('id-a', '10.0.0.1', {}), ('id-b', '10.0.0.1', {})]
+
+    def test_spawn_services_rollback(self, backend, monkeypatch):
+        """When a service cannot be started, the containers of the group are removed."""
+        backend, checker = backend
+        engine = MockAsyncClient(refused=['b'])
+        monkeypatch.setattr(checker, 'client', lambda host_config: engine)
+        with pytest.raises(ZoeStartExecutionFatalException):
+            backend.spawn_services(self._instances('a', 'b', 'c'))
+        assert sorted(engine.removed) == ['id-a', 'id-c']
+
+        engine = MockAsyncClient(refused=['a'], error=ZoeNotEnoughResourcesException)
+        monkeypatch.setattr(checker, 'client', lambda host_config: engine)
+        with pytest.raises(ZoeStartExecutionRetryException):
+            backend.spawn_services(self._instances('a', 'b'))
+        assert engine.removed == ['id-b']
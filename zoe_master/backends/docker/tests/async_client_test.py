@@ -0,0 +1,44 @@
+# Copyright (c) 2017, Daniele Venzano
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for the non-blocking Docker client."""
+
+from zoe_master.backends.docker import async_client
+from zoe_master.backends.docker.config import DockerHostConfig
+
+
+class TestAsyncDockerClient:
+    """Non-blocking Docker client testing."""
+
+    def test_json_lines(self):
+        """Test that JSON documents split across chunks are decoded once complete."""
+        messages = []
+        decoder = async_client._JSONLines(messages.append)  # pylint: disable=protected-access
+        decoder(b'{"status": "Downloading", "id": "l1"}\r\n{"sta')
+        assert messages == [{'status': 'Downloading', 'id': 'l1'}]
+        decoder(b'tus": "Pull complete"}\n\n')
+        assert messages[1] == {'status': 'Pull complete'}
+        assert len(messages) == 2
+
+    def test_base_url(self):
+        """Test the translation of the docker addresses into URLs."""
+        dhc = DockerHostConfig()
+        dhc.name = 'test'
+        dhc.address = 'tcp://192.168.1.1:2375'
+        assert async_client.AsyncDockerClient(dhc).base_url == 'http://192.168.1.1:2375'
+        dhc.tls = True
+        assert async_client.AsyncDockerClient(dhc).base_url == 'https://192.168.1.1:2375'
+        dhc.address = 'unix:///var/run/docker.sock'
+        assert async_client.AsyncDockerClient(dhc).base_url == 'http://docker'
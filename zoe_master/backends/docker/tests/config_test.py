@@ -15,6 +15,8 @@
 
 """Unit tests"""
 
+from zoe_lib.config import load_configuration
+from zoe_lib.tests.config_mock import zoe_configuration  # pylint: disable=unused-import
 from zoe_master.backends.docker import config
 
 
@@ -29,3 +31,16 @@ class TestDockerEngineBackendConfig:
         """Test Docker backend config parsing."""
         hosts = config.DockerConfig(config_file='integration_tests/sample_docker.conf').read_config()
         assert len(hosts) == 1
+
+    def test_host_configs(self, zoe_configuration, tmpdir):  # pylint: disable=redefined-outer-name
+        """The configuration file is parsed only once, until another file is configured."""
+        config_file = tmpdir.join('docker.conf')
+        config_file.write('[node-1]\ndocker_address = tcp://10.0.0.1:2375\nexternal_address = 10.0.0.1\nuse_tls = no\n')
+        zoe_configuration.backend_docker_config_file = str(config_file)
+        load_configuration(zoe_configuration)
+        hosts = config.host_configs()
+        assert hosts['node-1'].address == 'tcp://10.0.0.1:2375'
+        assert config.host_configs() is hosts
+        zoe_configuration.backend_docker_config_file = 'integration_tests/sample_docker.conf'
+        load_configuration(zoe_configuration)
+        assert 'node-1' not in config.host_configs()
@@ -0,0 +1,104 @@
+# Copyright (c) 2017, Daniele Venzano
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for the image distribution."""
+
+import threading
+import time
+
+import pytest
+
+from zoe_master.backends.docker import images
+from zoe_master.backends.docker.config import DockerHostConfig
+from zoe_master.exceptions import ZoeException
+
+
+class MockClient:
+    """A mock DockerClient whose pulls block until they are released."""
+    release = threading.Event()
+    pulled = []
+
+    def pull_image(self, image_name, progress=None):
+        """Pull an image, reporting the progress of one layer."""
+        MockClient.release.wait(timeout=5)
+        if image_name == 'broken:1':
+            raise ZoeException('Cannot download image broken:1')
+        progress({'status': 'Downloading', 'id': 'layer', 'progressDetail': {'current': 5, 'total': 10}})
+        progress({'status': 'Pull complete', 'id': 'layer', 'progressDetail': {}})
+        MockClient.pulled.append(image_name)
+
+    def close(self):
+        """Close the connections."""
+
+
+class MockPool:
+    """A mock pool returning mock clients."""
+    @staticmethod
+    def dedicated_client(host_config_):
+        """A new client."""
+        return MockClient()
+
+
+class TestImagePuller:
+    """Deduplication and progress of the pulls."""
+
+    @pytest.fixture
+    def host_config(self, monkeypatch):
+        """A host configuration, with the pool replaced by a mock."""
+        monkeypatch.setattr(images, 'get_pool', MockPool)
+        MockClient.release.clear()
+        MockClient.pulled = []
+        dhc = DockerHostConfig()
+        dhc.name = 'test'
+        dhc.address = 'tcp://localhost:2375'
+        return dhc
+
+    def test_dedup(self, host_config):
+        """Pulls of the same image on the same host are merged while in progress."""
+        refreshed = []
+        puller = images.ImagePuller(on_pulled=refreshed.append)
+        first = puller.pull(host_config, 'ubuntu')
+        second = puller.pull(host_config, 'docker.io/library/ubuntu:latest')
+        assert first is second
+        MockClient.release.set()
+        assert puller.wait([first], timeout=5)
+        assert MockClient.pulled == ['ubuntu']
+        assert refreshed == [host_config]
+        progress = puller.progress()[0].serialize()
+        assert progress['status'] == 'done'
+        assert progress['bytes_downloaded'] == progress['bytes_total'] == 10
+        assert puller.pull(host_config, 'ubuntu') is not first
+        puller.shutdown()
+
+    def test_failure(self, host_config):
+        """A failed pull is not retried immediately."""
+        puller = images.ImagePuller()
+        MockClient.release.set()
+        pull = puller.pull(host_config, 'broken:1')
+        assert not puller.wait([pull], timeout=5)
+        assert pull.status == 'error'
+        assert puller.pull(host_config, 'broken:1') is pull
+        puller.shutdown()
+
+    def test_history(self, host_config, monkeypatch):
+        """Finished pulls are forgotten after HISTORY_TIME also when the progress is never read."""
+        monkeypatch.setattr(images, 'HISTORY_TIME', 0)
+        puller = images.ImagePuller()
+        MockClient.release.set()
+        assert puller.wait([puller.pull(host_config, 'ubuntu:1')], timeout=5)
+        time.sleep(0.01)
+        puller.pull(host_config, 'ubuntu:2')
+        assert len(puller._pulls) == 1  # pylint: disable=protected-access
+        puller.shutdown()
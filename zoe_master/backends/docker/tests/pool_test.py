@@ -0,0 +1,174 @@
+# Copyright (c) 2017, Daniele Venzano
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for the Docker client pool."""
+
+from argparse import Namespace
+from concurrent.futures import ThreadPoolExecutor
+import threading
+
+import pytest
+import requests.exceptions
+
+from zoe_master.backends.docker import pool
+from zoe_master.backends.docker.config import DockerHostConfig
+from zoe_master.exceptions import ZoeException
+
+
+class MockClient:
+    """A mock DockerClient that records the API version it was created with."""
+    created = []
+
+    def __init__(self, docker_config, version="auto"):
+        self.docker_config = docker_config
+        self.version = version
+        self.closed = False
+        self.log_args = None
+        MockClient.created.append(self)
+
+    def logs(self, docker_id, since=None, tail='all', follow=False):
+        """Stream the logs of a container."""
+        if docker_id == 'gone':
+            raise ZoeException('Container {} not found'.format(docker_id))
+        self.log_args = (docker_id, since, tail, follow)
+        return iter([b'line\n'])
+
+    @property
+    def api_version(self):
+        """The negotiated version."""
+        return '1.30'
+
+    def close(self):
+        """Close the connections."""
+        self.closed = True
+
+
+class MockExecutor(ThreadPoolExecutor):
+    """An executor with the constructor of Python 3.4, which has no thread_name_prefix."""
+    def __init__(self, max_workers):
+        super().__init__(max_workers)
+
+
+class TestDockerClientPool:
+    """Client reuse and health tracking."""
+
+    @pytest.fixture
+    def host_config(self, monkeypatch):
+        """A host configuration, with the real client replaced by a mock."""
+        monkeypatch.setattr(pool, 'DockerClient', MockClient)
+        MockClient.created = []
+        dhc = DockerHostConfig()
+        dhc.name = 'test'
+        dhc.address = 'tcp://localhost:2375'
+        return dhc
+
+    def test_reuse(self, host_config):
+        """The client is created once, with the version negotiated on the first connection pinned for reconnections."""
+        client_pool = pool.DockerClientPool()
+        with client_pool.client(host_config) as first:
+            pass
+        with client_pool.client(host_config) as second:
+            pass
+        assert first is second
+        assert first.version == 'auto'
+        assert client_pool.health()['test']['api_version'] == '1.30'
+
+    def test_unhealthy(self, host_config):
+        """A connection error closes the client, new requests fail fast until the retry interval has passed."""
+        client_pool = pool.DockerClientPool()
+        with pytest.raises(ZoeException):
+            with client_pool.client(host_config):
+                try:
+                    raise requests.exceptions.ConnectionError('refused')
+                except requests.exceptions.ConnectionError as e:
+                    raise ZoeException(str(e))
+        assert MockClient.created[0].closed
+        assert not client_pool.health()['test']['healthy']
+
+        with pytest.raises(ZoeException):
+            with client_pool.client(host_config):
+                pass
+        assert len(MockClient.created) == 1
+
+        pool_host = client_pool._host(host_config)  # pylint: disable=protected-access
+        pool_host.last_failure -= pool.RETRY_INTERVAL
+        with client_pool.client(host_config) as client:
+            assert client.version == '1.30'
+        assert client_pool.health()['test']['healthy']
+
+    def test_submit(self, host_config, monkeypatch):
+        """Operations run in the threads of the host, and fail fast when the host is offline or has too many pending operations."""
+        client_pool = pool.DockerClientPool()
+        assert client_pool.call(host_config, lambda engine: engine.docker_config.name) == 'test'
+        monkeypatch.setattr(pool, 'MAX_PENDING_OPERATIONS', 1)
+        release = threading.Event()
+        future = client_pool.submit(host_config, lambda engine: release.wait(5))
+        with pytest.raises(ZoeException):
+            client_pool.submit(host_config, lambda engine: None)
+        release.set()
+        assert future.result()
+        client_pool.set_offline(host_config, 'synchronization failed')
+        with pytest.raises(ZoeException):
+            client_pool.submit(host_config, lambda engine: None)
+        client_pool.close()
+
+    def test_executor(self, host_config, monkeypatch):
+        """The executor of a host is built with the arguments available in Python 3.4, and its threads are named after the host."""
+        monkeypatch.setattr(pool, 'ThreadPoolExecutor', MockExecutor)
+        client_pool = pool.DockerClientPool()
+        assert client_pool.call(host_config, lambda engine: threading.current_thread().name) == 'docker_test'
+        assert isinstance(client_pool._host(host_config).executor, MockExecutor)  # pylint: disable=protected-access
+        client_pool.close()
+
+    def test_submit_closed(self, host_config):
+        """An operation refused by an executor that has been shut down is not counted as pending."""
+        client_pool = pool.DockerClientPool()
+        client_pool.call(host_config, lambda engine: None)
+        executor = client_pool._host(host_config).executor  # pylint: disable=protected-access
+        executor.shutdown()
+        with pytest.raises(ZoeException):
+            client_pool.submit(host_config, lambda engine: None)
+        assert client_pool.health()['test']['pending'] == 0
+        client_pool.close()
+
+    def test_call_timeout(self, host_config):
+        """The result of an operation that completes after the timeout is cleaned up."""
+        client_pool = pool.DockerClientPool()
+        release = threading.Event()
+        cleaned = []
+        cleaned_event = threading.Event()
+
+        def _cleanup(engine, result):
+            cleaned.append((engine.docker_config.name, result))
+            cleaned_event.set()
+
+        with pytest.raises(ZoeException):
+            client_pool.call(host_config, lambda engine: release.wait(5) and 'late', timeout=0.01, cleanup=_cleanup)
+        release.set()
+        assert cleaned_event.wait(5)
+        assert cleaned == [('test', 'late')]
+        client_pool.close()
+
+    def test_log_stream(self, host_config, monkeypatch):
+        """Logs are streamed with a dedicated client, which is closed if the stream cannot be opened."""
+        monkeypatch.setattr(pool, 'host_configs', lambda: {'test': host_config})
+        monkeypatch.setattr(pool, '_pool', pool.DockerClientPool())
+        assert pool.container_log_stream(Namespace(backend_host='other', backend_id='abc')) is None
+        assert list(pool.container_log_stream(Namespace(backend_host='test', backend_id='abc'), tail=10)) == [b'line\n']
+        assert MockClient.created[0].log_args == ('abc', None, 10, False)
+        with pytest.raises(ZoeException):
+            pool.container_log_stream(Namespace(backend_host='test', backend_id='gone'))
+        assert MockClient.created[1].closed
+        assert MockClient.created[1].version == '1.30'
@@ -0,0 +1,162 @@
+# Copyright (c) 2017, Daniele Venzano
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for the reservation accounting shared by the Docker back-ends."""
+
+from argparse import Namespace
+
+import pytest
+
+from zoe_lib.config import load_configuration
+from zoe_lib.state import Service
+from zoe_lib.tests.config_mock import zoe_configuration  # pylint: disable=unused-import
+from zoe_master.backends.docker.config import DockerHostConfig
+from zoe_master.backends.docker.threads import DockerHostsState
+
+INFO = {'NCPU': 8, 'MemTotal': 16 * 1024 ** 3, 'Labels': None}
+LIMITS = {'memory_hard_limit': 1024 ** 3, 'cpu_quota': 200000, 'cpu_period': 100000}
+
+
+class MockService:
+    """A service reserving one core and 512MB."""
+    TERMINATING_STATUS = Service.TERMINATING_STATUS
+
+    def __init__(self, service_id, backend_id, backend_status):
+        self.id = service_id
+        self.name = 'service{}'.format(service_id)
+        self.status = Service.ACTIVE_STATUS
+        self.backend_id = backend_id
+        self.backend_status = backend_status
+        self.resource_reservation = Namespace(cores=Namespace(min=1), memory=Namespace(min=512 * 1024 ** 2))
+
+    def set_backend_status(self, status):
+        """Record the new status."""
+        self.backend_status = status
+
+
+class MockServiceTable:
+    """The services of the test deployment."""
+    def __init__(self, services):
+        self.services = services
+        self.status_changes = {}
+
+    def select(self, only_one=False, **kwargs):
+        """Select by ID or by container ID."""
+        if only_one:
+            return next((service for service in self.services if service.id == kwargs['id']), None)
+        return [service for service in self.services if service.backend_id in kwargs['backend_id']]
+
+    def update_backend_status(self, statuses):
+        """Record the status changes."""
+        self.status_changes.update(statuses)
+
+
+def _container(cont_id, state, deployment='integration_test'):
+    return {'id': cont_id, 'name': cont_id, 'status': 'running' if state == 'started' else 'exited', 'state': state, 'labels': {'zoe_deployment_name': deployment}}
+
+
+def _event(cont_id, service_id, action):
+    return {'Type': 'container', 'Action': action, 'id': cont_id, 'Actor': {'ID': cont_id, 'Attributes': {'zoe_deployment_name': 'integration_test', 'zoe_service_id': str(service_id)}}}
+
+
+class TestDockerHostsState:
+    """Reconciliation of listings and events with the services and the node statistics."""
+
+    @pytest.fixture
+    def hosts_state(self, zoe_configuration):  # pylint: disable=redefined-outer-name
+        """The state of one host, with two services."""
+        load_configuration(zoe_configuration)
+        host_config = DockerHostConfig()
+        host_config.name = 'node1'
+        host_config.labels = set()
+        services = MockServiceTable([MockService(1, 'c1', 'started'), MockService(2, 'c2', 'started')])
+        hosts_state = DockerHostsState(Namespace(services=services), [host_config])
+        hosts_state._events_connected['node1'] = True  # pylint: disable=protected-access
+        return hosts_state, host_config, services
+
+    @staticmethod
+    def _sync(hosts_state, host_config, containers, limits, listing_seq=None):
+        """A reconciliation, with the limits read from the engine for the new containers."""
+        container_list, missing = hosts_state._host_containers(host_config, containers, INFO)  # pylint: disable=protected-access
+        hosts_state._store_limits(host_config, missing, [limits.get(cont_id) for cont_id in missing])  # pylint: disable=protected-access
+        return hosts_state._reconcile(host_config, container_list, INFO, listing_seq)  # pylint: disable=protected-access
+
+    def test_reconcile(self, hosts_state):
+        """The reservations of the services found on the host are accounted once, and released when their containers disappear."""
+        hosts_state, host_config, services = hosts_state
+        containers = [_container('c1', 'started'), _container('c2', 'dead'), _container('other', 'started', deployment='other')]
+        to_terminate = self._sync(hosts_state, host_config, containers, {'c1': LIMITS, 'c2': LIMITS})
+        node_stats = hosts_state.host_stats['node1']
+        assert to_terminate == []
+        assert node_stats.container_count == 2
+        assert node_stats.cores_reserved == 2
+        assert node_stats.cores_allocated == 4
+        assert node_stats.memory_allocated == 2 * 1024 ** 3
+        assert services.status_changes == {2: 'dead'}
+
+        self._sync(hosts_state, host_config, containers, {})
+        assert node_stats.cores_reserved == 2
+
+        self._sync(hosts_state, host_config, containers[:1], {})
+        assert node_stats.cores_reserved == 1
+        assert set(node_stats.service_stats) == {1}
+
+    def test_missing_limits(self, hosts_state):
+        """A service whose container limits cannot be read keeps its reservation."""
+        hosts_state, host_config = hosts_state[:2]
+        containers = [_container('c1', 'started'), _container('c2', 'started')]
+        self._sync(hosts_state, host_config, containers, {'c1': LIMITS, 'c2': LIMITS})
+        hosts_state._container_limits['node1'].pop('c2')  # pylint: disable=protected-access
+        self._sync(hosts_state, host_config, containers, {})
+        assert hosts_state.host_stats['node1'].cores_reserved == 2
+        assert hosts_state._reservations['node1'][2] == (1, 512 * 1024 ** 2)  # pylint: disable=protected-access
+
+    def test_orphan(self, hosts_state):
+        """Dead containers without a service are terminated."""
+        hosts_state, host_config = hosts_state[:2]
+        containers = [_container('c1', 'started'), _container('orphan', 'dead')]
+        assert self._sync(hosts_state, host_config, containers, {'c1': LIMITS, 'orphan': LIMITS}) == ['orphan']
+
+    def test_events(self, hosts_state):
+        """Events update the services and the reservations, and are not overwritten by an older listing."""
+        hosts_state, host_config, services = hosts_state
+        containers = [_container('c1', 'started'), _container('c2', 'started')]
+        self._sync(hosts_state, host_config, containers, {'c1': LIMITS, 'c2': LIMITS})
+        node_stats = hosts_state.host_stats['node1']
+
+        listing_seq = hosts_state._listing_seq('node1')  # pylint: disable=protected-access
+        assert hosts_state._event(host_config, _event('c2', 2, 'oom'))  # pylint: disable=protected-access
+        assert services.services[1].backend_status == 'oom-killed'
+        assert hosts_state._event(host_config, _event('c2', 2, 'die'))  # pylint: disable=protected-access
+        assert services.services[1].backend_status == 'oom-killed'
+        assert hosts_state._event(host_config, _event('c2', 2, 'destroy'))  # pylint: disable=protected-access
+        assert node_stats.cores_reserved == 1
+
+        self._sync(hosts_state, host_config, containers, {}, listing_seq)
+        assert 2 not in services.status_changes
+        assert node_stats.cores_reserved == 1
+
+        self._sync(hosts_state, host_config, containers[:1], {}, hosts_state._listing_seq('node1'))  # pylint: disable=protected-access
+        assert hosts_state._service_events['node1'] == {}  # pylint: disable=protected-access
+
+    def test_event_filters(self, hosts_state):
+        """Events of other deployments, of unknown services and of previous containers of a service are ignored."""
+        hosts_state, host_config, services = hosts_state
+        other = _event('c1', 1, 'die')
+        other['Actor']['Attributes']['zoe_deployment_name'] = 'other'
+        for event in (other, _event('c9', 9, 'die'), _event('old', 1, 'die')):
+            assert hosts_state._event(host_config, event)  # pylint: disable=protected-access
+        assert services.services[0].backend_status == 'started'
+        assert hosts_state._listing_seq('node1') == 0  # pylint: disable=protected-access
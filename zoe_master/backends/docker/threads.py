@@ -13,133 +13,391 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-"""Monitor for the Swarm event stream."""
+"""Synchronization of the Zoe state with the Docker Engines, driven by their event streams."""
 
 import logging
 import threading
 import time
+from typing import List, Tuple
 
 from zoe_lib.config import get_conf
 from zoe_lib.state import SQLManager, Service
+from zoe_master.backends.common import normalize_image_name
 from zoe_master.backends.docker.api_client import DockerClient
-from zoe_master.backends.docker.config import DockerConfig, DockerHostConfig  # pylint: disable=unused-import
+from zoe_master.backends.docker.pool import docker_client, get_pool
+from zoe_master.backends.docker.config import DockerHostConfig  # pylint: disable=unused-import
 from zoe_master.exceptions import ZoeException
 from zoe_master.stats import NodeStats
 
 log = logging.getLogger(__name__)
 
-CHECK_INTERVAL = 10
+CHECK_INTERVAL = 10  # seconds between full reconciliations of a host whose event stream is not available
+RECONCILE_INTERVAL = 60  # seconds between full reconciliations while events are received, to repair drift
+EVENT_WINDOW = 5  # the event stream is reopened every EVENT_WINDOW seconds, so that the threads can notice they have to stop
 
+# Container events that change the back-end status of a service
+EVENT_STATUS = {
+    'start': Service.BACKEND_START_STATUS,
+    'die': Service.BACKEND_DIE_STATUS,
+    'oom': Service.BACKEND_OOM_STATUS,
+    'destroy': Service.BACKEND_DESTROY_STATUS
+}
 
-class DockerStateSynchronizer(threading.Thread):
-    """The Docker Checker."""
+# Image events that change the set of images available on a host
+IMAGE_EVENTS = ('pull', 'tag', 'untag', 'delete', 'import', 'load')
 
-    def __init__(self, state: SQLManager) -> None:
-        super().__init__()
+
+class DockerHostsState:
+    """
+    Node statistics, reservations and image indexes of the Docker hosts, kept in sync with the containers found on them.
+
+    This class does not talk to the engines: subclasses feed it with container listings, resource limits, image lists and events.
+    """
+
+    def __init__(self, state: SQLManager, host_configs: List[DockerHostConfig]) -> None:
+        self.state = state
+        self.host_stats = {}
+        self._host_locks = {}
+        self._events_connected = {}
+        self._images_dirty = {}
+        self._images_lock = threading.Lock()
+        self._image_nodes = {}
+        self._container_limits = {}
+        self._reservations = {}
+        self._event_seq = {}  # container events applied to each host, to recognize listings older than an event
+        self._service_events = {}  # per host, the sequence number of the last event applied to each service
+        for docker_host in host_configs:
+            self.host_stats[docker_host.name] = NodeStats(docker_host.name)
+            self._host_locks[docker_host.name] = threading.Lock()
+            self._events_connected[docker_host.name] = False
+            self._images_dirty[docker_host.name] = True
+            self._container_limits[docker_host.name] = {}
+            self._reservations[docker_host.name] = {}
+            self._event_seq[docker_host.name] = 0
+            self._service_events[docker_host.name] = {}
+
+    def _listing_seq(self, host_name: str) -> int:
+        """Taken before listing the containers of a host, the events applied after it are newer than the listing."""
+        return self._event_seq[host_name]
+
+    def _host_containers(self, host_config: DockerHostConfig, all_containers: List[dict], info) -> Tuple[List[dict], List[str]]:
+        """
+        Update the totals of a host from a brief listing of all its containers.
+
+        :return: the containers of this deployment, and the IDs of those whose resource limits have to be read from the engine
+        """
+        node_stats = self.host_stats[host_config.name]
+        if node_stats.status == 'offline':
+            log.info('Node {} is now online'.format(host_config.name))
+            node_stats.status = 'online'
+
+        node_stats.cores_total = info['NCPU']
+        node_stats.memory_total = info['MemTotal']
+        node_stats.labels = host_config.labels
+        if info['Labels'] is not None:
+            node_stats.labels.union(set(info['Labels']))
+
+        deployment_name = get_conf().deployment_name
+        running_count = 0
+        container_list = []
+        for cont in all_containers:
+            if cont['status'] == 'running':
+                running_count += 1
+            if cont['labels'].get('zoe_deployment_name') == deployment_name:
+                container_list.append(cont)
+        node_stats.container_count = running_count
+
+        # Limits need one inspect call per container, they are read only for new containers and after update events
+        limits = self._container_limits[host_config.name]
+        if not self._events_connected[host_config.name]:
+            limits.clear()  # updates would go unnoticed without the event stream
+        for cont_id in set(limits) - {cont['id'] for cont in container_list}:
+            del limits[cont_id]
+        return container_list, [cont['id'] for cont in container_list if cont['id'] not in limits]
+
+    def _store_limits(self, host_config: DockerHostConfig, cont_ids: List[str], cont_limits: List[dict]):
+        """Store the resource limits read from the engine for new containers. Must be called with the host lock held."""
+        for cont_id, limits in zip(cont_ids, cont_limits):
+            if limits is not None:  # None if removed after the listing
+                self._container_limits[host_config.name][cont_id] = limits
+
+    def _reconcile(self, host_config: DockerHostConfig, container_list: List[dict], info, listing_seq=None) -> List[str]:  # pylint: disable=too-many-locals
+        """
+        Bring services and reservations in line with the containers of this deployment found on a host. Must be called with the host lock held.
+
+        :param listing_seq: the value of _listing_seq() before the containers were listed, services that received an event since then are left alone
+        :return: the IDs of the containers that should be terminated
+        """
+        service_events = self._service_events[host_config.name]
+        node_stats = self.host_stats[host_config.name]
+        limits = self._container_limits[host_config.name]
+
+        # One query for all the services on this host, the status changes are then written in one transaction
+        services = self.state.services.select(backend_host=host_config.name, backend_id=[cont['id'] for cont in container_list])
+        services = {service.backend_id: service for service in services}
+
+        memory_allocated = 0
+        cores_allocated = 0
+        status_changes = {}
+        seen_services = set()
+        to_terminate = []
+        for cont in container_list:
+            cont_limits = limits.get(cont['id'])
+            if cont_limits is not None:
+                if cont_limits['memory_hard_limit'] != info['MemTotal']:
+                    memory_allocated += cont_limits['memory_hard_limit']
+                if cont_limits['cpu_period'] != 0:
+                    cores_allocated += cont_limits['cpu_quota'] / cont_limits['cpu_period']
+
+            service = services.get(cont['id'])
+            if service is None:
+                log.warning('Container {} on host {} has no corresponding service'.format(cont['name'], host_config.name))
+                if cont['state'] == Service.BACKEND_DIE_STATUS:
+                    log.warning('Terminating dead and orphan container {}'.format(cont['name']))
+                    to_terminate.append(cont['id'])
+                continue
+            seen_services.add(service.id)  # also without limits, so that a reservation is not released and added again at every reconciliation
+            if listing_seq is not None and service_events.get(service.id, -1) > listing_seq:
+                continue  # the event is newer than the listing, it has already updated the service and its reservation
+            if service.status == service.TERMINATING_STATUS:
+                if service.backend_id is not None:
+                    to_terminate.append(service.backend_id)
+                else:
+                    service.set_inactive()
+
+            if service.backend_status != cont['state']:
+                log.debug('Updated service status, {} from {} to {}'.format(service.name, service.backend_status, cont['state']))
+                status_changes[service.id] = cont['state']
+            if cont_limits is None:
+                continue  # removed after the listing, or the limits will be read at the next reconciliation
+            core_limit = cont_limits['cpu_quota'] / cont_limits['cpu_period'] if cont_limits['cpu_period'] != 0 else info['NCPU']
+            self._reserve(host_config.name, service, core_limit, cont_limits['memory_hard_limit'])
+        self.state.services.update_backend_status(status_changes)
+        for service_id in set(self._reservations[host_config.name]) - seen_services:
+            self._release(host_config.name, service_id)
+        node_stats.memory_allocated = memory_allocated
+        node_stats.cores_allocated = cores_allocated
+        if listing_seq is not None:
+            self._service_events[host_config.name] = {service_id: seq for service_id, seq in service_events.items() if seq > listing_seq}
+        return to_terminate
+
+    def _event(self, host_config: DockerHostConfig, event) -> bool:
+        """Dispatch an event received from a host."""
+        if event.get('Type') == 'image':
+            if event.get('Action', event.get('status')) in IMAGE_EVENTS:
+                self._images_dirty[host_config.name] = True  # the index is refreshed once per event window, pulls generate bursts of events
+            return True
+        if event.get('Action', event.get('status')) == 'update':
+            self._container_limits[host_config.name].pop(event.get('id', event.get('Actor', {}).get('ID')), None)  # read again at the next reconciliation
+            return True
+        return self._container_event(host_config, event)
+
+    def _container_event(self, host_config: DockerHostConfig, event) -> bool:
+        """Apply a container event to the service state and to the node statistics."""
+        new_status = EVENT_STATUS.get(event.get('Action', event.get('status')))
+        if new_status is None:
+            return True
+        attributes = event.get('Actor', {}).get('Attributes', {})
+        if attributes.get('zoe_deployment_name') != get_conf().deployment_name:
+            return True
+        try:
+            service_id = int(attributes['zoe_service_id'])
+        except (KeyError, ValueError):
+            return True
+
+        with self._host_locks[host_config.name]:
+            service = self.state.services.select(only_one=True, id=service_id)
+            if service is None or service.backend_id != event.get('id', event.get('Actor', {}).get('ID')):
+                return True  # unknown or previous container of this service, the reconciliation will deal with it
+            if new_status == Service.BACKEND_DIE_STATUS and service.backend_status == Service.BACKEND_OOM_STATUS:
+                return True  # docker sends a die event after the oom one
+            self._update_service_status(service, {'state': new_status})
+            self._event_seq[host_config.name] += 1
+            self._service_events[host_config.name][service.id] = self._event_seq[host_config.name]
+
+            if new_status == Service.BACKEND_START_STATUS and service.id not in self._reservations[host_config.name]:
+                self._reserve(host_config.name, service, service.resource_reservation.cores.min, service.resource_reservation.memory.min)
+            elif new_status == Service.BACKEND_DESTROY_STATUS:
+                self._release(host_config.name, service.id)
+        return True
+
+    def _reserve(self, host_name: str, service: Service, core_limit, mem_limit):
+        """Account for the reservation of a service on a host, only the first time it is seen. Must be called with the host lock held."""
+        node_stats = self.host_stats[host_name]
+        if service.id not in self._reservations[host_name]:
+            reservation = service.resource_reservation  # parsing the description is not free, it is done once per service
+            self._reservations[host_name][service.id] = (reservation.cores.min, reservation.memory.min)
+            node_stats.cores_reserved += reservation.cores.min
+            node_stats.memory_reserved += reservation.memory.min
+        node_stats.service_stats[service.id] = {
+            'core_limit': core_limit,
+            'mem_limit': mem_limit
+        }
+
+    def _release(self, host_name: str, service_id: int):
+        """Remove the reservation of a service from the totals of a host. Must be called with the host lock held."""
+        node_stats = self.host_stats[host_name]
+        reservation = self._reservations[host_name].pop(service_id, None)
+        if reservation is not None:
+            node_stats.cores_reserved -= reservation[0]
+            node_stats.memory_reserved -= reservation[1]
+        node_stats.service_stats.pop(service_id, None)
+
+    def _set_images(self, host_config: DockerHostConfig, images: List[dict]):
+        """Update the image index of a host, and the cluster-wide index if the images have changed."""
+        with self._images_lock:
+            index = self.host_stats[host_config.name].images
+            if not index.update(images):
+                return
+            for nodes in self._image_nodes.values():
+                nodes.discard(host_config.name)
+            for name in index.digests:
+                self._image_nodes.setdefault(name, set()).add(host_config.name)
+            self._image_nodes = {name: nodes for name, nodes in self._image_nodes.items() if len(nodes) > 0}
+        log.debug('Image index of host {} updated, {} images'.format(host_config.name, len(images)))
+
+    def image_nodes(self, image_name) -> set:
+        """Return the names of the online nodes where an image is available."""
+        with self._images_lock:
+            nodes = self._image_nodes.get(normalize_image_name(image_name), set())
+            return {node for node in nodes if self.host_stats[node].status == 'online'}
+
+    def _update_service_status(self, service: Service, container):
+        """Update the service status."""
+        if service.backend_status != container['state']:
+            old_status = service.backend_status
+            service.set_backend_status(container['state'])
+            log.debug('Updated service status, {} from {} to {}'.format(service.name, old_status, container['state']))
+
+
+class DockerStateSynchronizer(DockerHostsState, threading.Thread):
+    """
+    The Docker Checker.
+
+    For each host one thread follows the event stream, updating services and node statistics as containers start and die, and another thread
+    runs a full reconciliation every RECONCILE_INTERVAL seconds, or every CHECK_INTERVAL seconds while the event stream is down.
+
+    The image index of a host is refreshed only after image events or pulls, and feeds a cluster-wide index of the nodes holding each image.
+    """
+
+    def __init__(self, state: SQLManager, host_configs: List[DockerHostConfig]) -> None:
+        DockerHostsState.__init__(self, state, host_configs)
+        threading.Thread.__init__(self)
         self.setName('checker')
         self.stop = threading.Event()
         self.my_stop = threading.Event()
-        self.state = state
         self.setDaemon(True)
         self.host_checkers = []
-        self.host_stats = {}
-        for docker_host in DockerConfig(get_conf().backend_docker_config_file).read_config():
-            th = threading.Thread(target=self._host_subthread, args=(docker_host,), name='synchro_' + docker_host.name, daemon=True)
-            th.start()
-            self.host_checkers.append((th, docker_host))
+        self._wakeup = {}
+        for docker_host in host_configs:
+            self._wakeup[docker_host.name] = threading.Event()
+            for target, prefix in ((self._host_subthread, 'synchro_'), (self._event_subthread, 'events_')):
+                th = threading.Thread(target=target, args=(docker_host,), name=prefix + docker_host.name, daemon=True)
+                th.start()
+                self.host_checkers.append((th, docker_host, target))
 
         self.start()
 
-    def _host_subthread(self, host_config: DockerHostConfig):  # pylint: disable=too-many-locals
+    def _host_subthread(self, host_config: DockerHostConfig):
         log.info("Synchro thread for host {} started".format(host_config.name))
 
-        self.host_stats[host_config.name] = NodeStats(host_config.name)
-
         while True:
             time_start = time.time()
+            self._wakeup[host_config.name].clear()
             try:
-                my_engine = DockerClient(host_config)
-                container_list = my_engine.list(only_label='zoe_deployment_name={}'.format(get_conf().deployment_name))
-                running_container_list = my_engine.list(status='running')
-                info = my_engine.info()
+                with docker_client(host_config) as my_engine:
+                    self._update_host(host_config, my_engine, time_start)
             except ZoeException as e:
                 self.host_stats[host_config.name].status = 'offline'
+                get_pool().set_offline(host_config, str(e))  # the operations for this host fail fast until it answers again
                 log.error(str(e))
                 log.info('Node {} is offline'.format(host_config.name))
-            else:
-                if self.host_stats[host_config.name].status == 'offline':
-                    log.info('Node {} is now online'.format(host_config.name))
-                    self.host_stats[host_config.name].status = 'online'
-
-                self.host_stats[host_config.name].container_count = len(running_container_list)
-                self.host_stats[host_config.name].cores_total = info['NCPU']
-                self.host_stats[host_config.name].memory_total = info['MemTotal']
-                self.host_stats[host_config.name].labels = host_config.labels
-                if info['Labels'] is not None:
-                    self.host_stats[host_config.name].labels.union(set(info['Labels']))
-
-                self.host_stats[host_config.name].memory_allocated = sum([cont['memory_hard_limit'] for cont in container_list if cont['memory_hard_limit'] != info['MemTotal']])
-                self.host_stats[host_config.name].cores_allocated = sum([cont['cpu_quota'] / cont['cpu_period'] for cont in container_list if cont['cpu_period'] != 0])
-
-                stats = {}
-                tmp_memory_reserved = 0
-                tmp_cores_reserved = 0
-                for cont in container_list:
-                    service = self.state.services.select(only_one=True, backend_host=host_config.name, backend_id=cont['id'])
-                    if service is None:
-                        log.warning('Container {} on host {} has no corresponding service'.format(cont['name'], host_config.name))
-                        if cont['state'] == Service.BACKEND_DIE_STATUS:
-                            log.warning('Terminating dead and orphan container {}'.format(cont['name']))
-                            my_engine.terminate_container(cont['id'], delete=True)
-                        continue
-                    if service.status == service.TERMINATING_STATUS:
-                        if service.backend_id is not None:
-                            my_engine.terminate_container(service.backend_id, delete=True)
-                        else:
-                            service.set_inactive()
-
-                    self._update_service_status(service, cont)
-                    tmp_memory_reserved += service.resource_reservation.memory.min
-                    tmp_cores_reserved += service.resource_reservation.cores.min
-                    stats[service.id] = {
-                        'core_limit': cont['cpu_quota'] / cont['cpu_period'],
-                        'mem_limit': cont['memory_hard_limit']
-                    }
-                self.host_stats[host_config.name].memory_reserved = tmp_memory_reserved
-                self.host_stats[host_config.name].cores_reserved = tmp_cores_reserved
-                self.host_stats[host_config.name].service_stats = stats
-
-                tmp_images = []
-                for dk_image in my_engine.list_images():
-                    image = {
-                        'id': dk_image.attrs['Id'],
-                        'size': dk_image.attrs['Size'],
-                        'names': dk_image.tags
-                    }
-                    for name in image['names']:
-                        if name[-7:] == ':latest':  # add an image with the name without 'latest' to fake Docker image lookup algorithm
-                            image['names'].append(name[:-7])
-                            break
-                    tmp_images.append(image)
-                self.host_stats[host_config.name].images = tmp_images
-                self.host_stats[host_config.name].timestamp = time_start
-                self.host_stats[host_config.name].valid = True
-
-            sleep_time = CHECK_INTERVAL - (time.time() - time_start)
+
+            interval = RECONCILE_INTERVAL if self._events_connected[host_config.name] else CHECK_INTERVAL
+            sleep_time = interval - (time.time() - time_start)
             if sleep_time <= 0:
                 log.warning('synchro thread for host {} is late by {:.2f} seconds'.format(host_config.name, sleep_time * -1))
                 sleep_time = 0
-            if self.stop.wait(timeout=sleep_time):
+            self._wakeup[host_config.name].wait(timeout=sleep_time)
+            if self.stop.is_set():
                 break
 
         log.info("Synchro thread for host {} stopped".format(host_config.name))
 
-    def _update_service_status(self, service: Service, container):
-        """Update the service status."""
-        if service.backend_status != container['state']:
-            old_status = service.backend_status
-            service.set_backend_status(container['state'])
-            log.debug('Updated service status, {} from {} to {}'.format(service.name, old_status, container['state']))
+    def _event_subthread(self, host_config: DockerHostConfig):
+        log.info("Event thread for host {} started".format(host_config.name))
+        filters = {'type': ['container', 'image']}
+        since = int(time.time())
+        my_engine = None
+        while not self.stop.is_set():
+            until = int(time.time()) + EVENT_WINDOW
+            try:
+                if my_engine is None:
+                    my_engine = get_pool().dedicated_client(host_config)
+                my_engine.event_listener(lambda event: self._event(host_config, event), filters=filters, since=since, until=until)
+            except ZoeException as e:
+                if self._events_connected[host_config.name]:
+                    log.warning(str(e))
+                    self._events_connected[host_config.name] = False
+                if my_engine is not None:
+                    my_engine.close()
+                    my_engine = None
+                self.stop.wait(timeout=CHECK_INTERVAL)
+                continue  # since is not moved forward, the missed events are replayed when the stream is back
+            if not self._events_connected[host_config.name]:
+                log.info('Receiving events from host {}'.format(host_config.name))
+                self._events_connected[host_config.name] = True
+                self._wakeup[host_config.name].set()  # catch up with what happened while the stream was down
+            since = until  # events at the boundary second are received twice, their processing is idempotent
+            if self._images_dirty[host_config.name]:
+                try:
+                    self.refresh_images(host_config)
+                except ZoeException as e:
+                    log.warning(str(e))
+            # An engine whose clock is ahead answers at once, since the window has already passed for it
+            self.stop.wait(timeout=max(until - time.time(), 0))
+
+        if my_engine is not None:
+            my_engine.close()
+        log.info("Event thread for host {} stopped".format(host_config.name))
+
+    def _update_host(self, host_config: DockerHostConfig, my_engine: DockerClient, time_start: float):
+        """Refresh the statistics of a host and the status of the services running on it, the host lock is held only while the state is updated."""
+        listing_seq = self._listing_seq(host_config.name)
+        all_containers = my_engine.list_brief()
+        info = my_engine.info()
+
+        with self._host_locks[host_config.name]:
+            container_list, missing_limits = self._host_containers(host_config, all_containers, info)
+        limits = [my_engine.resource_limits(cont_id) for cont_id in missing_limits]
+        with self._host_locks[host_config.name]:
+            self._store_limits(host_config, missing_limits, limits)
+            to_terminate = self._reconcile(host_config, container_list, info, listing_seq)
+        for cont_id in to_terminate:
+            my_engine.terminate_container(cont_id, delete=True)
+
+        if self._images_dirty[host_config.name] or not self._events_connected[host_config.name]:
+            self._update_images(host_config, my_engine)
+        self.host_stats[host_config.name].timestamp = time_start
+        self.host_stats[host_config.name].valid = True
+
+    def _update_images(self, host_config: DockerHostConfig, my_engine: DockerClient):
+        """Rebuild the image index of a host."""
+        self._images_dirty[host_config.name] = False  # an event received during the listing marks the index dirty again
+        images = []
+        for dk_image in my_engine.list_images():
+            images.append({
+                'id': dk_image.attrs['Id'],
+                'size': dk_image.attrs['Size'],
+                'names': dk_image.tags,
+                'digests': dk_image.attrs.get('RepoDigests') or []
+            })
+        self._set_images(host_config, images)
+
+    def refresh_images(self, host_config: DockerHostConfig):
+        """Refresh the image index of a host, for example after pulling an image."""
+        with docker_client(host_config) as my_engine:
+            self._update_images(host_config, my_engine)
 
     def run(self):
         """The thread loop."""
@@ -150,13 +408,13 @@ class DockerStateSynchronizer(threading.Thread):
                 break
             to_remove = []
             to_add = []
-            for th, conf in self.host_checkers:
+            for th, conf, target in self.host_checkers:
                 if not th.is_alive():
                     log.warning('Thread {} has died, starting a new one.'.format(th.name))
-                    to_remove.append((th, conf))
-                    th = threading.Thread(target=self._host_subthread, args=(conf,), name='synchro_' + conf.name, daemon=True)
+                    to_remove.append((th, conf, target))
+                    th = threading.Thread(target=target, args=(conf,), name=th.name, daemon=True)
                     th.start()
-                    to_add.append((th, conf))
+                    to_add.append((th, conf, target))
             for dead_th in to_remove:
                 self.host_checkers.remove(dead_th)
             for new_th in to_add:
@@ -166,7 +424,9 @@ class DockerStateSynchronizer(threading.Thread):
     def quit(self):
         """Stops the thread."""
         self.stop.set()
-        for th, conf_ in self.host_checkers:
+        for wakeup in self._wakeup.values():
+            wakeup.set()
+        for th, conf_, target_ in self.host_checkers:
             th.join()
         self.my_stop.set()
         self.join()
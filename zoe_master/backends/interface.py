@@ -15,7 +15,9 @@
 
 """The high-level interface that Zoe uses to talk to the configured container backend."""
 
+import itertools
 import logging
+import threading
 import time
 from typing import List, Union
 
@@ -23,55 +25,74 @@ from zoe_lib.config import get_conf
 from zoe_lib.state import Execution, Service  # pylint: disable=unused-import
 
 from zoe_master.backends.base import BaseBackend
+from zoe_master.backends.registry import BackendRegistry
 from zoe_master.backends.service_instance import ServiceInstance
-from zoe_master.exceptions import ZoeStartExecutionFatalException, ZoeStartExecutionRetryException, ZoeException
+from zoe_master.exceptions import ZoeStartExecutionFatalException, ZoeStartExecutionRetryException
 from zoe_master.stats import ClusterStats  # pylint: disable=unused-import
 
-try:
-    from zoe_master.backends.kubernetes.backend import KubernetesBackend
-except ImportError:
-    KubernetesBackend = None
+log = logging.getLogger(__name__)
 
-try:
-    from zoe_master.backends.docker.backend import DockerEngineBackend
-except ImportError:
-    DockerEngineBackend = None
+_registry = None  # type: BackendRegistry
+_registry_lock = threading.Lock()
 
-log = logging.getLogger(__name__)
 
+def _get_registry() -> BackendRegistry:
+    """Return the registry of the configured back-ends, the back-end objects are created only once."""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = BackendRegistry(get_conf())
+        return _registry
 
-def _get_backend() -> Union[BaseBackend, None]:
-    """Return the right backend instance by reading the global configuration."""
-    backend_name = get_conf().backend
-    assert backend_name in ['Kubernetes', 'Swarm', 'DockerEngine']
-    if backend_name == 'Kubernetes':
-        if KubernetesBackend is None:
-            raise ZoeException('The Kubernetes backend requires the pykube module')
-        return KubernetesBackend(get_conf())
-    elif backend_name == 'DockerEngine':
-        if DockerEngineBackend is None:
-            raise ZoeException('The Docker Engine backend requires docker python version >= 2.0.2')
-        return DockerEngineBackend(get_conf())
-    else:
-        log.error('Unknown backend selected')
-        return None
+
+def _get_backend(node_name=None) -> BaseBackend:
+    """Return the back-end that owns a node, or the first configured back-end."""
+    return _get_registry().get(node_name)
+
+
+def backend_names() -> List[str]:
+    """The names of the configured back-ends."""
+    return list(_get_registry().classes)
 
 
 def initialize_backend(state):
-    """Initializes the configured backend."""
-    backend = _get_backend()
-    backend.init(state)
+    """Initializes the configured backends."""
+    _get_registry().init(state)
 
 
 def shutdown_backend():
-    """Shuts down the configured backend."""
-    backend = _get_backend()
-    backend.shutdown()
+    """Shuts down the configured backends."""
+    _get_registry().shutdown()
+
+
+def _spawn_failed(execution: Execution, services: List[Service], ex: Exception) -> str:
+    """Clean up after a failed service start, return one of 'requeue' for temporary failures and 'fatal' for fatal failures."""
+    service_ids = ', '.join(str(service.id) for service in services)
+    if isinstance(ex, ZoeStartExecutionRetryException):
+        log.warning('Temporary failure starting service {} of execution {}: {}'.format(service_ids, execution.id, ex.message))
+        for service in services:
+            service.set_error(ex.message)
+        terminate_execution(execution, reason=ex.message)
+        execution.set_queued()
+        return "requeue"
+    elif isinstance(ex, ZoeStartExecutionFatalException):
+        log.error('Fatal error trying to start service {} of execution {}: {}'.format(service_ids, execution.id, ex.message))
+        for service in services:
+            service.set_error(ex.message)
+        terminate_execution(execution, reason=ex.message)
+        execution.set_error()
+        return "fatal"
+    else:
+        log.error('Fatal error trying to start service {} of execution {}'.format(service_ids, execution.id))
+        log.error('BUG, this error should have been caught earlier', exc_info=ex)
+        terminate_execution(execution, reason=str(ex))
+        execution.set_error()
+        return "fatal"
 
 
 def service_list_to_containers(execution: Execution, service_list: List[Service], placement=None) -> str:
     """Given a subset of services from an execution, tries to start them, return one of 'ok', 'requeue' for temporary failures and 'fatal' for fatal failures."""
-    backend = _get_backend()
+    registry = _get_registry()
 
     ordered_service_list = sorted(service_list, key=lambda x: x.startup_order)
 
@@ -85,34 +106,48 @@ def service_list_to_containers(execution: Execution, service_list: List[Service]
     for service in execution.services:
         env_subst_dict['dns_name#' + service.name] = service.dns_name
 
-    for service in ordered_service_list:
-        env_subst_dict['dns_name#self'] = service.dns_name
-        if placement is not None:
-            service.assign_backend_host(placement[service.id])
-        service.set_starting()
-        instance = ServiceInstance(execution, service, env_subst_dict)
+    for _, startup_group in itertools.groupby(ordered_service_list, key=lambda x: x.startup_order):
+        startup_group = list(startup_group)
+        for service in startup_group:
+            if placement is not None:
+                service.assign_backend_host(placement[service.id])
+        ret = _spawn_group(execution, registry.group(startup_group, lambda x: x.backend_host), env_subst_dict)
+        if ret != "ok":
+            return ret
+
+    return "ok"
+
+
+def _spawn_group(execution: Execution, backend_groups, env_subst_dict) -> str:
+    """Start services with the same startup order, split by the back-end that owns their nodes."""
+    for backend, group in backend_groups:
+        instances = []
+        for service in group:
+            env_subst_dict['dns_name#self'] = service.dns_name
+            service.set_starting()
+            instances.append(ServiceInstance(execution, service, env_subst_dict))
+
+        time_start = time.time()
         try:
-            backend_id, ip_address, ports = backend.spawn_service(instance)
-        except ZoeStartExecutionRetryException as ex:
-            log.warning('Temporary failure starting service {} of execution {}: {}'.format(service.id, execution.id, ex.message))
-            service.set_error(ex.message)
-            terminate_execution(execution, reason=ex.message)
-            execution.set_queued()
-            return "requeue"
-        except ZoeStartExecutionFatalException as ex:
-            log.error('Fatal error trying to start service {} of execution {}: {}'.format(service.id, execution.id, ex.message))
-            service.set_error(ex.message)
-            terminate_execution(execution, reason=ex.message)
-            execution.set_error()
-            return "fatal"
-        except Exception as ex:
-            log.error('Fatal error trying to start service {} of execution {}'.format(service.id, execution.id))
-            log.exception('BUG, this error should have been caught earlier')
-            terminate_execution(execution, reason=str(ex))
-            execution.set_error()
-            return "fatal"
-        else:
-            log.debug('Service {} started'.format(instance.name))
+            results = backend.spawn_services(instances)
+        except NotImplementedError:
+            results = None
+        except Exception as ex:  # pylint: disable=broad-except
+            return _spawn_failed(execution, group, ex)
+
+        if results is not None:
+            log.debug('{} services of execution {} started in {:.3f}s'.format(len(group), execution.id, time.time() - time_start))
+            for service, (backend_id, ip_address, ports) in zip(group, results):
+                service.set_active(backend_id, ip_address, ports)
+            continue
+
+        for service, instance in zip(group, instances):
+            time_start = time.time()
+            try:
+                backend_id, ip_address, ports = backend.spawn_service(instance)
+            except Exception as ex:  # pylint: disable=broad-except
+                return _spawn_failed(execution, [service], ex)
+            log.debug('Service {} started on host {} in {:.3f}s'.format(instance.name, service.backend_host, time.time() - time_start))
             service.set_active(backend_id, ip_address, ports)
 
     return "ok"
@@ -144,7 +179,7 @@ def start_elastic(execution: Execution, placement) -> str:
 
 def terminate_service(service: Service) -> None:
     """Terminate a single service."""
-    backend = _get_backend()
+    backend = _get_backend(service.backend_host)
     if service.status != Service.INACTIVE_STATUS:
         if service.status == Service.ERROR_STATUS:
             backend.terminate_service(service)
@@ -174,37 +209,80 @@ def terminate_execution(execution: Execution, reason: Union[None, str] = None) -
 
 
 def get_platform_state() -> ClusterStats:
-    """Retrieves the state of the platform by querying the container backend. Platform state includes information on free/reserved resources for each node."""
-    backend = _get_backend()
-    return backend.platform_state()
+    """Retrieves the state of the platform by querying the container backends. Platform state includes information on free/reserved resources for each node."""
+    return _get_registry().platform_state()
 
 
 def preload_image(image_name):
     """Make a service image available on the cluster, according to the backend support."""
-    backend = _get_backend()
-    log.debug('Preloading image {}'.format(image_name))
-    time_start = time.time()
-    try:
-        backend.preload_image(image_name)
-        log.info('Image {} preloaded in {:.2f}s'.format(image_name, time.time() - time_start))
-    except NotImplementedError:
-        log.warning('Backend {} does not support image preloading'.format(get_conf().backend))
+    for name, backend in _get_registry().backends.items():
+        log.debug('Preloading image {} in back-end {}'.format(image_name, name))
+        time_start = time.time()
+        try:
+            backend.preload_image(image_name)
+            log.info('Image {} preloaded in {:.2f}s'.format(image_name, time.time() - time_start))
+        except NotImplementedError:
+            log.warning('Backend {} does not support image preloading'.format(name))
+
+
+def prefetch_images(images):
+    """Start making images available on the given nodes, without waiting. The images dictionary maps image names to node names."""
+    registry = _get_registry()
+    backend_images = {}
+    for image_name, nodes in images.items():
+        for node_name in nodes:
+            backend_images.setdefault(registry.backend_name(node_name), {}).setdefault(image_name, set()).add(node_name)
+    for name, name_images in backend_images.items():
+        try:
+            registry.backends[name].prefetch_images(name_images)
+        except NotImplementedError:
+            log.warning('Backend {} does not support image prefetching'.format(name))
+
+
+def image_pulls():
+    """The image pulls in progress."""
+    pulls = []
+    for backend in _get_registry().backends.values():
+        try:
+            pulls += backend.image_pulls()
+        except NotImplementedError:
+            pass
+    return pulls
+
+
+def service_log_stream(service: Service, since=None, tail='all', follow=False):
+    """Stream the log of a service from the back-end that runs it, returns None if no back-end can provide it. Only the back-end classes are used, the back-ends do not need to be initialized."""
+    for backend_class in _get_registry().classes.values():
+        try:
+            stream = backend_class.service_log_stream(service, since, tail, follow)
+        except NotImplementedError:
+            continue
+        if stream is not None:
+            return stream
+    return None
 
 
 def update_service_resource_limits(service, cores=None, memory=None):
     """Update a service reservation."""
-    backend = _get_backend()
+    backend = _get_backend(service.backend_host)
     if 'gpu' not in service.labels:  # see https://github.com/NVIDIA/nvidia-docker/issues/515
         backend.update_service(service, cores, memory)
 
 
 def node_list():
-    """List node names configured in the back-end."""
-    backend = _get_backend()
-    return backend.node_list()
+    """List node names configured in the back-ends."""
+    return _get_registry().node_list()
 
 
 def list_available_images(node_name):
     """List the images available on the specified node."""
-    backend = _get_backend()
+    backend = _get_backend(node_name)
     return backend.list_available_images(node_name)
+
+
+def image_nodes(image_name):
+    """Return the names of the nodes where an image is available."""
+    nodes = set()
+    for backend in _get_registry().backends.values():
+        nodes |= set(backend.image_nodes(image_name))
+    return nodes
@@ -15,20 +15,22 @@
 
 """Interface to the low-level Kubernetes API."""
 import logging
+import json
+import time
 from argparse import Namespace
-import socket
+from concurrent.futures import ThreadPoolExecutor, wait
 from typing import Dict, Any, List
 
 import re
 
-import humanfriendly
 import pykube
 
 from zoe_master.stats import ClusterStats, NodeStats
 from zoe_master.backends.service_instance import ServiceInstance
 from zoe_lib.version import ZOE_VERSION
-from zoe_lib.state import VolumeDescription, VolumeDescriptionHostPath
+from zoe_lib.state import Service, VolumeDescription, VolumeDescriptionHostPath
 from zoe_lib.config import get_conf
+from zoe_master.exceptions import ZoeException, ZoeNotEnoughResourcesException
 
 log = logging.getLogger(__name__)
 
@@ -38,6 +40,11 @@ ZOE_LABELS = {
     "auto-ingress/enabled": "enabled",
 }
 
+SPAWN_WORKERS = 8  # concurrent requests to the API server when creating the objects of a group of services
+APPLY_PARAMS = {'fieldManager': 'zoe', 'force': 'true'}
+# Core/v1 ReplicationControllers orphan their pods when deleted with the default policy, the garbage collector must delete them too
+DELETE_OPTIONS = {'kind': 'DeleteOptions', 'apiVersion': 'v1', 'propagationPolicy': 'Background'}
+
 
 class KubernetesServiceConf:
     """ Wrapper for Kubernetes Service configuration """
@@ -155,9 +162,9 @@ class KubernetesReplicationControllerConf:
         aux['spec']['containers'][0]['env'] = [{} for _ in range(len(env))]
         count = 0
 
-        for k in env:
-            aux['spec']['containers'][0]['env'][count]['name'] = k[0]
-            aux['spec']['containers'][0]['env'][count]['value'] = k[1]
+        for name, value in env.items():
+            aux['spec']['containers'][0]['env'][count]['name'] = name
+            aux['spec']['containers'][0]['env'][count]['value'] = value
             count += 1
 
     def set_spec_container_ports(self, ports):
@@ -170,18 +177,30 @@ class KubernetesReplicationControllerConf:
             aux['spec']['containers'][0]['ports'][count]['containerPort'] = prt.number
             count += 1
 
-    def set_spec_container_mem_limit(self, memlimit):
-        """Setter to set container mem limit"""
-        memset = str(memlimit / (1024*1024)) + "Mi"
+    def _container_resources(self):
         aux = self.conf['spec']['template']  # type: Dict
-        aux['spec']['containers'][0]['resources'] = {}
-        aux['spec']['containers'][0]['resources']['limits'] = {}
-        aux['spec']['containers'][0]['resources']['limits']['memory'] = memset
+        resources = aux['spec']['containers'][0].setdefault('resources', {})
+        return resources.setdefault('requests', {}), resources.setdefault('limits', {})
+
+    def set_spec_container_mem_limit(self, memlimit):
+        """Setter to set container mem limit, the memory request is the same as the limit"""
+        requests, limits = self._container_resources()
+        requests['memory'] = limits['memory'] = str(int(memlimit))
 
     def set_spec_container_core_limit(self, corelimit):
-        """Setter to set container corelimit"""
+        """Setter to set container corelimit, the cpu request is the same as the limit"""
+        requests, limits = self._container_resources()
+        requests['cpu'] = limits['cpu'] = str(corelimit)
+
+    def set_spec_node_affinity(self, node_name, required=True):
+        """Setter to restrict or steer the pod to the node chosen by the Zoe scheduler"""
+        term = {'matchFields': [{'key': 'metadata.name', 'operator': 'In', 'values': [node_name]}]}
+        if required:
+            affinity = {'requiredDuringSchedulingIgnoredDuringExecution': {'nodeSelectorTerms': [term]}}
+        else:
+            affinity = {'preferredDuringSchedulingIgnoredDuringExecution': [{'weight': 100, 'preference': term}]}
         aux = self.conf['spec']['template']  # type: Dict
-        aux['spec']['containers'][0]['resources']['limits']['cpu'] = corelimit
+        aux['spec']['affinity'] = {'nodeAffinity': affinity}
 
     def set_spec_container_command(self, command):
         """Setter to set container command"""
@@ -226,52 +245,206 @@ class KubernetesReplicationControllerConf:
         return self.conf
 
 
-class KubernetesClient:
-    """The Kubernetes client class that wraps the Kubernetes API."""
-    def __init__(self, opts: Namespace) -> None:
-        self.api = pykube.HTTPClient(pykube.KubeConfig.from_file(opts.kube_config_file))
-
-    def spawn_replication_controller(self, service_instance: ServiceInstance):
-        """Create and start a new replication controller."""
-        config = KubernetesReplicationControllerConf()
-        config.set_name(service_instance.name)
-
-        config.set_labels(ZOE_LABELS)
-        config.set_labels({'service_name': service_instance.name})
-        config.set_replicas(1)
-
-        config.set_spec_selector(ZOE_LABELS)
-        config.set_spec_selector({'service_name': service_instance.name})
-
-        config.set_temp_meta_labels(ZOE_LABELS)
-        config.set_temp_meta_labels({'service_name': service_instance.name})
+# Suffixes of the Kubernetes resource quantities
+QUANTITY_SUFFIXES = {
+    'm': 10 ** -3, '': 1, 'k': 10 ** 3, 'M': 10 ** 6, 'G': 10 ** 9, 'T': 10 ** 12, 'P': 10 ** 15, 'E': 10 ** 18,
+    'Ki': 2 ** 10, 'Mi': 2 ** 20, 'Gi': 2 ** 30, 'Ti': 2 ** 40, 'Pi': 2 ** 50, 'Ei': 2 ** 60
+}
+QUANTITY_RE = re.compile(r'^([+-]?[0-9.]+(?:[eE][+-]?[0-9]+)?)([a-zA-Z]*)$')
+
+
+def parse_quantity(quantity) -> float:
+    """Parse a Kubernetes resource quantity, ex. '100m' cores or '1Gi' bytes."""
+    match = QUANTITY_RE.match(str(quantity).strip())
+    if match is None or match.group(2) not in QUANTITY_SUFFIXES:
+        raise ValueError('Invalid quantity: {}'.format(quantity))
+    return float(match.group(1)) * QUANTITY_SUFFIXES[match.group(2)]
+
+
+def pod_requests(pod: Dict[str, Any]):
+    """Return the cores and memory requested by a pod, the way the scheduler accounts for them."""
+    def _requests(containers):
+        cores = 0
+        memory = 0
+        for container in containers or []:
+            requests = container.get('resources', {}).get('requests', {})
+            cores += parse_quantity(requests.get('cpu', 0))
+            memory += parse_quantity(requests.get('memory', 0))
+        return cores, memory
+
+    cores, memory = _requests(pod['spec'].get('containers'))
+    for init_container in pod['spec'].get('initContainers') or []:  # init containers run one at a time, before the others
+        init_cores, init_memory = _requests([init_container])
+        cores = max(cores, init_cores)
+        memory = max(memory, init_memory)
+    return round(cores, 3), int(memory)
+
+
+def pod_is_placed(pod: Dict[str, Any]) -> bool:
+    """True for the pods that hold resources on a node: scheduled and not terminated."""
+    return pod['spec'].get('nodeName') is not None and pod.get('status', {}).get('phase') not in ('Succeeded', 'Failed')
+
+
+def pod_node_name(pods: List[Dict[str, Any]]):
+    """The node where the live pod of a replication controller has been bound, None if it is not scheduled yet."""
+    for pod in pods:
+        if pod_is_placed(pod):
+            return pod['spec']['nodeName']
+    return None
+
+
+def pod_summary(pod: Dict[str, Any]) -> Dict[str, Any]:
+    """Keep only the fields of a pod that are needed for placement."""
+    cores, memory = pod_requests(pod)
+    return {
+        'metadata': {key: pod['metadata'][key] for key in ('uid', 'name', 'namespace', 'resourceVersion') if key in pod['metadata']},
+        'node_name': pod['spec']['nodeName'],
+        'cores': cores,
+        'memory': memory
+    }
+
+
+def update_node_stats(nss: NodeStats, node: Dict[str, Any]):
+    """Update the totals, labels, status and images of a node from its Kubernetes object."""
+    allocatable = node.get('status', {}).get('allocatable', {})
+    nss.cores_total = parse_quantity(allocatable.get('cpu', 0))
+    nss.memory_total = int(parse_quantity(allocatable.get('memory', 0)))
+    nss.labels = node['metadata'].get('labels', {})
+    ready = [cond for cond in node.get('status', {}).get('conditions') or [] if cond.get('type') == 'Ready']
+    nss.status = 'online' if len(ready) == 0 or ready[0].get('status') == 'True' else 'offline'
+    images = []
+    for image in node.get('status', {}).get('images') or []:
+        names = image.get('names') or []
+        if len(names) == 0:
+            continue
+        images.append({
+            'id': names[0],
+            'size': image.get('sizeBytes', 0),
+            'names': [name for name in names if '@' not in name],
+            'digests': [name for name in names if '@' in name]
+        })
+    nss.images.update(images)
+
+
+def replication_controller_info(rc_info: Dict[str, Any]) -> Dict[str, Any]:
+    """Translate a replication controller object into a simple dictionary."""
+    no_replicas = rc_info['spec']['replicas']
+    ready_replicas = rc_info.get('status', {}).get('readyReplicas', 0)
+    info = {
+        "backend_id": rc_info['metadata']['uid'],
+        'ip_address': '0.0.0.0',
+        'replicas': no_replicas,
+        'readyReplicas': ready_replicas
+    }
+    if 0 < ready_replicas <= no_replicas:
+        info['state'] = 'running'
+        info['running'] = True
+    else:
+        info['state'] = 'undefined'
+        info['running'] = ready_replicas > 0
+    return info
+
+
+def replication_controller_status(rc_info: Dict[str, Any], pods: List[Dict[str, Any]]) -> str:
+    """Derive the back-end status of a service from its replication controller and the pods it manages."""
+    info = replication_controller_info(rc_info)
+    if info['readyReplicas'] >= info['replicas'] > 0:
+        return Service.BACKEND_START_STATUS
+    for pod in pods:
+        for cont_status in pod.get('status', {}).get('containerStatuses') or []:
+            state = cont_status.get('state', {})
+            terminated = state.get('terminated')
+            if terminated is None and 'waiting' in state:  # restarting after a crash
+                terminated = cont_status.get('lastState', {}).get('terminated')
+            if terminated is not None:
+                return Service.BACKEND_OOM_STATUS if terminated.get('reason') == 'OOMKilled' else Service.BACKEND_DIE_STATUS
+    if info['readyReplicas'] > 0:
+        return Service.BACKEND_CREATE_STATUS
+    return Service.BACKEND_UNDEFINED_STATUS
+
+
+def service_ports(srv_obj: Dict[str, Any]) -> Dict[int, int]:
+    """The port mapping of a Service object."""
+    return {port['port']: port['targetPort'] for port in srv_obj['spec'].get('ports') or []}
+
+
+def replication_controller_conf(service_instance: ServiceInstance) -> Dict[str, Any]:
+    """Build the replication controller object that runs a service."""
+    config = KubernetesReplicationControllerConf()
+    config.set_name(service_instance.name)
+
+    config.set_labels(ZOE_LABELS)
+    config.set_labels({'service_name': service_instance.name})
+    config.set_replicas(1)
+
+    config.set_spec_selector(ZOE_LABELS)
+    config.set_spec_selector({'service_name': service_instance.name})
+
+    config.set_temp_meta_labels(ZOE_LABELS)
+    config.set_temp_meta_labels({'service_name': service_instance.name})
+
+    config.set_spec_container_image(service_instance.image_name)
+    config.set_spec_container_name(service_instance.name)
+
+    if len(service_instance.environment) > 0:
+        envs = {e[0]: str(e[1]) for e in service_instance.environment}
+        config.set_spec_container_env(envs)
+
+    if len(service_instance.ports) > 0:
+        config.set_spec_container_ports(service_instance.ports)
+
+    if service_instance.memory_limit is not None:
+        config.set_spec_container_mem_limit(service_instance.memory_limit.min)
+
+    if service_instance.core_limit is not None:
+        config.set_spec_container_core_limit(service_instance.core_limit.min)
+
+    if len(service_instance.volumes) > 0:
+        config.set_spec_container_volumes(service_instance.volumes, service_instance.name)
+
+    if service_instance.command is not None:
+        config.set_spec_container_command(service_instance.command)
+
+    if service_instance.backend_host is not None and get_conf().kube_placement != 'none':
+        config.set_spec_node_affinity(service_instance.backend_host, required=get_conf().kube_placement == 'required')
+
+    return config.get_json()
+
+
+def service_conf(service_instance: ServiceInstance) -> Dict[str, Any]:
+    """Build the Service object that exposes the ports of a service."""
+    config = KubernetesServiceConf()
 
-        config.set_spec_container_image(service_instance.image_name)
-        config.set_spec_container_name(service_instance.name)
+    config.set_name(service_instance.name)
+    config.set_labels(ZOE_LABELS)
+    config.set_labels({'service_name': service_instance.name})
 
-        if len(service_instance.environment) > 0:
-            envs = {e[0]: str(e[1]) for e in service_instance.environment}
-            config.set_spec_container_env(envs)
+    if len(service_instance.ports) > 0:
+        config.set_ports(service_instance.ports)
 
-        if len(service_instance.ports) > 0:
-            config.set_spec_container_ports(service_instance.ports)
+    # Handling for having a GCP LoadBalancer based exposure instead of the default nodeport/ingress
+    if service_instance.load_balancer:
+        config.set_labels({'auto-ingress/enabled': 'disabled'})
+        config.set_type('LoadBalancer')
 
-        if service_instance.memory_limit is not None:
-            config.set_spec_container_mem_limit(service_instance.memory_limit.min)
+    config.set_selectors(ZOE_LABELS)
+    config.set_selectors({'service_name': service_instance.name})
 
-        if service_instance.core_limit is not None:
-            config.set_spec_container_core_limit(service_instance.core_limit.min)
+    return config.get_json()
 
-        if len(service_instance.volumes) > 0:
-            config.set_spec_container_volumes(service_instance.volumes, service_instance.name)
 
-        if service_instance.command is not None:
-            config.set_spec_container_command(service_instance.command)
+class KubernetesClient:
+    """The Kubernetes client class that wraps the Kubernetes API."""
+    def __init__(self, opts: Namespace) -> None:
+        self.api = pykube.HTTPClient(pykube.KubeConfig.from_file(opts.kube_config_file))
+        self._server_side_apply = True
 
+    def spawn_replication_controller(self, service_instance: ServiceInstance):
+        """Create and start a new replication controller."""
         info = {}
 
         try:
-            pykube.ReplicationController(self.api, config.get_json()).create()
+            pykube.ReplicationController(self.api, replication_controller_conf(service_instance)).create()
             log.info('Created ReplicationController on Kubernetes cluster')
             info = self.inspect_replication_controller(service_instance.name)
         except Exception as ex:
@@ -284,40 +457,13 @@ class KubernetesClient:
         try:
             repcon_list = pykube.ReplicationController.objects(self.api).filter(namespace=get_conf().kube_namespace)
             rep = repcon_list.get_by_name(name)
-            rc_info = rep.obj
-
-            info = {
-                "backend_id": rc_info['metadata']['uid'],
-                'ip_address': '0.0.0.0'
-            }
-
-            no_replicas = rc_info['spec']['replicas']
-
-            if 'readyReplicas' in rc_info['status']:
-                ready_replicas = rc_info['status']['readyReplicas']
-            else:
-                ready_replicas = 0
-
-            info['replicas'] = no_replicas
-            info['readyReplicas'] = ready_replicas
-
-            if ready_replicas <= 0:
-                info['state'] = 'undefined'
-                info['running'] = False
-            if 0 < ready_replicas <= no_replicas:
-                info['state'] = 'running'
-                info['running'] = True
-            else:
-                info['state'] = 'undefined'
-                info['running'] = True
-
         except pykube.exceptions.ObjectDoesNotExist:
             return None
         except Exception as ex:
             log.exception(ex)
             return None
 
-        return info
+        return replication_controller_info(rep.obj)
 
     def replication_controller_list(self):
         """Get list of replication controller."""
@@ -325,32 +471,15 @@ class KubernetesClient:
         rclist = []
         try:
             for rep in repcon_list:
-                rclist.append(self.inspect_replication_controller(rep.name))
+                rclist.append(replication_controller_info(rep.obj))
         except Exception as ex:
             log.exception(ex)
         return rclist
 
     def spawn_service(self, service_instance: ServiceInstance):
         """Create and start a new Service object."""
-        config = KubernetesServiceConf()
-
-        config.set_name(service_instance.name)
-        config.set_labels(ZOE_LABELS)
-        config.set_labels({'service_name': service_instance.name})
-
-        if len(service_instance.ports) > 0:
-            config.set_ports(service_instance.ports)
-
-        """Handling for having a GCP LoadBalancer based exposure instead of the default nodeport/ingress"""
-        if service_instance.load_balancer == True:
-            config.set_labels({'auto-ingress/enabled': 'disabled'})
-            config.set_type('LoadBalancer')
-
-        config.set_selectors(ZOE_LABELS)
-        config.set_selectors({'service_name': service_instance.name})
-
         try:
-            pykube.Service(self.api, config.get_json()).create()
+            pykube.Service(self.api, service_conf(service_instance)).create()
             log.info('created service on Kubernetes cluster')
         except Exception as ex:
             log.exception(ex)
@@ -383,6 +512,67 @@ class KubernetesClient:
 
         return info
 
+    def apply(self, object_class, obj: Dict[str, Any]) -> Dict[str, Any]:
+        """Create or update an object with a server-side apply, returns the object as stored by the API server."""
+        kube_obj = object_class(self.api, obj)
+        if self._server_side_apply:
+            resp = self.api.patch(**kube_obj.api_kwargs(headers={'Content-Type': 'application/apply-patch+yaml'}, data=json.dumps(obj), params=APPLY_PARAMS))
+            if resp.status_code != 415:
+                self.api.raise_for_status(resp)
+                return resp.json()
+            log.info('Server-side apply is not supported by the API server, creating objects instead')
+            self._server_side_apply = False
+        kube_obj.create()
+        return kube_obj.obj
+
+    def delete(self, object_class, name: str) -> None:
+        """Delete an object and the objects it owns, like the pods of a replication controller, objects that do not exist are ignored."""
+        del_obj = {'metadata': {'name': name, 'namespace': get_conf().kube_namespace}}
+        try:
+            resp = self.api.delete(**object_class(self.api, del_obj).api_kwargs(data=json.dumps(DELETE_OPTIONS)))
+            if resp.status_code != 404:
+                self.api.raise_for_status(resp)
+        except Exception as ex:  # pylint: disable=broad-except
+            log.warning('Cannot delete {} {}: {}'.format(object_class.kind, name, ex))
+
+    def spawn_services(self, service_instances: List[ServiceInstance]) -> List[Dict[str, Any]]:
+        """
+        Create the Service and the ReplicationController objects of a group of services with concurrent requests.
+
+        If any request fails, all the objects of the group are deleted before raising the error, returns the back-end ID and the port mapping of each service.
+        """
+        objects = []
+        for service_instance in service_instances:
+            objects.append((pykube.Service, service_conf(service_instance)))
+            objects.append((pykube.ReplicationController, replication_controller_conf(service_instance)))
+
+        time_start = time.time()
+        with ThreadPoolExecutor(max_workers=min(SPAWN_WORKERS, len(objects))) as executor:
+            futures = [executor.submit(self.apply, object_class, obj) for object_class, obj in objects]
+            wait(futures)
+        log.debug('Applied {} objects in {:.3f}s'.format(len(objects), time.time() - time_start))
+
+        errors = [future.exception() for future in futures if future.exception() is not None]
+        if len(errors) > 0:
+            log.error('Failed creating {} of {} objects, rolling back the group'.format(len(errors), len(objects)))
+            for object_class, obj in objects:  # a request that failed on the client side may still have created its object
+                self.delete(object_class, obj['metadata']['name'])
+            for error in errors:
+                if isinstance(error, pykube.exceptions.HTTPError) and error.code == 403 and 'exceeded quota' in str(error):
+                    raise ZoeNotEnoughResourcesException(str(error))
+            raise ZoeException('Cannot create Kubernetes objects: {}'.format(errors[0]))
+
+        results = []
+        for i in range(len(service_instances)):
+            srv_obj = futures[2 * i].result()
+            rc_obj = futures[2 * i + 1].result()
+            results.append({
+                'backend_id': rc_obj['metadata']['uid'],
+                'ip_address': '0.0.0.0',
+                'ports': service_ports(srv_obj)
+            })
+        return results
+
     def terminate(self, name):
         """Terminate a service.
         It will terminate Service, then ReplicationController and Pods have the same labels."""
@@ -402,7 +592,7 @@ class KubernetesClient:
             pykube.ReplicationController(self.api, del_obj).delete()
 
             del_obj['kind'] = 'Pod'
-            pod_selector = ZOE_LABELS
+            pod_selector = dict(ZOE_LABELS)  # the module-level labels must not be modified
             pod_selector['service_name'] = name
             pods = pykube.Pod.objects(self.api).filter(namespace=get_conf().kube_namespace, selector=pod_selector).iterator()
             for pod in pods:
@@ -413,48 +603,24 @@ class KubernetesClient:
         except Exception as ex:
             log.exception(ex)
 
-    def info(self) -> ClusterStats:  # pylint: disable=too-many-locals
-        """Retrieve Kubernetes cluster statistics."""
+    def info(self) -> ClusterStats:
+        """Retrieve Kubernetes cluster statistics with a full listing of nodes and pods."""
         pl_status = ClusterStats()
 
-        node_list = pykube.Node.objects(self.api).filter(namespace=pykube.all).iterator()
         node_dict = {}
-
-        # Get basic information from nodes
-        for node in node_list:
+        for node in pykube.Node.objects(self.api).filter(namespace=pykube.all).iterator():
             nss = NodeStats(node.name)
-            nss.cores_total = float(node.obj['status']['allocatable']['cpu'][1]) ## Bug found on GKE
-            nss.memory_total = humanfriendly.parse_size(node.obj['status']['allocatable']['memory'])
-            nss.labels = node.obj['metadata']['labels']
-            nss.status = 'online'
-            node_dict[str(socket.gethostbyname(node.name))] = nss
-
-        # Get information from all running pods, then accumulate to nodes
-        pod_list = pykube.Pod.objects(self.api).filter(namespace=pykube.all).iterator()
-        for pod in pod_list:
-            try:
-                host_ip = pod.obj['status']['hostIP']
-            except KeyError:
+            update_node_stats(nss, node.obj)
+            node_dict[node.name] = nss
+
+        for pod in pykube.Pod.objects(self.api).filter(namespace=pykube.all).iterator():
+            if not pod_is_placed(pod.obj) or pod.obj['spec']['nodeName'] not in node_dict:
                 continue
-            nss = node_dict[host_ip]
+            nss = node_dict[pod.obj['spec']['nodeName']]
+            cores, memory = pod_requests(pod.obj)
             nss.container_count += 1
-            spec_cont = pod.obj['spec']['containers'][0]
-            if 'resources' in spec_cont:
-                if 'requests' in spec_cont['resources']:
-                    if 'memory' in spec_cont['resources']['requests']:
-                        memory = spec_cont['resources']['requests']['memory']
-                        nss.memory_reserved = nss.memory_reserved + humanfriendly.parse_size(memory)
-                    if 'cpu' in spec_cont['resources']['requests']:
-                        cpu = spec_cont['resources']['requests']['cpu']
-                        # ex: cpu could be 100m or 0.1
-                        cpu_splitted = cpu.split('m')
-                        if len(cpu_splitted) > 1:
-                            cpu_float = int(cpu_splitted[0]) / 1000
-                        else:
-                            cpu_float = int(cpu_splitted[0])
-                        nss.cores_reserved = round(nss.cores_reserved + cpu_float, 3)
-
-        for node_ip in node_dict:
-            pl_status.nodes.append(node_dict[node_ip])
+            nss.cores_reserved = round(nss.cores_reserved + cores, 3)
+            nss.memory_reserved += memory
 
+        pl_status.nodes = list(node_dict.values())
         return pl_status
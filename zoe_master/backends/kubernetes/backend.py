@@ -16,13 +16,16 @@
 """Zoe backend implementation for Kubernetes with docker."""
 
 import logging
+import time
+from typing import List
 
+from zoe_lib.config import get_conf
 from zoe_lib.state import Service
 from zoe_master.backends.kubernetes.api_client import KubernetesClient
 from zoe_master.exceptions import ZoeStartExecutionRetryException, ZoeStartExecutionFatalException, ZoeException, ZoeNotEnoughResourcesException
 from zoe_master.backends.service_instance import ServiceInstance
 import zoe_master.backends.base
-from zoe_master.backends.kubernetes.threads import KubernetesMonitor
+from zoe_master.backends.kubernetes.threads import KubernetesMonitor, KubernetesStateSynchronizer
 from zoe_master.stats import NodeStats, ClusterStats  # pylint: disable=unused-import
 
 log = logging.getLogger(__name__)
@@ -36,20 +39,29 @@ class KubernetesBackend(zoe_master.backends.base.BaseBackend):
     """Zoe backend implementation for Kubernetes with docker."""
     def __init__(self, opts):
         super().__init__(opts)
-        self.kube = KubernetesClient(opts)
+        if _monitor is not None:
+            self.kube = _monitor.kube  # parsing the kube config file is not free, the back-end is instantiated on each call
+        else:
+            self.kube = KubernetesClient(opts)
+
+    def _cluster_stats(self) -> ClusterStats:
+        """The cluster statistics from the monitor cache, or from a full listing until the cache is ready."""
+        if _monitor is not None and _monitor.stats_synced:
+            return _monitor.cluster_stats()
+        return self.kube.info()
 
     @classmethod
     def init(cls, state):
         """Initializes Kubernetes backend starting the event monitoring thread."""
         global _monitor, _checker
         _monitor = KubernetesMonitor(state)
-#        _checker = KubernetesStateSynchronizer(state)
+        _checker = KubernetesStateSynchronizer(state, _monitor)
 
     @classmethod
     def shutdown(cls):
         """Performs a clean shutdown of the resources used by Kubernetes backend."""
+        _checker.quit()
         _monitor.quit()
-#        _checker.quit()
 
     def spawn_service(self, service_instance: ServiceInstance):
         """Spawn a service, translating a Zoe Service into a Docker container."""
@@ -66,13 +78,31 @@ class KubernetesBackend(zoe_master.backends.base.BaseBackend):
 
         return rc_info["backend_id"], rc_info['ip_address'], ports
 
+    def spawn_services(self, service_instances: List[ServiceInstance]):
+        """Spawn a group of services with concurrent requests and wait for them to start, reading their status from the monitor cache."""
+        try:
+            results = self.kube.spawn_services(service_instances)
+        except ZoeNotEnoughResourcesException as e:
+            raise ZoeStartExecutionRetryException('Not enough free resources to satisfy reservation request: {}'.format(e))
+        except ZoeException as e:
+            raise ZoeStartExecutionFatalException(str(e))
+
+        if _monitor is not None and get_conf().kube_ready_timeout > 0:
+            time_start = time.time()
+            statuses = _monitor.wait_started([instance.name for instance in service_instances], get_conf().kube_ready_timeout)
+            not_started = [name for name, status in statuses.items() if status != Service.BACKEND_START_STATUS]
+            if len(not_started) > 0:
+                log.warning('Services {} not running after {:.1f}s'.format(', '.join(not_started), time.time() - time_start))
+
+        return [(result['backend_id'], result['ip_address'], result['ports']) for result in results]
+
     def terminate_service(self, service: Service) -> None:
         """Terminate and delete a container."""
         self.kube.terminate(service.dns_name)
 
     def platform_state(self) -> ClusterStats:
         """Get the platform state."""
-        info = self.kube.info()
+        info = self._cluster_stats()
         for node in info.nodes:  # type: NodeStats
             node.memory_in_use = node.memory_reserved
             node.cores_in_use = node.cores_reserved
@@ -88,14 +118,18 @@ class KubernetesBackend(zoe_master.backends.base.BaseBackend):
 
     def node_list(self):
         """Return a list of node names."""
-        info = self.kube.info()
+        info = self._cluster_stats()
         return [node.name for node in info.nodes]
 
     def list_available_images(self, node_name):
         """List the images available on the specified node."""
-        info = self.kube.info()
+        info = self._cluster_stats()
 
         for node in info.nodes:
             if node.name == node_name:
                 return node.images
         return []
+
+    def image_nodes(self, image_name):
+        """Kubernetes pulls images on demand, they are available on all nodes."""
+        return set(self.node_list())
@@ -0,0 +1,180 @@
+# Copyright (c) 2017, Daniele Venzano
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Local caches of Kubernetes objects, kept up to date by watching the API server."""
+
+import logging
+import threading
+from typing import Any, Callable, Dict, List
+
+import pykube
+
+log = logging.getLogger(__name__)
+
+RETRY_INTERVAL = 2  # seconds to wait before listing again after an error
+
+
+class ResourceVersionExpired(Exception):
+    """The API server does not keep history back to the requested resourceVersion, a new list is needed."""
+
+
+class KubernetesInformer(threading.Thread):
+    """
+    A cache of the objects of one kind, indexed by UID.
+
+    The objects are listed once, then a watch resumes from the resourceVersion of the list. When the watch ends it is reopened from the last
+    resourceVersion seen, so no event is lost; when that version has expired the objects are listed again and the differences are notified.
+    """
+
+    def __init__(self, api: pykube.HTTPClient, object_class, namespace, selector=None, index_key: Callable[[Dict[str, Any]], Any] = None,
+                 handler: Callable[[str, Dict[str, Any]], None] = None, keep: Callable[[Dict[str, Any]], bool] = None,
+                 transform: Callable[[Dict[str, Any]], Dict[str, Any]] = None) -> None:
+        super().__init__(name='informer_' + object_class.endpoint, daemon=True)
+        self.api = api
+        self.object_class = object_class
+        self.namespace = namespace
+        self.selector = selector
+        self.index_key = index_key
+        self.handler = handler
+        self.keep = keep  # objects for which keep() is False are handled as deleted
+        self.transform = transform  # reduces the objects to the fields that are needed, to save memory
+        self.synced = threading.Event()
+        self.stop = threading.Event()
+        self.resource_version = None
+        self._objects = {}  # type: Dict[str, Dict[str, Any]]
+        self._index = {}  # type: Dict[Any, Dict[str, Dict[str, Any]]]
+        self._lock = threading.Lock()
+
+    def get(self, uid: str):
+        """Return a cached object, None if it does not exist."""
+        with self._lock:
+            return self._objects.get(uid)
+
+    def objects(self) -> Dict[str, Dict[str, Any]]:
+        """A snapshot of the cached objects, indexed by UID."""
+        with self._lock:
+            return dict(self._objects)
+
+    def indexed(self, key) -> List[Dict[str, Any]]:
+        """The cached objects whose index key is equal to key."""
+        with self._lock:
+            return list(self._index.get(key, {}).values())
+
+    def _query(self):
+        return self.object_class.objects(self.api).filter(namespace=self.namespace, selector=self.selector)
+
+    def _store(self, obj: Dict[str, Any]):
+        uid = obj['metadata']['uid']
+        self._remove(uid)
+        self._objects[uid] = obj
+        if self.index_key is not None:
+            self._index.setdefault(self.index_key(obj), {})[uid] = obj
+
+    def _remove(self, uid: str):
+        old = self._objects.pop(uid, None)
+        if old is not None and self.index_key is not None:
+            entries = self._index.get(self.index_key(old), {})
+            entries.pop(uid, None)
+            if len(entries) == 0:
+                self._index.pop(self.index_key(old), None)
+        return old
+
+    def _notify(self, event_type: str, obj: Dict[str, Any]):
+        if self.handler is None:
+            return
+        try:
+            self.handler(event_type, obj)
+        except Exception:  # pylint: disable=broad-except
+            log.exception('Uncaught exception in Kubernetes event handler')
+
+    def _prepare(self, obj: Dict[str, Any]):
+        if self.keep is not None and not self.keep(obj):
+            return None
+        if self.transform is not None:
+            return self.transform(obj)
+        return obj
+
+    def relist(self, items: List[Dict[str, Any]], resource_version: str):
+        """Replace the cache content with a full list of objects, notifying what has changed since the previous list."""
+        changes = []
+        with self._lock:
+            old_objects = self._objects
+            self._objects = {}
+            self._index = {}
+            for obj in items:
+                obj = self._prepare(obj)
+                if obj is None:
+                    continue
+                self._store(obj)
+                old = old_objects.pop(obj['metadata']['uid'], None)
+                if old is None:
+                    changes.append(('ADDED', obj))
+                elif old['metadata'].get('resourceVersion') != obj['metadata'].get('resourceVersion'):
+                    changes.append(('MODIFIED', obj))
+            for old in old_objects.values():
+                changes.append(('DELETED', old))
+            self.resource_version = resource_version
+        for event_type, obj in changes:
+            self._notify(event_type, obj)
+
+    def apply(self, event_type: str, obj: Dict[str, Any]):
+        """Apply a watch event to the cache and notify it."""
+        if event_type == 'ERROR':
+            if obj.get('code') == 410:
+                raise ResourceVersionExpired(obj.get('message'))
+            log.warning('Error in the watch of {}: {}'.format(self.object_class.endpoint, obj.get('message')))
+            return
+        resource_version = obj['metadata'].get('resourceVersion', self.resource_version)
+        if event_type != 'DELETED':
+            prepared = self._prepare(obj)
+            if prepared is None:
+                event_type = 'DELETED'
+            else:
+                obj = prepared
+        with self._lock:
+            if event_type == 'DELETED':
+                old = self._remove(obj['metadata']['uid'])
+            else:
+                old = True
+                self._store(obj)
+            self.resource_version = resource_version
+        if old is not None:  # objects that were never kept are not notified
+            self._notify(event_type, obj)
+
+    def run(self):
+        """List and watch, until the thread is stopped."""
+        log.info('Informer for {} started'.format(self.object_class.endpoint))
+        while not self.stop.is_set():
+            try:
+                if self.resource_version is None:
+                    response = self._query().response
+                    self.relist(response['items'] or [], response['metadata']['resourceVersion'])
+                    self.synced.set()
+                    log.debug('Listed {} {}, at resourceVersion {}'.format(len(self._objects), self.object_class.endpoint, self.resource_version))
+                for event in self._query().watch(since=self.resource_version):
+                    self.apply(event.type, event.object.obj)
+                    if self.stop.is_set():
+                        break
+            except ResourceVersionExpired:
+                log.debug('resourceVersion {} of {} has expired, listing again'.format(self.resource_version, self.object_class.endpoint))
+                self.resource_version = None
+            except Exception as ex:  # pylint: disable=broad-except
+                log.error('Watch of {} failed: {}'.format(self.object_class.endpoint, ex))
+                self.stop.wait(timeout=RETRY_INTERVAL)
+        log.info('Informer for {} stopped'.format(self.object_class.endpoint))
+
+    def quit(self):
+        """Stops the thread at the next event, the thread is a daemon and does not keep the process alive."""
+        self.stop.set()
@@ -0,0 +1,92 @@
+# Copyright (c) 2017, Daniele Venzano
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for the Kubernetes API client."""
+
+import json
+
+import pykube
+
+from zoe_lib.config import load_configuration
+from zoe_lib.tests.config_mock import zoe_configuration  # pylint: disable=unused-import
+from zoe_master.backends.kubernetes.api_client import parse_quantity, pod_requests, KubernetesReplicationControllerConf, KubernetesClient, service_ports
+
+
+class MockAPI:
+    """An API server that records the DELETE requests."""
+    def __init__(self):
+        self.deleted = []
+
+    def delete(self, **kwargs):
+        """Record the request, the object does not exist."""
+        self.deleted.append(kwargs)
+        return type('Response', (), {'status_code': 404})
+
+    def raise_for_status(self, resp):
+        """Never called for 404."""
+        raise AssertionError(resp)
+
+
+class TestKubernetesApiClient:
+    """API client testing."""
+
+    def test_quantities(self):
+        """Test the parsing of resource quantities and the requests of a pod, init containers included."""
+        assert parse_quantity('500m') == 0.5
+        assert parse_quantity('2') == 2
+        assert parse_quantity('1Gi') == 1024 ** 3
+        assert parse_quantity('1G') == 1000 ** 3
+        assert parse_quantity('1e3') == 1000
+        pod = {'spec': {
+            'containers': [{'resources': {'requests': {'cpu': '250m', 'memory': '128Mi'}}}, {'resources': {'requests': {'cpu': '1'}}}],
+            'initContainers': [{'resources': {'requests': {'cpu': '2', 'memory': '64Mi'}}}]
+        }}
+        assert pod_requests(pod) == (2, 128 * 1024 ** 2)
+
+    def test_objects(self, zoe_configuration):  # pylint: disable=redefined-outer-name
+        """Test the container environment and the port mapping of the objects submitted for a service."""
+        zoe_configuration.kube_namespace = 'zoe'
+        load_configuration(zoe_configuration)
+        config = KubernetesReplicationControllerConf()
+        config.set_spec_container_env({'SPARK_MASTER': 'spark://master:7077', 'X': '1'})
+        env = config.get_json()['spec']['template']['spec']['containers'][0]['env']
+        assert sorted((var['name'], var['value']) for var in env) == [('SPARK_MASTER', 'spark://master:7077'), ('X', '1')]
+        assert service_ports({'spec': {'ports': [{'port': 8080, 'targetPort': 8080}]}}) == {8080: 8080}
+
+    def test_placement(self, zoe_configuration):  # pylint: disable=redefined-outer-name
+        """Test the node affinity and the resource requests that make Kubernetes follow the Zoe placement."""
+        zoe_configuration.kube_namespace = 'zoe'
+        load_configuration(zoe_configuration)
+        config = KubernetesReplicationControllerConf()
+        config.set_spec_container_core_limit(0.5)
+        config.set_spec_container_mem_limit(512 * 1024 ** 2)
+        config.set_spec_node_affinity('node-1')
+        pod_spec = config.get_json()['spec']['template']['spec']
+        assert pod_spec['containers'][0]['resources']['requests'] == {'cpu': '0.5', 'memory': str(512 * 1024 ** 2)}
+        assert pod_requests({'spec': pod_spec}) == (0.5, 512 * 1024 ** 2)
+        terms = pod_spec['affinity']['nodeAffinity']['requiredDuringSchedulingIgnoredDuringExecution']['nodeSelectorTerms']
+        assert terms[0]['matchFields'][0]['values'] == ['node-1']
+
+    def test_delete(self, zoe_configuration):  # pylint: disable=redefined-outer-name
+        """Test that deleting a replication controller also deletes its pods, instead of orphaning them."""
+        zoe_configuration.kube_namespace = 'zoe'
+        load_configuration(zoe_configuration)
+        client = KubernetesClient.__new__(KubernetesClient)
+        client.api = MockAPI()
+        client.delete(pykube.ReplicationController, 'svc-a')
+        request = client.api.deleted[0]
+        assert request['url'] == 'replicationcontrollers/svc-a'
+        assert request['namespace'] == 'zoe'
+        assert json.loads(request['data'])['propagationPolicy'] == 'Background'
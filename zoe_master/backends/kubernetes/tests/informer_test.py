@@ -0,0 +1,76 @@
+# Copyright (c) 2017, Daniele Venzano
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for the Kubernetes object caches."""
+
+import pykube
+import pytest
+
+from zoe_lib.state import Service
+from zoe_master.backends.kubernetes.api_client import replication_controller_status
+from zoe_master.backends.kubernetes.informer import KubernetesInformer, ResourceVersionExpired
+
+
+def _rc(uid, name, ready, resource_version):
+    return {
+        'metadata': {'uid': uid, 'name': name, 'resourceVersion': resource_version, 'labels': {'service_name': name}},
+        'spec': {'replicas': 1},
+        'status': {'readyReplicas': ready}
+    }
+
+
+class TestKubernetesInformer:
+    """Object cache testing."""
+
+    @pytest.fixture
+    def informer(self):
+        """An informer that is not started, with a handler that records the events."""
+        events = []
+        informer = KubernetesInformer(None, pykube.ReplicationController, 'zoe', index_key=lambda obj: obj['metadata']['labels']['service_name'],
+                                      handler=lambda event_type, obj: events.append((event_type, obj['metadata']['uid'])))
+        informer.events = events
+        return informer
+
+    def test_relist(self, informer):
+        """Test that a new list notifies only the differences with the cache."""
+        informer.relist([_rc('a', 'svc-a', 0, '1'), _rc('b', 'svc-b', 0, '2')], '2')
+        informer.events.clear()
+        informer.relist([_rc('a', 'svc-a', 0, '1'), _rc('b', 'svc-b', 1, '3'), _rc('c', 'svc-c', 0, '4')], '4')
+        assert sorted(informer.events) == [('ADDED', 'c'), ('MODIFIED', 'b')]
+        informer.events.clear()
+        informer.relist([_rc('c', 'svc-c', 0, '4')], '5')
+        assert sorted(informer.events) == [('DELETED', 'a'), ('DELETED', 'b')]
+        assert informer.resource_version == '5'
+        assert set(informer.objects()) == {'c'}
+
+    def test_apply(self, informer):
+        """Test that watch events update the cache, the index and the resourceVersion."""
+        informer.relist([_rc('a', 'svc-a', 0, '1')], '1')
+        informer.apply('MODIFIED', _rc('a', 'svc-a', 1, '7'))
+        assert informer.get('a')['status']['readyReplicas'] == 1
+        assert informer.resource_version == '7'
+        assert len(informer.indexed('svc-a')) == 1
+        informer.apply('DELETED', _rc('a', 'svc-a', 1, '8'))
+        assert informer.get('a') is None
+        assert informer.indexed('svc-a') == []
+        with pytest.raises(ResourceVersionExpired):
+            informer.apply('ERROR', {'kind': 'Status', 'code': 410, 'message': 'too old resource version'})
+
+    def test_status(self):
+        """Test the back-end status derived from a replication controller and its pods."""
+        assert replication_controller_status(_rc('a', 'svc-a', 1, '1'), []) == Service.BACKEND_START_STATUS
+        assert replication_controller_status(_rc('a', 'svc-a', 0, '1'), []) == Service.BACKEND_UNDEFINED_STATUS
+        pod = {'status': {'containerStatuses': [{'state': {'waiting': {'reason': 'CrashLoopBackOff'}}, 'lastState': {'terminated': {'reason': 'OOMKilled'}}}]}}
+        assert replication_controller_status(_rc('a', 'svc-a', 0, '1'), [pod]) == Service.BACKEND_OOM_STATUS
@@ -18,118 +18,216 @@
 import logging
 import threading
 import time
+from typing import Dict, List, Tuple
+
 import pykube
 
 from zoe_lib.config import get_conf
 from zoe_lib.state import SQLManager, Service
-from zoe_master.backends.kubernetes.api_client import KubernetesClient
+from zoe_master.backends.kubernetes.api_client import KubernetesClient, ZOE_LABELS, replication_controller_status, pod_is_placed, pod_node_name, pod_summary, update_node_stats
+from zoe_master.backends.kubernetes.informer import KubernetesInformer
+from zoe_master.stats import ClusterStats, NodeStats
 
 log = logging.getLogger(__name__)
 
+# Objects created by any version of Zoe
+ZOE_SELECTOR = {'app': ZOE_LABELS['app']}
+
+
+def _service_name(obj):
+    return obj['metadata'].get('labels', {}).get('service_name')
+
+
+class KubernetesMonitor:
+    """
+    The monitor.
 
-class KubernetesMonitor(threading.Thread):
-    """The monitor."""
+    Keeps local caches of the replication controllers and of the pods created by Zoe, and updates the status of a service as soon as one of its
+    objects changes, without querying the API server again.
+
+    The cluster statistics are kept current in the same way: node events update the totals, and the events of the pods placed on the nodes,
+    in all namespaces, add or remove their requests from the reserved resources.
+    """
 
     def __init__(self, state: SQLManager) -> None:
-        super().__init__()
-        self.setName('monitor')
-        self.stop = False
         self.state = state
-        self.setDaemon(True)
-        self.service_id = {}
         self.kube = KubernetesClient(get_conf())
-        self.start()
-
-    def run(self):
-        """An infinite loop that listens for events from Kubernetes."""
-        log.info("Monitor thread started")
-        while True:  # pylint: disable=too-many-nested-blocks
-            log.debug("Kubernetes service event stream")
-            try:
-                watch = pykube.ReplicationController.objects(self.kube.api, namespace=get_conf().kube_namespace).watch()
-                for event in watch:
-                    log.debug('%s: %s', event.object.name, event.type)
-                    if event.type != 'DELETED' and event.type != 'ADDED':
-                        rc_info = self.kube.inspect_replication_controller(event.object.name)
-                        if rc_info:
-                            rc_uid = rc_info['backend_id']
-                            service = self.state.services.select(only_one=True, backend_id=rc_uid)
-                            if event.object.name not in self.service_id:
-                                self.service_id[event.object.name] = service.id
-                            if service is not None:
-                                if rc_info['readyReplicas'] == 0:
-                                    log.debug('Number replicas: 0')
-                                    service.set_backend_status(service.BACKEND_UNDEFINED_STATUS)
-                                elif rc_info['readyReplicas'] < rc_info['replicas']:
-                                    logstr = 'Number replicas: ' + str(rc_info['readyReplicas'])
-                                    log.debug(logstr)
-                                    service.set_backend_status(service.BACKEND_CREATE_STATUS)
-                                elif rc_info['readyReplicas'] == rc_info['replicas']:
-                                    if service.backend_status != service.BACKEND_START_STATUS:
-                                        log.debug('Reached desired number of replicas')
-                                        service.set_backend_status(service.BACKEND_START_STATUS)
-                    else:
-                        if event.type != 'ADDED':
-                            if event.object.name in self.service_id:
-                                sid = self.service_id[event.object.name]
-                                self.service_id.pop(event.object.name)
-                                service = self.state.services.select(only_one=True, id=sid)
-                                if service is not None:
-                                    log.info('Destroyed all replicas')
-                                    service.set_backend_status(service.BACKEND_DESTROY_STATUS)
-                    time.sleep(1)
-            except Exception as ex:
-                log.error(ex)
-            log.debug("Kubernetes service event stream ended, start new stream")
-            time.sleep(2)
+        self._lock = threading.Lock()
+        self._status_changed = threading.Condition()
+        self.controllers = KubernetesInformer(self.kube.api, pykube.ReplicationController, get_conf().kube_namespace, selector=ZOE_SELECTOR, index_key=_service_name, handler=self._controller_event)
+        self.pods = KubernetesInformer(self.kube.api, pykube.Pod, get_conf().kube_namespace, selector=ZOE_SELECTOR, index_key=_service_name, handler=self._pod_event)
+        self._stats_lock = threading.Lock()
+        self._node_stats = {}  # type: Dict[str, NodeStats]
+        self._pod_usage = {}  # type: Dict[str, Tuple[str, float, int]]
+        self.nodes = KubernetesInformer(self.kube.api, pykube.Node, pykube.all, handler=self._node_event)
+        self.cluster_pods = KubernetesInformer(self.kube.api, pykube.Pod, pykube.all, handler=self._cluster_pod_event, keep=pod_is_placed, transform=pod_summary)
+        self.pods.start()
+        self.controllers.start()
+        self.nodes.start()
+        self.cluster_pods.start()
+
+    def controller_status(self, rc_obj) -> str:
+        """The back-end status of the service managed by a replication controller, from the cached objects."""
+        return replication_controller_status(rc_obj, self.pods.indexed(_service_name(rc_obj)))
+
+    def _controller_event(self, event_type, rc_obj):
+        log.debug('%s: %s', rc_obj['metadata']['name'], event_type)
+        node_name = None
+        if event_type == 'DELETED':
+            new_status = Service.BACKEND_DESTROY_STATUS
+        else:
+            pods = self.pods.indexed(_service_name(rc_obj))
+            new_status = replication_controller_status(rc_obj, pods)
+            node_name = pod_node_name(pods)
+        with self._lock:
+            service = self.state.services.select(only_one=True, backend_id=rc_obj['metadata']['uid'])
+            if service is not None and node_name is not None and service.backend_host != node_name:
+                if service.backend_host is not None:
+                    log.info('Service {} was placed by Kubernetes on node {} instead of {}'.format(service.name, node_name, service.backend_host))
+                service.assign_backend_host(node_name)
+            if service is not None and service.backend_status != new_status:
+                log.debug('Service {} is now {}'.format(service.name, new_status))
+                service.set_backend_status(new_status)
+        with self._status_changed:
+            self._status_changed.notify_all()
+
+    def service_status(self, name: str) -> str:
+        """The back-end status of a service, by name, from the cached objects."""
+        rc_list = self.controllers.indexed(name)
+        if len(rc_list) == 0:
+            return Service.BACKEND_UNDEFINED_STATUS
+        return self.controller_status(rc_list[0])
+
+    def wait_started(self, names: List[str], timeout: float) -> Dict[str, str]:
+        """Wait until the services have started or failed, or until the timeout expires, and return their back-end statuses."""
+        deadline = time.time() + timeout
+        with self._status_changed:
+            while True:
+                statuses = {name: self.service_status(name) for name in names}
+                pending = [name for name, status in statuses.items() if status in (Service.BACKEND_CREATE_STATUS, Service.BACKEND_UNDEFINED_STATUS)]
+                remaining = deadline - time.time()
+                if len(pending) == 0 or remaining <= 0:
+                    return statuses
+                self._status_changed.wait(remaining)
+
+    def _pod_event(self, event_type, pod_obj):  # pylint: disable=unused-argument
+        for rc_obj in self.controllers.indexed(_service_name(pod_obj)):
+            self._controller_event('MODIFIED', rc_obj)
+
+    def _node_event(self, event_type, node_obj):
+        name = node_obj['metadata']['name']
+        with self._stats_lock:
+            if event_type == 'DELETED':
+                self._node_stats.pop(name, None)
+                return
+            nss = self._node_stats.get(name)
+            if nss is None:
+                nss = NodeStats(name)
+                for node_name, cores, memory in self._pod_usage.values():  # pods seen before their node
+                    if node_name == name:
+                        self._add_usage(nss, 1, cores, memory)
+                self._node_stats[name] = nss
+            update_node_stats(nss, node_obj)
+            nss.valid = True
+            nss.timestamp = time.time()
+
+    def _cluster_pod_event(self, event_type, pod):
+        uid = pod['metadata']['uid']
+        with self._stats_lock:
+            old_usage = self._pod_usage.pop(uid, None)
+            if old_usage is not None and old_usage[0] in self._node_stats:
+                self._add_usage(self._node_stats[old_usage[0]], -1, -old_usage[1], -old_usage[2])
+            if event_type == 'DELETED':
+                return
+            self._pod_usage[uid] = (pod['node_name'], pod['cores'], pod['memory'])
+            if pod['node_name'] in self._node_stats:
+                self._add_usage(self._node_stats[pod['node_name']], 1, pod['cores'], pod['memory'])
+
+    @staticmethod
+    def _add_usage(nss: NodeStats, count, cores, memory):
+        nss.container_count += count
+        nss.cores_reserved = round(nss.cores_reserved + cores, 3)
+        nss.memory_reserved += memory
+
+    def cluster_stats(self) -> ClusterStats:
+        """The statistics of the cluster, from the cached nodes and pods."""
+        stats = ClusterStats()
+        with self._stats_lock:
+            stats.nodes = list(self._node_stats.values())
+        return stats
+
+    @property
+    def stats_synced(self) -> bool:
+        """True once the nodes and the pods have been listed."""
+        return self.nodes.synced.is_set() and self.cluster_pods.synced.is_set()
 
     def quit(self):
-        """Stops the thread."""
-        self.stop = True
+        """Stops the informers."""
+        self.controllers.quit()
+        self.pods.quit()
+        self.nodes.quit()
+        self.cluster_pods.quit()
 
 
 CHECK_INTERVAL = 10
 
+# Back-end statuses of services that may still have objects in Kubernetes
+LIVE_STATUSES = [Service.BACKEND_UNDEFINED_STATUS, Service.BACKEND_CREATE_STATUS, Service.BACKEND_START_STATUS]
+
 
 class KubernetesStateSynchronizer(threading.Thread):
-    """The Kubernetes Checker."""
+    """
+    The Kubernetes Checker.
 
-    def __init__(self, state: SQLManager) -> None:
+    Repairs what the event handlers may have missed by comparing the live services with the replication controllers in the monitor cache.
+    """
+
+    def __init__(self, state: SQLManager, monitor: KubernetesMonitor) -> None:
         super().__init__()
         self.setName('checker')
-        self.stop = False
+        self.stop = threading.Event()
         self.state = state
+        self.monitor = monitor
         self.setDaemon(True)
-        self.kube = KubernetesClient(get_conf())
+        self._missing = set()
         self.start()
 
-    def _find_dead_service(self, repcon_list, service: Service):
-        """Loop through the pods and try to update the service status."""
-        found = False
-        for rep in repcon_list:
-            log.debug("%s - %s", rep['backend_id'], service.backend_id)
-            if rep['backend_id'] == service.backend_id:
-                found = True
-                if rep['running'] is False:
-                    log.info('resetting status of service {}, died with no event'.format(service.name))
-                    service.set_backend_status(service.BACKEND_DIE_STATUS)
-        if not found:
-            service.set_backend_status(service.BACKEND_DESTROY_STATUS)
+    def _reconcile(self):
+        """Join the live services with the cached replication controllers by UID, and write the status changes in one transaction."""
+        repcons = self.monitor.controllers.objects()
+        status_changes = {}
+        missing = set()
+        for service in self.state.services.select(backend_status=LIVE_STATUSES):
+            if service.backend_id is None:
+                continue
+            rc_obj = repcons.get(service.backend_id)
+            if rc_obj is None:
+                if service.id in self._missing:  # missing twice in a row, not just created
+                    log.info('resetting status of service {}, destroyed with no event'.format(service.name))
+                    status_changes[service.id] = Service.BACKEND_DESTROY_STATUS
+                else:
+                    missing.add(service.id)
+                continue
+            new_status = self.monitor.controller_status(rc_obj)
+            if new_status != service.backend_status:
+                log.info('resetting status of service {} to {}, changed with no event'.format(service.name, new_status))
+                status_changes[service.id] = new_status
+        self._missing = missing
+        self.state.services.update_backend_status(status_changes)
 
     def run(self):
         """The thread loop."""
         log.info("Checker thread started")
-        while not self.stop:
-            service_list = self.state.services.select()
-            repcon_list = self.kube.replication_controller_list()
-            for service in service_list:
-                assert isinstance(service, Service)
-                if service.backend_status == service.BACKEND_DESTROY_STATUS or service.backend_status == service.BACKEND_DIE_STATUS:
-                    continue
-                self._find_dead_service(repcon_list, service)
-
-            time.sleep(CHECK_INTERVAL)
+        self.monitor.controllers.synced.wait()
+        while not self.stop.is_set():
+            try:
+                self._reconcile()
+            except Exception:  # pylint: disable=broad-except
+                log.exception('Error while reconciling the Kubernetes state')
+            self.stop.wait(timeout=CHECK_INTERVAL)
+        log.info("Checker thread stopped")
 
     def quit(self):
         """Stops the thread."""
-        self.stop = True
+        self.stop.set()
+        self.join()
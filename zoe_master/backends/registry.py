@@ -0,0 +1,171 @@
+# Copyright (c) 2017, Daniele Venzano
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""The back-ends enabled in the configuration, federated into a single platform."""
+
+from collections import OrderedDict
+import logging
+import threading
+from typing import Callable, Dict, Iterable, List, Tuple, TypeVar
+
+from zoe_master.backends.base import BaseBackend
+from zoe_master.exceptions import ZoeException
+from zoe_master.stats import ClusterStats
+
+try:
+    from zoe_master.backends.kubernetes.backend import KubernetesBackend
+except ImportError:
+    KubernetesBackend = None
+
+try:
+    from zoe_master.backends.docker.backend import DockerEngineBackend
+except ImportError:
+    DockerEngineBackend = None
+
+try:
+    from zoe_master.backends.docker.async_backend import AsyncDockerEngineBackend
+except ImportError:
+    AsyncDockerEngineBackend = None
+
+log = logging.getLogger(__name__)
+
+BACKEND_CLASSES = OrderedDict([
+    ('DockerEngine', (DockerEngineBackend, 'The Docker Engine backend requires docker python version >= 2.0.2')),
+    ('DockerEngineAsync', (AsyncDockerEngineBackend, 'The asynchronous Docker Engine backend requires docker python version >= 2.0.2 and tornado')),
+    ('Kubernetes', (KubernetesBackend, 'The Kubernetes backend requires the pykube module')),
+])
+
+# Back-ends that run a container only where its image has already been pulled
+IMAGE_INDEX_BACKENDS = ('DockerEngine', 'DockerEngineAsync')
+
+T = TypeVar('T')
+
+
+def backend_names(backend_option: str) -> List[str]:
+    """Parse the backend configuration option, a comma-separated list of back-end names."""
+    names = [name.strip() for name in backend_option.split(',') if name.strip() != '']
+    if len(names) == 0:
+        raise ZoeException('No back-end configured')
+    for name in names:
+        if name not in BACKEND_CLASSES:
+            raise ZoeException('Unknown back-end {}, choose among {}'.format(name, ', '.join(BACKEND_CLASSES)))
+    if len(set(names)) != len(names):
+        raise ZoeException('Back-end configured more than once: {}'.format(backend_option))
+    return names
+
+
+class BackendRegistry:
+    """
+    Holds one instance of each enabled back-end and routes the calls to the back-end that owns a node.
+
+    Node names must be unique across the back-ends. Services without a node, and nodes that no back-end reports, go to the first back-end in the configuration.
+    """
+
+    def __init__(self, opts) -> None:
+        self.opts = opts
+        self.classes = OrderedDict()  # type: Dict[str, type]
+        for name in backend_names(opts.backend):
+            backend_class, missing_message = BACKEND_CLASSES[name]
+            if backend_class is None:
+                raise ZoeException(missing_message)
+            self.classes[name] = backend_class
+        self.default_name = next(iter(self.classes))
+        self._backends = {}  # type: Dict[str, BaseBackend]
+        self._node_backends = {}  # type: Dict[str, str]
+        self._lock = threading.Lock()
+
+    def init(self, state):
+        """Initializes all the back-ends, then creates the instance that will serve all the calls to each one."""
+        for name, backend_class in self.classes.items():
+            log.info('Initializing back-end {}'.format(name))
+            backend_class.init(state)
+            self._backends[name] = backend_class(self.opts)
+
+    def shutdown(self):
+        """Shuts down all the back-ends."""
+        for backend_class in self.classes.values():
+            backend_class.shutdown()
+
+    @property
+    def backends(self) -> Dict[str, BaseBackend]:
+        """The back-end instances, by name, in the configuration order."""
+        for name, backend_class in self.classes.items():
+            if name not in self._backends:  # not initialized, e.g. when used from a script
+                self._backends[name] = backend_class(self.opts)
+        return OrderedDict((name, self._backends[name]) for name in self.classes)
+
+    def backend_name(self, node_name) -> str:
+        """The name of the back-end that owns a node."""
+        if node_name is None or len(self.classes) == 1:
+            return self.default_name
+        with self._lock:
+            name = self._node_backends.get(node_name)
+        if name is None:
+            self.node_list()  # a node that was not there at the last refresh
+            with self._lock:
+                name = self._node_backends.get(node_name, self.default_name)
+        return name
+
+    def get(self, node_name) -> BaseBackend:
+        """The back-end that owns a node."""
+        return self.backends[self.backend_name(node_name)]
+
+    def group(self, items: Iterable[T], node_name: Callable[[T], str]) -> List[Tuple[BaseBackend, List[T]]]:
+        """Split items by the back-end that owns their node, keeping their order within each back-end."""
+        groups = OrderedDict()  # type: Dict[str, List[T]]
+        for item in items:
+            groups.setdefault(self.backend_name(node_name(item)), []).append(item)
+        return [(self.backends[name], group) for name, group in groups.items()]
+
+    def _update_nodes(self, name: str, node_names: Iterable[str]):
+        with self._lock:
+            self._node_backends = {node_name: backend_name for node_name, backend_name in self._node_backends.items() if backend_name != name}
+            for node_name in node_names:
+                previous = self._node_backends.setdefault(node_name, name)
+                if previous != name:
+                    log.error('Node {node} is reported by back-ends {previous} and {name}, it is routed to {previous}'.format(node=node_name, previous=previous, name=name))
+
+    def platform_state(self) -> ClusterStats:
+        """The nodes of all the back-ends, each tagged with the name of its back-end."""
+        if len(self.classes) == 1:
+            state = self.get(None).platform_state()
+            for node in state.nodes:
+                node.backend = self.default_name
+            return state
+        state = ClusterStats()
+        errors = []
+        for name, backend in self.backends.items():
+            try:
+                backend_state = backend.platform_state()
+            except ZoeException as e:
+                log.error('Cannot retrieve the state of back-end {}: {}'.format(name, e))
+                errors.append(e)
+                continue
+            for node in backend_state.nodes:
+                node.backend = name
+            self._update_nodes(name, [node.name for node in backend_state.nodes])
+            state.nodes += backend_state.nodes
+        if len(errors) == len(self.classes):
+            raise errors[0]
+        return state
+
+    def node_list(self) -> List[str]:
+        """The nodes of all the back-ends."""
+        nodes = []
+        for name, backend in self.backends.items():
+            backend_nodes = backend.node_list()
+            self._update_nodes(name, backend_nodes)
+            nodes += backend_nodes
+        return nodes
@@ -0,0 +1,61 @@
+# Copyright (c) 2017, Daniele Venzano
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for the helpers shared by the back-ends."""
+
+import pytest
+
+from zoe_master.backends.common import normalize_image_name
+from zoe_master.stats import ImageIndex
+
+# Image references and their normalized form, as the Docker Engine expands them
+IMAGE_NAMES = [
+    ('ubuntu', 'docker.io/library/ubuntu:latest'),
+    ('ubuntu:latest', 'docker.io/library/ubuntu:latest'),
+    ('ubuntu:16.04', 'docker.io/library/ubuntu:16.04'),
+    ('library/ubuntu', 'docker.io/library/ubuntu:latest'),
+    ('docker.io/ubuntu', 'docker.io/library/ubuntu:latest'),
+    ('docker.io/library/ubuntu:16.04', 'docker.io/library/ubuntu:16.04'),
+    ('index.docker.io/ubuntu', 'docker.io/library/ubuntu:latest'),
+    ('index.docker.io/library/ubuntu:16.04', 'docker.io/library/ubuntu:16.04'),
+    ('zoerepo/spark:2.1', 'docker.io/zoerepo/spark:2.1'),
+    ('localhost/x', 'localhost/x:latest'),
+    ('localhost:5000/x', 'localhost:5000/x:latest'),
+    ('localhost:5000/x:1.0', 'localhost:5000/x:1.0'),
+    ('registry.example.com/team/x:1.0', 'registry.example.com/team/x:1.0'),
+    ('ubuntu@sha256:0123abcd', 'docker.io/library/ubuntu@sha256:0123abcd'),
+    ('docker.io/library/ubuntu@sha256:0123abcd', 'docker.io/library/ubuntu@sha256:0123abcd'),
+    ('localhost:5000/x@sha256:0123abcd', 'localhost:5000/x@sha256:0123abcd'),
+]
+
+
+class TestImageNames:
+    """Test the normalization of image references."""
+
+    @pytest.mark.parametrize('image_name,normalized', IMAGE_NAMES)
+    def test_normalize(self, image_name, normalized):
+        """Test that references to the same image compare equal once normalized."""
+        assert normalize_image_name(image_name) == normalized
+
+    def test_image_index(self):
+        """Test that the index finds an image by any spelling of its tags and digests."""
+        index = ImageIndex()
+        assert index.update([{'id': 'sha256:1', 'size': 1, 'names': ['ubuntu:16.04'], 'digests': ['ubuntu@sha256:0123abcd']}])
+        assert 'docker.io/library/ubuntu:16.04' in index
+        assert 'index.docker.io/library/ubuntu:16.04' in index
+        assert 'library/ubuntu@sha256:0123abcd' in index
+        assert 'ubuntu' not in index
+        assert 'localhost:5000/ubuntu:16.04' not in index
+        assert not index.update([{'id': 'sha256:1', 'size': 1, 'names': ['docker.io/library/ubuntu:16.04'], 'digests': ['ubuntu@sha256:0123abcd']}])
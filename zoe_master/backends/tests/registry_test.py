@@ -0,0 +1,77 @@
+# Copyright (c) 2017, Daniele Venzano
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for the back-end registry."""
+
+from argparse import Namespace
+
+import pytest
+
+from zoe_master.backends import registry
+from zoe_master.backends.base import BaseBackend
+from zoe_master.exceptions import ZoeException
+from zoe_master.stats import ClusterStats, NodeStats
+
+
+def _fake_backend(node_names):
+    class FakeBackend(BaseBackend):  # pylint: disable=abstract-method
+        """A back-end that reports a fixed list of nodes."""
+        instances = 0
+
+        def __init__(self, opts):
+            super().__init__(opts)
+            FakeBackend.instances += 1
+
+        def platform_state(self):
+            stats = ClusterStats()
+            stats.nodes = [NodeStats(name) for name in node_names]
+            return stats
+
+        def node_list(self):
+            return list(node_names)
+    return FakeBackend
+
+
+class TestBackendRegistry:
+    """Back-end registry testing."""
+
+    @pytest.fixture
+    def backends(self, monkeypatch):
+        """A Docker and a Kubernetes back-end with two nodes each."""
+        classes = {
+            'DockerEngine': (_fake_backend(['docker-1', 'docker-2']), ''),
+            'Kubernetes': (_fake_backend(['kube-1', 'kube-2']), '')
+        }
+        monkeypatch.setattr(registry, 'BACKEND_CLASSES', classes)
+        return registry.BackendRegistry(Namespace(backend='Kubernetes, DockerEngine'))
+
+    def test_names(self):
+        """Test the parsing of the backend option."""
+        assert registry.backend_names('DockerEngine') == ['DockerEngine']
+        assert registry.backend_names('DockerEngine,Kubernetes') == ['DockerEngine', 'Kubernetes']
+        with pytest.raises(ZoeException):
+            registry.backend_names('Swarm')
+        with pytest.raises(ZoeException):
+            registry.backend_names('Kubernetes,Kubernetes')
+
+    def test_routing(self, backends):
+        """Test that nodes are routed to the back-end that reports them, and that each back-end is created once."""
+        state = backends.platform_state()
+        assert [(node.name, node.backend) for node in state.nodes] == [('kube-1', 'Kubernetes'), ('kube-2', 'Kubernetes'), ('docker-1', 'DockerEngine'), ('docker-2', 'DockerEngine')]
+        assert backends.backend_name('docker-2') == 'DockerEngine'
+        assert backends.backend_name(None) == 'Kubernetes'
+        groups = backends.group(['docker-1', 'kube-1', 'docker-2'], lambda x: x)
+        assert [(type(backend), items) for backend, items in groups] == [(backends.classes['DockerEngine'], ['docker-1', 'docker-2']), (backends.classes['Kubernetes'], ['kube-1'])]
+        assert backends.classes['DockerEngine'].instances == 1
@@ -29,6 +29,7 @@ from zoe_master.gelf_listener import GELFListener
 from zoe_master.master_api import APIManager
 from zoe_master.metrics.base import StatsManager
 from zoe_master.preprocessing import restart_resubmit_scheduler
+from zoe_master.runtime_limit import RuntimeLimitEnforcer
 
 log = logging.getLogger("main")
 LOG_FORMAT = '%(asctime)-15s %(levelname)s %(threadName)s->%(name)s: %(message)s'
@@ -79,6 +80,9 @@ def main(test_conf=None):
 
     restart_resubmit_scheduler(state, scheduler)
 
+    runtime_limit = RuntimeLimitEnforcer(state, scheduler)
+    runtime_limit.start()
+
     log.info("Starting ZMQ API server...")
     api_server = APIManager(metrics, scheduler, state)
 
@@ -94,6 +98,8 @@ def main(test_conf=None):
     except Exception:
         log.exception('Fatal error in API loop')
     finally:
+        log.info('Terminating run time limit thread')
+        runtime_limit.quit()
         log.info('Terminating scheduler thread')
         scheduler.quit()
         log.info('Terminating api server thread')
@@ -22,6 +22,7 @@ import zmq
 
 import zoe_lib.config
 from zoe_lib.state import SQLManager
+import zoe_master.backends.interface
 import zoe_master.preprocessing
 from zoe_master.exceptions import ZoeException
 from zoe_master.metrics.base import StatsManager
@@ -80,7 +81,7 @@ class APIManager:
                     zoe_master.preprocessing.execution_terminate(self.scheduler, execution, reason)
             elif message['command'] == 'execution_delete':
                 exec_id = message['exec_id']
-                execution = self.state.executions.select(id=exec_id, only_one=True)
+                execution = self.state.executions.select(id=exec_id, only_one=True, history=True)
                 if execution is not None:
                     zoe_master.preprocessing.execution_delete(execution)
                 self._reply_ok()
@@ -96,6 +97,12 @@ class APIManager:
                     self._reply_error(str(e))
                 else:
                     self._reply_ok(data=data)
+            elif message['command'] == 'images_warm':
+                nodes = zoe_master.backends.interface.node_list()
+                zoe_master.backends.interface.prefetch_images({image_name: nodes for image_name in message['images']})
+                self._reply_ok()
+            elif message['command'] == 'image_pulls':
+                self._reply_ok(data=zoe_master.backends.interface.image_pulls())
             else:
                 log.error('Unknown command: {}'.format(message['command']))
                 self._reply_error('unknown command')
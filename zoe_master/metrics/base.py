@@ -19,11 +19,13 @@ import time
 import logging
 import threading
 from copy import deepcopy
+from typing import Any, Callable, Dict, List, Tuple, Union
 
 from zoe_lib.config import get_conf
 from zoe_master.backends.interface import get_platform_state
 from zoe_master.metrics.kairosdb import KairosDBInMetrics
 from zoe_master.metrics.influxdb import InfluxDBInMetrics
+from zoe_master.stats import ClusterStats, NodeStats  # pylint: disable=unused-import
 
 log = logging.getLogger(__name__)
 
@@ -33,70 +35,142 @@ def time_diff_ms(start: float, end: float) -> int:
     return int((end - start) * 1000)
 
 
-class StatsManager(threading.Thread):
-    """Class for collecting and sending out metrics and statistics."""
+class MetricsCollector(threading.Thread):
+    """
+    Calls a collection function periodically in its own thread and publishes the last result, with the time it was collected.
+
+    A collection that returns None or raises does not replace the last result, which ages until the next successful one. A collection that takes longer
+    than the deadline is logged, its result is published as old as the time the collection started.
+    """
+
+    def __init__(self, name: str, collect: Callable[[], Any], interval: float, deadline: float) -> None:
+        super().__init__(name='metrics_' + name, daemon=True)
+        self.source = name
+        self.collect = collect
+        self.interval = interval
+        self.deadline = deadline
+        self.stop = threading.Event()
+        self._result = None
+        self._timestamp = None  # type: Union[float, None]
+        self._lock = threading.Lock()
+
+    def latest(self) -> Tuple[Any, Union[float, None]]:
+        """The last result and the time it was collected, (None, None) before the first successful collection."""
+        with self._lock:
+            return self._result, self._timestamp
+
+    def collect_once(self):
+        """Run one collection and publish its result."""
+        time_start = time.time()
+        try:
+            result = self.collect()
+        except Exception:  # pylint: disable=broad-except
+            log.exception('Exception collecting {}'.format(self.source))
+            return
+        duration = time.time() - time_start
+        if duration > self.deadline:
+            log.warning('Collection of {} took {} ms, more than its deadline of {} s'.format(self.source, time_diff_ms(time_start, time.time()), self.deadline))
+        if result is None:
+            return
+        with self._lock:
+            self._result = result
+            self._timestamp = time_start  # the data is as old as the start of the collection
+        log.debug('Collection of {} done in {} ms'.format(self.source, time_diff_ms(time_start, time.time())))
+
+    def run(self):
+        """The thread loop."""
+        while not self.stop.is_set():
+            time_start = time.time()
+            self.collect_once()
+            sleep_time = self.interval - (time.time() - time_start)
+            if sleep_time > 0:
+                self.stop.wait(timeout=sleep_time)
+        log.info('Metrics collector for {} terminated'.format(self.source))
+
+    def quit(self):
+        """Terminates the collector thread."""
+        self.stop.set()
+
+
+class StatsManager:
+    """
+    Class for collecting metrics and statistics.
+
+    The platform state and the usage metrics are collected by independent threads, so a slow metrics DB does not delay the platform state. Snapshots merge
+    the last result of each collector and record in ClusterStats.sources when each one was collected.
+    """
 
     METRIC_INTERVAL = 20
 
     def __init__(self, state):
-        super().__init__(name='metrics', daemon=True)
         self.state = state
         self.deployment_name = get_conf().deployment_name
-        self.stop = threading.Event()
-        self._current_platform_stats = None
+        self.max_age = get_conf().metrics_max_age
         if get_conf().kairosdb_enable:
             self.usage_metrics = KairosDBInMetrics()
         elif get_conf().influxdb_enable:
             self.usage_metrics = InfluxDBInMetrics()
         else:
             self.usage_metrics = None
+        self.collectors = {'platform': MetricsCollector('platform', get_platform_state, self.METRIC_INTERVAL, self.METRIC_INTERVAL)}  # type: Dict[str, MetricsCollector]
+        if self.usage_metrics is not None:
+            self.collectors['usage'] = MetricsCollector('usage', self._collect_usage, self.METRIC_INTERVAL, self.METRIC_INTERVAL)
 
-    def quit(self):
-        """Terminates the sender thread."""
-        self.stop.set()
-        self.join()
-
-    def run(self):
-        """Wraps the loop to catch exceptions"""
-        while True:
-            try:
-                self._real_run()
-            except BaseException:  # pylint: disable=broad-except
-                log.exception("Exception in metrics thread")
-            else:
-                log.info('Metrics thread terminated')
-                break
-
-    def _real_run(self):
-        """The thread loop."""
-        while True:
-            time_start = time.time()
+    def start(self):
+        """Starts the collector threads."""
+        for collector in self.collectors.values():
+            collector.start()
 
-            self._current_platform_stats = get_platform_state()
-            if self.usage_metrics is not None:
-                for node in self._current_platform_stats.nodes:
-                    node_cores = 0
-                    node_memory = 0
-                    for service_id in node.service_stats:
-                        usage = self.usage_metrics.get_service_usage(service_id)
-                        try:
-                            node.service_stats[service_id]['cores_in_use'] = usage['cpu_usage']
-                            node.service_stats[service_id]['memory_in_use'] = usage['mem_usage']
-                        except KeyError:  # happens while a service is being terminated
-                            continue
-                        except TypeError:  # happens while KairosDB cannot be reached
-                            continue
-                        node_cores += usage['cpu_usage']
-                        node_memory += usage['mem_usage']
-
-                    node.cores_in_use = node_cores
-                    node.memory_in_use = node_memory
-
-            sleep_time = self.METRIC_INTERVAL - (time.time() - time_start)
-            if sleep_time > 0 and self.stop.wait(timeout=sleep_time):
-                break
+    def quit(self):
+        """Terminates the collector threads."""
+        for collector in self.collectors.values():
+            collector.quit()
+        for collector in self.collectors.values():
+            if collector.is_alive():
+                collector.join()
+
+    def _collect_usage(self) -> Union[Dict[int, Dict[str, float]], None]:
+        """Query the metrics DB for the usage of the services in the last platform state, with a single query."""
+        platform_state, _ = self.collectors['platform'].latest()
+        if platform_state is None:
+            return None
+        service_ids = [service_id for node in platform_state.nodes for service_id in list(node.service_stats)]
+        if len(service_ids) == 0:
+            return {}
+        return self.usage_metrics.get_services_usage(service_ids)  # None while the metrics DB cannot be reached
+
+    @staticmethod
+    def _apply_usage(nodes: List[NodeStats], usage: Dict[int, Dict[str, float]]):
+        """Fill in the resources in use by each service and node."""
+        for node in nodes:
+            node_cores = 0
+            node_memory = 0
+            for service_id in list(node.service_stats):
+                service_usage = usage.get(service_id)
+                if service_usage is None:
+                    continue
+                try:
+                    node.service_stats[service_id]['cores_in_use'] = service_usage['cpu_usage']
+                    node.service_stats[service_id]['memory_in_use'] = service_usage['mem_usage']
+                except KeyError:  # happens while a service is being terminated
+                    continue
+                node_cores += service_usage['cpu_usage']
+                node_memory += service_usage['mem_usage']
+
+            node.cores_in_use = node_cores
+            node.memory_in_use = node_memory
 
     @property
-    def current_stats(self):
-        """Returns a snapshot of the current metrics."""
-        return deepcopy(self._current_platform_stats)
+    def current_stats(self) -> Union[ClusterStats, None]:
+        """Returns a snapshot of the current metrics, None until the platform state has been collected once."""
+        platform_state, platform_timestamp = self.collectors['platform'].latest()
+        if platform_state is None:
+            return None
+        snapshot = deepcopy(platform_state)
+        snapshot.sources['platform'] = platform_timestamp
+        if 'usage' in self.collectors:
+            usage, usage_timestamp = self.collectors['usage'].latest()
+            if usage is not None:
+                self._apply_usage(snapshot.nodes, usage)
+                snapshot.sources['usage'] = usage_timestamp
+        return snapshot
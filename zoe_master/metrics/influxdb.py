@@ -16,6 +16,7 @@
 """Retrieves metrics about services from InfluxDB."""
 
 import logging
+from typing import Dict, List, Union
 
 import requests
 
@@ -23,46 +24,68 @@ from zoe_lib.config import get_conf
 
 log = logging.getLogger(__name__)
 
+REQUEST_TIMEOUT = (3, 10)  # seconds to connect and to wait for the response
+
+# One series per service: the per-minute means of the last 3 minutes, the most recent first
+QUERY_CPU = 'SELECT mean("usage_percent") / 100 FROM "docker_container_cpu" WHERE "zoe_deployment_name" = {} AND time >= now() - 3m GROUP BY time(1m), "zoe_service_id" ORDER BY time DESC LIMIT 2'
+QUERY_MEM = 'SELECT mean("usage") FROM "docker_container_mem" WHERE "zoe_deployment_name" = {} AND time >= now() - 3m GROUP BY time(1m), "zoe_service_id" ORDER BY time DESC LIMIT 2'
+
+
+def _quote(value: str) -> str:
+    """An InfluxQL string literal."""
+    return "'" + value.replace('\\', '\\\\').replace("'", "\\'") + "'"
+
 
 class InfluxDBInMetrics:
     """InfluxDB metrics."""
     def __init__(self):
         self.base_url = get_conf().influxdb_url
+        self.session = requests.Session()  # keeps the connection to InfluxDB open between queries
+        self.available = True
 
     def get_service_usage(self, service_id):
         """Query the DB for the current usage metrics."""
-        query_cpu = 'SELECT mean("usage_percent") / 100 FROM "docker_container_cpu" WHERE "zoe_service_id" = \'{}\' AND "zoe_deployment_name" = \'{}\' AND time >= now() - 3m GROUP BY time(1m) ORDER BY time DESC LIMIT 2'.format(service_id, get_conf().deployment_name)
-        query_mem = 'SELECT mean("usage") FROM "docker_container_mem" WHERE "zoe_service_id" = \'{}\' AND "zoe_deployment_name" = \'{}\' AND time >= now() - 3m GROUP BY time(1m) ORDER BY time DESC LIMIT 2'.format(service_id, get_conf().deployment_name)
+        usage = self.get_services_usage([service_id])
+        return None if usage is None else usage[service_id]
+
+    def get_services_usage(self, service_ids: List[int]) -> Union[Dict[int, Dict[str, float]], None]:
+        """Query the DB for the current usage metrics of many services with a single request, returns None if InfluxDB cannot be queried."""
+        deployment_name = _quote(get_conf().deployment_name)
+        query = QUERY_CPU.format(deployment_name) + ';' + QUERY_MEM.format(deployment_name)
 
         url = self.base_url + '/query'
-        resp = requests.post(url, data={"db": 'telegraf', 'q': query_cpu + ';' + query_mem})
-        influx_resp = resp.json()
+        try:
+            resp = self.session.post(url, data={"db": 'telegraf', 'q': query}, timeout=REQUEST_TIMEOUT)
+            influx_resp = resp.json()
+        except (requests.exceptions.RequestException, ValueError) as e:
+            self._set_available(False, e)
+            return None
+        self._set_available(True)
         if "error" in influx_resp:
             log.warning("InfluxDB reported an error: {}".format(influx_resp['error']))
             return None
-        return self._extract_data(influx_resp)
-
-    def _extract_data(self, data):
-        ret = {}
-        cpu_results = data['results'][0]
-        assert cpu_results['statement_id'] == 0
-        if 'series' in cpu_results:
-            val = cpu_results['series'][0]['values'][1][1]
-            if val is None:
-                ret['cpu_usage'] = 0
-            else:
-                ret['cpu_usage'] = val
-        else:
-            ret['cpu_usage'] = 0
-
-        mem_results = data['results'][1]
-        assert mem_results['statement_id'] == 1
-        if 'series' in mem_results:
-            val = mem_results['series'][0]['values'][1][1]
-            if val is None:
-                ret['mem_usage'] = 0
-            else:
-                ret['mem_usage'] = val
-        else:
-            ret['mem_usage'] = 0
-        return ret
+        return self._extract_data(influx_resp, service_ids)
+
+    def _set_available(self, available, error=None):
+        if not available and self.available:
+            log.warning('Cannot query InfluxDB: {}'.format(error))
+        self.available = available
+
+    def _extract_data(self, data, service_ids):
+        usage = {service_id: {'cpu_usage': 0, 'mem_usage': 0} for service_id in service_ids}
+        ids_by_tag = {str(service_id): service_id for service_id in service_ids}
+        for statement_id, key in enumerate(('cpu_usage', 'mem_usage')):
+            results = data['results'][statement_id]
+            assert results['statement_id'] == statement_id
+            if 'error' in results:
+                log.warning("InfluxDB reported an error: {}".format(results['error']))
+                return None
+            for series in results.get('series', []):
+                service_tag = series.get('tags', {}).get('zoe_service_id')
+                if service_tag not in ids_by_tag:
+                    continue
+                values = series['values']
+                val = values[1][1] if len(values) > 1 else values[0][1]  # the first value is the mean of the minute in progress
+                if val is not None:
+                    usage[ids_by_tag[service_tag]][key] = val
+        return usage
@@ -17,6 +17,7 @@
 
 from datetime import datetime, timedelta
 import logging
+from typing import Dict, List, Union
 
 import requests
 
@@ -24,6 +25,9 @@ from zoe_lib.config import get_conf
 
 log = logging.getLogger(__name__)
 
+QUERY_RANGE = 2  # minutes of data points to look at, only the sum over the last minute of each service is used
+REQUEST_TIMEOUT = (3, 10)  # seconds to connect and to wait for the response
+
 
 class KairosDBInMetrics:
     """KairosDB metrics."""
@@ -34,6 +38,9 @@ class KairosDBInMetrics:
         self.metrics_url = self.base_url + '/api/v1/datapoints/query'
         self.list_metrics_url = self.base_url + '/api/v1/metricnames'
 
+        self.session = requests.Session()  # keeps the connection to KairosDB open between queries
+        self.available = True
+
     def _prepare_query(self):
         query = {
             'time_zone': 'UTC',
@@ -48,10 +55,12 @@ class KairosDBInMetrics:
         query['start_absolute'] = int(start.timestamp() * 1000)
         query['end_absolute'] = int(end.timestamp() * 1000)
 
-    def _add_metric(self, query, metric_name: str, tags, aggregators, limit: int):
+    def _add_metric(self, query, metric_name: str, tags, aggregators, limit: int, group_by=None):
         metric = {
             'name': metric_name,
         }
+        if group_by is not None:
+            metric['group_by'] = group_by
         if tags is not None:
             metric['tags'] = tags
         if aggregators is not None:
@@ -62,61 +71,68 @@ class KairosDBInMetrics:
 
     def get_service_usage(self, service_id):
         """Query the DB for the current usage metrics."""
+        usage = self.get_services_usage([service_id])
+        return None if usage is None else usage[service_id]
+
+    def get_services_usage(self, service_ids: List[int]) -> Union[Dict[int, Dict[str, float]], None]:
+        """Query the DB for the current usage metrics of many services with a single request, returns None if KairosDB cannot be queried."""
         query = self._prepare_query()
+        self._add_time_range(query, minutes_from_now=QUERY_RANGE)
+        group_by = [{"name": "tag", "tags": ["zoe_service_id"]}]
+        service_tags = [str(service_id) for service_id in service_ids]
 
         tags_cpu = {
             "field": ["usage_percent"],
-            "zoe_service_id": service_id
+            "zoe_service_id": service_tags
         }
         aggregators_cpu = [
             {"name": "scale", "factor": "0.01"},
             {"name": "sum", "sampling": {"value": "1", "unit": "minutes"}, "align_sampling": False}
         ]
-        self._add_metric(query, "docker_container_cpu", tags_cpu, aggregators_cpu, limit=0)
+        self._add_metric(query, "docker_container_cpu", tags_cpu, aggregators_cpu, limit=0, group_by=group_by)
 
         tags_memory = {
             "field": ["usage"],
-            "zoe_service_id": service_id
+            "zoe_service_id": service_tags
         }
-
         aggregators_memory = [
             {"name": "sum", "sampling": {"value": "1", "unit": "minutes"}, "align_sampling": False}
         ]
-        self._add_metric(query, "docker_container_mem", tags_memory, aggregators_memory, limit=0)
+        self._add_metric(query, "docker_container_mem", tags_memory, aggregators_memory, limit=0, group_by=group_by)
 
         try:
-            req = requests.post(self.metrics_url, json=query)
-        except requests.exceptions.ConnectionError:
+            req = self.session.post(self.metrics_url, json=query, timeout=REQUEST_TIMEOUT)
+        except requests.exceptions.RequestException as e:
+            self._set_available(False, e)
             return None
-        return self._extract_data(req)
+        self._set_available(True)
+        return self._extract_data(req, service_ids)
 
-    def _extract_data(self, response):
-        if response is None:
-            return None
+    def _set_available(self, available, error=None):
+        if not available and self.available:
+            log.warning('Cannot query KairosDB: {}'.format(error))
+        self.available = available
+
+    def _extract_data(self, response, service_ids):
         if response.status_code != 200:
+            try:
+                errors = response.json()['errors']
+            except (ValueError, KeyError, TypeError):  # not a KairosDB response, for example an error page from a proxy
+                errors = ['HTTP status {}'.format(response.status_code)]
             error_msg = ''
-            for error in response.json()['errors']:
+            for error in errors:
                 error_msg += ' {}'.format(error)
             log.error('kairosdb query error: {}'.format(error_msg))
             return None
-        else:
-            data = response.json()
-            cpu_results = data['queries'][0]
-            mem_results = data['queries'][1]
-
-            if cpu_results['sample_size'] > 0:
-                assert len(cpu_results['results']) == 1
-                cpu_usage = cpu_results['results'][0]['values'][-1][1]
-            else:
-                cpu_usage = 0
-
-            if mem_results['sample_size'] > 0:
-                assert len(mem_results['results']) == 1
-                mem_usage = mem_results['results'][0]['values'][-1][1]
-            else:
-                mem_usage = 0
-
-            return {
-                'cpu_usage': cpu_usage,
-                'mem_usage': mem_usage
-            }
+
+        usage = {service_id: {'cpu_usage': 0, 'mem_usage': 0} for service_id in service_ids}
+        ids_by_tag = {str(service_id): service_id for service_id in service_ids}
+        data = response.json()
+        for query_results, key in zip(data['queries'], ('cpu_usage', 'mem_usage')):
+            for result in query_results['results']:
+                if len(result['values']) == 0:
+                    continue
+                for service_tag in result['tags'].get('zoe_service_id', []):
+                    if service_tag in ids_by_tag:
+                        usage[ids_by_tag[service_tag]][key] = result['values'][-1][1]
+        return usage
@@ -0,0 +1,80 @@
+# Copyright (c) 2017, Daniele Venzano
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for the metrics collectors."""
+
+import time
+
+from zoe_lib.config import load_configuration
+from zoe_master.metrics import base
+from zoe_master.stats import ClusterStats, NodeStats
+from zoe_lib.tests.config_mock import zoe_configuration  # pylint: disable=unused-import
+
+
+class MockUsageMetrics:
+    """A metrics DB that can be made unreachable."""
+    available = True
+
+    def get_services_usage(self, service_ids):
+        """Every service uses one core and 1 KB of memory."""
+        if not self.available:
+            return None
+        return {service_id: {'cpu_usage': 1, 'mem_usage': 1024} for service_id in service_ids}
+
+
+def _platform_state():
+    state = ClusterStats()
+    node = NodeStats('node-1')
+    node.service_stats = {1: {}, 2: {}}
+    state.nodes.append(node)
+    return state
+
+
+class TestStatsManager:
+    """Metrics collectors testing."""
+
+    def test_snapshot_sources(self, zoe_configuration, monkeypatch):  # pylint: disable=redefined-outer-name
+        """Test that snapshots merge the last result of each collector and record when each one was collected."""
+        zoe_configuration.kairosdb_enable = True
+        zoe_configuration.kairosdb_url = 'http://localhost:8090'
+        load_configuration(zoe_configuration)
+        monkeypatch.setattr(base, 'get_platform_state', _platform_state)
+        manager = base.StatsManager(None)
+        manager.usage_metrics = MockUsageMetrics()
+        assert manager.current_stats is None
+
+        manager.collectors['usage'].collect_once()  # no platform state yet, nothing to query
+        manager.collectors['platform'].collect_once()
+        stats = manager.current_stats
+        assert stats.is_fresh('platform', 60)
+        assert 'usage' not in stats.sources
+        assert stats.nodes[0].cores_in_use == 0
+
+        manager.collectors['usage'].collect_once()
+        stats = manager.current_stats
+        assert stats.nodes[0].cores_in_use == 2
+        assert stats.nodes[0].service_stats[1]['memory_in_use'] == 1024
+        usage_time = stats.sources['usage']
+
+        manager.usage_metrics.available = False
+        time.sleep(0.01)
+        manager.collectors['usage'].collect_once()
+        manager.collectors['platform'].collect_once()
+        stats = manager.current_stats
+        assert stats.sources['usage'] == usage_time  # the last usage is kept, with its age
+        assert stats.sources['platform'] > usage_time
+        assert stats.nodes[0].cores_in_use == 2
+        assert not stats.is_fresh('usage', 0)
+        assert 'sources' in stats.serialize()
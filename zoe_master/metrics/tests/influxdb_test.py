@@ -0,0 +1,57 @@
+# Copyright (c) 2017, Daniele Venzano
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for the InfluxDB metrics input."""
+
+from zoe_lib.config import load_configuration
+from zoe_master.metrics.influxdb import InfluxDBInMetrics
+from zoe_lib.tests.config_mock import zoe_configuration  # pylint: disable=unused-import
+
+
+class MockResponse:
+    """An InfluxDB response with one series per service and statement, service 3 has no data points."""
+
+    def json(self):
+        """Fake per-minute means, the values of the last complete minute are the service IDs."""
+        results = []
+        for statement_id in range(2):
+            series = [{'name': 'docker_container', 'tags': {'zoe_service_id': str(service_id)}, 'columns': ['time', 'mean'],
+                       'values': [['2018-01-01T00:02:00Z', 0], ['2018-01-01T00:01:00Z', service_id * 10]]} for service_id in (1, 2, 4)]
+            results.append({'statement_id': statement_id, 'series': series})
+        return {'results': results}
+
+
+class TestInfluxDBInMetrics:
+    """InfluxDB metrics testing."""
+
+    def test_bulk_query(self, zoe_configuration, monkeypatch):  # pylint: disable=redefined-outer-name
+        """Test that the usage of many services is retrieved with one request, grouped by service."""
+        zoe_configuration.influxdb_url = 'http://localhost:8086'
+        zoe_configuration.deployment_name = "o'test"
+        load_configuration(zoe_configuration)
+        metrics = InfluxDBInMetrics()
+        requests_sent = []
+
+        def post(url, data, timeout):  # pylint: disable=unused-argument
+            """Record the query."""
+            requests_sent.append(data['q'])
+            return MockResponse()
+        monkeypatch.setattr(metrics.session, 'post', post)
+
+        usage = metrics.get_services_usage([1, 2, 3])
+        assert len(requests_sent) == 1
+        assert 'GROUP BY time(1m), "zoe_service_id"' in requests_sent[0]
+        assert "\"zoe_deployment_name\" = 'o\\'test'" in requests_sent[0]
+        assert usage == {1: {'cpu_usage': 10, 'mem_usage': 10}, 2: {'cpu_usage': 20, 'mem_usage': 20}, 3: {'cpu_usage': 0, 'mem_usage': 0}}
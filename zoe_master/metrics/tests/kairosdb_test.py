@@ -0,0 +1,79 @@
+# Copyright (c) 2017, Daniele Venzano
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for the KairosDB metrics input."""
+
+import requests
+
+from zoe_lib.config import load_configuration
+from zoe_master.metrics.kairosdb import KairosDBInMetrics
+from zoe_lib.tests.config_mock import zoe_configuration  # pylint: disable=unused-import
+
+
+class MockResponse:
+    """A KairosDB response with one result per service and metric."""
+    status_code = 200
+
+    def __init__(self, query):
+        self.query = query
+
+    def json(self):
+        """Fake data points, the values are the service IDs."""
+        queries = []
+        for metric in self.query['metrics']:
+            results = [{'tags': {'zoe_service_id': [tag]}, 'values': [[1, 0], [2, int(tag) * 10]]} for tag in metric['tags']['zoe_service_id'] if tag != '3']
+            queries.append({'sample_size': len(results), 'results': results})
+        return {'queries': queries}
+
+
+class MockProxyError:
+    """An error page from a proxy in front of KairosDB."""
+    status_code = 502
+
+    def json(self):
+        """The body is HTML."""
+        raise ValueError('Expecting value: line 1 column 1 (char 0)')
+
+
+class TestKairosDBInMetrics:
+    """KairosDB metrics testing."""
+
+    def test_bulk_query(self, zoe_configuration, monkeypatch):  # pylint: disable=redefined-outer-name
+        """Test that the usage of many services is retrieved with one request, grouped by service."""
+        zoe_configuration.kairosdb_url = 'http://localhost:8090'
+        load_configuration(zoe_configuration)
+        metrics = KairosDBInMetrics()
+        requests_sent = []
+
+        def post(url, json, timeout):  # pylint: disable=unused-argument
+            """Record the query."""
+            requests_sent.append(json)
+            return MockResponse(json)
+        monkeypatch.setattr(metrics.session, 'post', post)
+
+        usage = metrics.get_services_usage([1, 2, 3])
+        assert len(requests_sent) == 1
+        assert requests_sent[0]['metrics'][0]['group_by'] == [{'name': 'tag', 'tags': ['zoe_service_id']}]
+        assert requests_sent[0]['metrics'][0]['aggregators'][-1]['name'] == 'sum'
+        assert usage == {1: {'cpu_usage': 10, 'mem_usage': 10}, 2: {'cpu_usage': 20, 'mem_usage': 20}, 3: {'cpu_usage': 0, 'mem_usage': 0}}
+
+        def unreachable(url, json, timeout):  # pylint: disable=unused-argument
+            """KairosDB is down."""
+            raise requests.exceptions.ConnectionError('refused')
+        monkeypatch.setattr(metrics.session, 'post', unreachable)
+        assert metrics.get_services_usage([1]) is None
+
+        monkeypatch.setattr(metrics.session, 'post', lambda url, json, timeout: MockProxyError())
+        assert metrics.get_services_usage([1]) is None
@@ -22,24 +22,17 @@ import shutil
 from zoe_lib.state import Execution, SQLManager
 from zoe_lib.config import get_conf
 from zoe_master.scheduler import ZoeBaseScheduler
-from zoe_master.backends.interface import terminate_execution, node_list, list_available_images
+from zoe_master.backends.interface import terminate_execution, image_nodes, backend_names
+from zoe_master.backends.registry import IMAGE_INDEX_BACKENDS
 
 log = logging.getLogger(__name__)
 
 
 def _digest_application_description(state: SQLManager, execution: Execution):
     """Read an application description and expand it into services that can be deployed."""
-    if get_conf().backend == 'DockerEngine':
-        nodes = node_list()
-        images = []
-        for node in nodes:
-            images += list_available_images(node)
-
-        images = [name for image in images for name in image['names']]
-        if len(images) == 0:
-            log.warning('The image list reported by the back-end is empty')
+    if any(name in IMAGE_INDEX_BACKENDS for name in backend_names()):
         for service_descr in execution.description['services']:
-            if service_descr['image'] not in images:
+            if len(image_nodes(service_descr['image'])) == 0:
                 execution.set_error()
                 execution.set_error_message('image {} is not available'.format(service_descr['image']))
                 return False
@@ -0,0 +1,63 @@
+# Copyright (c) 2017, Daniele Venzano
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Enforcement of the run time limit set in the user quotas."""
+
+import datetime
+import logging
+import threading
+
+from zoe_lib.state import SQLManager
+from zoe_master.preprocessing import execution_terminate
+from zoe_master.scheduler import ZoeBaseScheduler
+
+log = logging.getLogger(__name__)
+
+
+class RuntimeLimitEnforcer(threading.Thread):
+    """Terminates the executions that have passed the deadline computed from their owner's quota."""
+
+    CHECK_INTERVAL = 60
+
+    def __init__(self, state: SQLManager, scheduler: ZoeBaseScheduler):
+        super().__init__(name='runtime_limit', daemon=True)
+        self.state = state
+        self.scheduler = scheduler
+        self.stop = threading.Event()
+
+    def quit(self):
+        """Terminates the enforcer thread."""
+        self.stop.set()
+        self.join()
+
+    def run(self):
+        """The thread loop."""
+        while not self.stop.wait(timeout=self.CHECK_INTERVAL):
+            try:
+                self.check()
+            except Exception:  # pylint: disable=broad-except
+                log.exception('Error while enforcing the run time limits')
+
+    def check(self):
+        """Terminate the overdue executions, returns how many were found."""
+        overdue = self.state.executions.select_overdue(datetime.datetime.utcnow())
+        for execution in overdue:
+            if execution.status == execution.STARTING_STATUS or execution.status == execution.IMAGE_DL_STATUS:
+                # It is unsafe to terminate while the services are being created, it is done at the first check after the start
+                log.debug('Execution {} has exceeded the run time limit, it will be terminated once started'.format(execution.id))
+                continue
+            log.info('Automatically terminating execution {} that has exceeded the run time limit'.format(execution.id))
+            execution_terminate(self.scheduler, execution, 'Run time quota exceeded')
+        return len(overdue)
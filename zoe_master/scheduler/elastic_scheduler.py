@@ -22,10 +22,10 @@ import logging
 import threading
 import time
 
+from zoe_lib.config import get_conf
 from zoe_lib.state import Execution, SQLManager, Service  # pylint: disable=unused-import
-from zoe_master.exceptions import ZoeException
 
-from zoe_master.backends.interface import terminate_execution, terminate_service, start_elastic, start_essential, update_service_resource_limits
+from zoe_master.backends.interface import terminate_execution, terminate_service, start_elastic, start_essential, update_service_resource_limits, prefetch_images
 from zoe_master.scheduler.simulated_platform import SimulatedPlatform
 from zoe_master.exceptions import UnsupportedSchedulerPolicyError
 from zoe_master.stats import NodeStats  # pylint: disable=unused-import
@@ -197,10 +197,9 @@ class ZoeElasticScheduler:
                 for job in jobs_to_attempt_scheduling:
                     log.debug("-> {} ({})".format(job, job.size))
 
-                try:
-                    platform_state = self.metrics.current_stats
-                except ZoeException:
-                    log.error('Cannot retrieve platform state, cannot schedule')
+                platform_state = self.metrics.current_stats
+                if platform_state is None or not platform_state.is_fresh('platform', get_conf().metrics_max_age):
+                    log.error('Cannot retrieve an up to date platform state, cannot schedule')
                     for job in jobs_to_attempt_scheduling:
                         self._requeue(job)
                     break
@@ -235,6 +234,14 @@ class ZoeElasticScheduler:
                         break
                     free_resources = current_free_resources
 
+                if get_conf().image_prefetch:
+                    for job in jobs_to_attempt_scheduling:
+                        if job not in jobs_to_launch:
+                            plan = cluster_status_snapshot.image_prefetch_plan(job)
+                            if len(plan) > 0:
+                                log.debug('Prefetching images for execution {}: {}'.format(job.id, plan))
+                                prefetch_images(plan)
+
                 placements = cluster_status_snapshot.get_service_allocation()
                 log.info('Allocation after simulation: {}'.format(placements))
 
@@ -306,6 +313,8 @@ class ZoeElasticScheduler:
             if self.loop_quit:
                 break
             stats = self.metrics.current_stats
+            if stats is None:
+                continue
             for node in stats.nodes:  # type: NodeStats
                 new_core_allocations = {}
                 node_services = self.state.services.select(backend_host=node.name, backend_status=Service.BACKEND_START_STATUS)
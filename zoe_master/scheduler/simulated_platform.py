@@ -2,12 +2,13 @@
 
 import logging
 import random
-from typing import List
+from typing import Dict, List, Set
 
 from zoe_lib.state import Execution, Service
 from zoe_lib.config import get_conf
 from zoe_master.stats import ClusterStats, NodeStats
 from zoe_master.backends.interface import list_available_images
+from zoe_master.backends.registry import IMAGE_INDEX_BACKENDS
 
 
 log = logging.getLogger(__name__)
@@ -27,18 +28,19 @@ class SimulatedNode:
         self.real_active_containers = real_node.container_count
         self.services = []
         self.name = real_node.name
+        self.backend = real_node.backend
         self.labels = real_node.labels
         self.images = list_available_images(self.name)
         log.debug('Node {}: m {:.2f}GB | c {} | l {} | ncont {}'.format(self.name, self.node_free_memory() / (1024 ** 3), self.node_free_cores(), list(self.labels), self.container_count))
 
-    def service_fits(self, service: Service) -> bool:
+    def service_fits(self, service: Service, check_image=True) -> bool:
         """Checks whether a service can fit in this node"""
         if 'disabled' in self.labels:
             return False
         ret = set(service.labels).issubset(self.labels)
         ret = ret and service.resource_reservation.memory.min < self.node_free_memory()
         ret = ret and service.resource_reservation.cores.min <= self.node_free_cores()
-        ret = ret and self._image_is_available(service.image_name)
+        ret = ret and (not check_image or self._image_is_available(service.image_name))
         return ret
 
     def service_why_unfit(self, service) -> str:
@@ -57,12 +59,9 @@ class SimulatedNode:
             return 'unknown reason'
 
     def _image_is_available(self, image_name) -> bool:
-        if get_conf().backend != 'DockerEngine':
+        if self.backend not in IMAGE_INDEX_BACKENDS:
             return True
-        for image in self.images:
-            if image_name in image['names']:
-                return True
-        return False
+        return image_name in self.images
 
     def service_add(self, service):
         """Add a service in this node."""
@@ -118,6 +117,33 @@ class SimulatedPlatform:
         for node in platform_status.nodes:
             if node.status == 'online':
                 self.nodes[node.name] = SimulatedNode(node)
+        self.federated = len({node.backend for node in self.nodes.values()}) > 1
+
+    def _execution_backend(self, execution: Execution):
+        """The back-end where the execution already has services, in the real or in the simulated platform, the services of an execution cannot be split across back-ends."""
+        if not self.federated:
+            return None
+        for service in execution.services:
+            if service.status == service.ACTIVE_STATUS and service.backend_host in self.nodes:
+                return self.nodes[service.backend_host].backend
+        for node in self.nodes.values():
+            if any(service.execution_id == execution.id for service in node.services):
+                return node.backend
+        return None
+
+    def _candidate_nodes(self, execution: Execution, service: Service):
+        candidate_nodes = []
+        reasons = ''
+        backend = self._execution_backend(execution)
+        for node_id_, node in self.nodes.items():
+            if backend is not None and node.backend != backend:
+                reasons += 'node {}: execution runs on back-end {} ## '.format(node.name, backend)
+            elif node.service_fits(service):
+                candidate_nodes.append(node)
+            else:
+                reasons += 'node {}: {} ## '.format(node.name, node.service_why_unfit(service))
+                log.debug('node rejected: {}'.format(node.service_why_unfit(service)))
+        return candidate_nodes, reasons
 
     def _select_node_policy(self, node_list: List[SimulatedNode]) -> SimulatedNode:
         if get_conf().placement_policy == "random":
@@ -139,14 +165,7 @@ class SimulatedPlatform:
     def allocate_essential(self, execution: Execution) -> bool:
         """Try to find an allocation for essential services"""
         for service in execution.essential_services:
-            candidate_nodes = []
-            reasons = ''
-            for node_id_, node in self.nodes.items():
-                if node.service_fits(service):
-                    candidate_nodes.append(node)
-                else:
-                    reasons += 'node {}: {} ## '.format(node.name, node.service_why_unfit(service))
-                    log.debug('node rejected: {}'.format(node.service_why_unfit(service)))
+            candidate_nodes, reasons = self._candidate_nodes(execution, service)
             if len(candidate_nodes) == 0:  # this service does not fit anywhere
                 self.deallocate_essential(execution)
                 log.info('Cannot fit essential service {} anywhere, reasons: {}'.format(service.id, reasons))
@@ -156,6 +175,19 @@ class SimulatedPlatform:
             selected_node.service_add(service)
         return True
 
+    def image_prefetch_plan(self, execution: Execution) -> Dict[str, Set[str]]:
+        """For the services that do not fit anywhere only because of their image, find the nodes the placement policy would pick if the image was there."""
+        plan = {}
+        for service in execution.services:
+            if service.status == service.ACTIVE_STATUS or any(node.service_fits(service) for node in self.nodes.values()):
+                continue
+            candidate_nodes = [node for node in self.nodes.values() if node.service_fits(service, check_image=False)]
+            if len(candidate_nodes) == 0:
+                continue
+            selected_node = self._select_node_policy(candidate_nodes)
+            plan.setdefault(service.image_name, set()).add(selected_node.name)
+        return plan
+
     def deallocate_essential(self, execution: Execution):
         """Remove all essential services from the simulated cluster"""
         for service in execution.essential_services:
@@ -169,13 +201,7 @@ class SimulatedPlatform:
         for service in execution.elastic_services:
             if service.status == service.ACTIVE_STATUS and service.backend_status != service.BACKEND_DIE_STATUS:
                 continue
-            candidate_nodes = []
-            reasons = ''
-            for node_id_, node in self.nodes.items():
-                if node.service_fits(service):
-                    candidate_nodes.append(node)
-                else:
-                    reasons += 'node {}: {} ## '.format(node.name, node.service_why_unfit(service))
+            candidate_nodes, reasons = self._candidate_nodes(execution, service)
             if len(candidate_nodes) == 0:  # this service does not fit anywhere
                 log.info('Cannot fit elastic service {} anywhere, reasons: {}'.format(service.id, reasons))
                 continue
@@ -16,6 +16,9 @@
 """This module contains classes for statistics on various entities in the Zoe master."""
 
 import time
+from typing import Dict
+
+from zoe_master.backends.common import normalize_image_name
 
 
 class Stats:
@@ -27,6 +30,35 @@ class Stats:
         self.timestamp = time.time()
 
 
+class ImageIndex:
+    """The images available on a node, indexed by their normalized names and repository digests."""
+    def __init__(self):
+        self.images = []
+        self.digests = {}
+
+    def update(self, images) -> bool:
+        """Replace the content of the index, returns True if any name has appeared, disappeared or now points to a different image."""
+        digests = {}
+        for image in images:
+            for name in image['names'] + image['digests']:
+                digests[normalize_image_name(name)] = image['id']
+        if digests == self.digests:
+            return False
+        self.images = images
+        self.digests = digests
+        return True
+
+    def __contains__(self, image_name):
+        return normalize_image_name(image_name) in self.digests
+
+    def __len__(self):
+        return len(self.images)
+
+    def serialize(self):
+        """Convert the object into a list."""
+        return self.images
+
+
 class NodeStats(Stats):
     """Stats related to a single node."""
     def __init__(self, name):
@@ -44,8 +76,9 @@ class NodeStats(Stats):
         self.labels = []
         self.status = 'offline'
         self.service_stats = {}
-        self.images = []
+        self.images = ImageIndex()
         self.valid = False
+        self.backend = None
 
     def serialize(self):
         """Convert the object into a dict."""
@@ -63,16 +96,31 @@ class NodeStats(Stats):
             'labels': list(self.labels),
             'status': self.status,
             'service_stats': self.service_stats,
-            'images': self.images
+            'images': self.images.serialize(),
+            'backend': self.backend
         }
         return ret
 
 
 class ClusterStats(Stats):
-    """Stats related to the whole cluster."""
+    """Stats related to the whole cluster.
+
+    The sources dictionary records when each source of data (the platform state, the usage metrics) merged into this snapshot was collected.
+    """
     def __init__(self):
         super().__init__()
         self.nodes = []
+        self.sources = {}  # type: Dict[str, float]
+
+    def source_age(self, source: str) -> float:
+        """Seconds since the data from a source was collected, infinite if the snapshot has no data from it."""
+        if source not in self.sources:
+            return float('inf')
+        return time.time() - self.sources[source]
+
+    def is_fresh(self, source: str, max_age: float) -> bool:
+        """True if the data from a source is not older than max_age seconds."""
+        return self.source_age(source) <= max_age
 
     def serialize(self):
         """Convert the object into a dict."""
@@ -84,7 +132,8 @@ class ClusterStats(Stats):
             'cores_reserved': sum([n.cores_reserved for n in self.nodes]),
             'memory_in_use': sum([n.memory_in_use for n in self.nodes]),
             'cores_in_use': sum([n.cores_in_use for n in self.nodes]),
-            'nodes': [x.serialize() for x in self.nodes]
+            'nodes': [x.serialize() for x in self.nodes],
+            'sources': dict(self.sources)
         }
 
     @property
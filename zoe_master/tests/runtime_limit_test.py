@@ -0,0 +1,48 @@
+# Copyright (c) 2017, Daniele Venzano
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for the run time limit enforcement."""
+
+from argparse import Namespace
+
+from zoe_lib.state import Execution
+from zoe_master import runtime_limit
+
+
+class MockExecutionTable:
+    """Returns the same overdue executions at every check."""
+    def __init__(self, overdue):
+        self.overdue = overdue
+
+    def select_overdue(self, now):  # pylint: disable=unused-argument
+        """The executions given at creation."""
+        return self.overdue
+
+
+def _execution(execution_id, status):
+    return Namespace(id=execution_id, status=status, STARTING_STATUS=Execution.STARTING_STATUS, IMAGE_DL_STATUS=Execution.IMAGE_DL_STATUS)
+
+
+class TestRuntimeLimitEnforcer:
+    """Test the RuntimeLimitEnforcer class."""
+
+    def test_check(self, monkeypatch):
+        """Overdue executions are terminated, unless their services are being started."""
+        terminated = []
+        monkeypatch.setattr(runtime_limit, 'execution_terminate', lambda scheduler, execution, reason: terminated.append((execution.id, reason)))
+        overdue = [_execution(1, 'running'), _execution(2, 'starting'), _execution(3, 'queued'), _execution(4, 'image download'), _execution(5, 'submitted')]
+        enforcer = runtime_limit.RuntimeLimitEnforcer(Namespace(executions=MockExecutionTable(overdue)), None)
+        assert enforcer.check() == 5
+        assert terminated == [(1, 'Run time quota exceeded'), (3, 'Run time quota exceeded'), (5, 'Run time quota exceeded')]